@@ -47,6 +47,8 @@ function formatStatusDisplay(status) {
 // Global variables
 let selectedOrder = null;
 let selectedStatus = null;
+// Multi-select: order_id -> status saat dipilih, untuk pindah tahap sekaligus
+const selectedOrders = new Map();
 let currentTab = 'active';
 
 // Store for cancelled items grouped by order_id
@@ -726,6 +728,53 @@ async function syncUpdate(orderId, status, reason = "") {
   }
 }
 
+function toggleOrderSelection(orderId, status, checked) {
+  if (checked) {
+    selectedOrders.set(orderId, status);
+  } else {
+    selectedOrders.delete(orderId);
+  }
+  updateBatchActionBar();
+}
+
+function clearOrderSelection() {
+  selectedOrders.clear();
+  document.querySelectorAll('.order-select').forEach(cb => { cb.checked = false; });
+  updateBatchActionBar();
+}
+
+function updateBatchActionBar() {
+  const bar = document.getElementById("batch-action-bar");
+  if (!bar) return;
+  bar.classList.toggle("hidden", selectedOrders.size === 0);
+  document.getElementById("batch-selected-count").textContent = `${selectedOrders.size} pesanan dipilih`;
+}
+
+// Pindahkan semua order terpilih ke tahap berikutnya dalam satu request
+async function advanceSelectedOrders() {
+  const updates = [...selectedOrders.entries()]
+    .filter(([, status]) => statusFlow[status])
+    .map(([orderId, status]) => ({ order_id: orderId, status: statusFlow[status] }));
+  if (updates.length === 0) return;
+  try {
+    const res = await fetch("/kitchen/update_status/batch", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ updates })
+    });
+    if (!res.ok) {
+      const data = await res.json().catch(() => ({}));
+      throw new Error(data.detail || data.error || res.statusText);
+    }
+    document.getElementById("sound-status-update").play().catch(() => {});
+    updates.forEach(u => logHistory(u.order_id, u.status));
+    clearOrderSelection();
+    fetchOrders();
+  } catch (err) {
+    showErrorModal(`Gagal update status pesanan terpilih: ${err.message}`);
+  }
+}
+
 function logHistory(orderId, status, reason = "") {
   console.log(`[LOG] Order ${orderId} → Status: ${status} ${reason ? "| Alasan: " + reason : ""}`);
 }
@@ -843,6 +892,7 @@ function createOrderCard(order) {
 
   card.innerHTML = `
     <div class="order-header">
+      ${statusFlow[order.status] ? `<input type="checkbox" class="order-select" title="Pilih untuk update sekaligus" ${selectedOrders.has(order.order_id) ? 'checked' : ''} onclick="event.stopPropagation(); toggleOrderSelection('${order.order_id}', '${order.status}', this.checked)">` : ''}
       <span class="order-number">${queueNumber ? `#${queueNumber}` : ''}</span>
       <span class="customer-name">${order.customer_name ?? 'John Doe'}</span>
   ${["receive", "making"].includes(order.status) ? `<button class="order-close" onclick=\"event.stopPropagation(); openConfirmModal('${order.order_id}', 'cancelled')\">&times;</button>` : ""}
@@ -881,6 +931,17 @@ function renderOrders(orders) {
   
   // Validate and filter orders
   const validOrders = orders.filter(order => order && order.order_id && order.detail);
+
+  // Buang pilihan yang sudah tidak aktif, dan ikuti status terbaru (mis. diubah tablet lain)
+  const activeStatusById = new Map(validOrders.filter(o => statusFlow[o.status]).map(o => [o.order_id, o.status]));
+  [...selectedOrders.keys()].forEach(id => {
+    if (activeStatusById.has(id)) {
+      selectedOrders.set(id, activeStatusById.get(id));
+    } else {
+      selectedOrders.delete(id);
+    }
+  });
+  updateBatchActionBar();
   
   // Sort orders by time received (FIFO)
   validOrders.sort((a, b) => new Date(a.time_receive) - new Date(b.time_receive));
@@ -1075,6 +1136,34 @@ function updateSummary(orders) {
   window._orderIdToQueue = orderIdToQueue;
 }
 
+// Board lokal untuk fetch inkremental: hanya order yang berubah sejak boardVersion yang diambil
+const boardOrders = new Map();
+let boardVersion = 0;
+let boardDay = null;
+
+async function loadBoard() {
+  // Ganti hari tidak menghasilkan tombstone di server, jadi mulai ulang dari board lengkap
+  const today = new Date().toDateString();
+  if (boardDay !== today) {
+    boardVersion = 0;
+    boardDay = today;
+  }
+  const res = await fetch(`/kitchen/orders?since=${boardVersion}`);
+  if (!res.ok) {
+    throw new Error('Network response was not ok');
+  }
+  const data = await res.json();
+  // Respons lama yang datang terlambat (fetch paralel) tidak boleh menimpa data lebih baru
+  if (!data.full && data.version < boardVersion) {
+    return [...boardOrders.values()];
+  }
+  if (data.full) boardOrders.clear();
+  (data.removed || []).forEach(id => boardOrders.delete(id));
+  (data.orders || []).forEach(order => boardOrders.set(order.order_id, order));
+  boardVersion = data.version;
+  return [...boardOrders.values()];
+}
+
 function fetchOrders() {
   // Show loading state
   document.getElementById('offline-banner').classList.add('hidden');
@@ -1084,13 +1173,7 @@ function fetchOrders() {
     return;
   }
   
-      fetch("/kitchen/orders")
-    .then(res => {
-      if (!res.ok) {
-        throw new Error('Network response was not ok');
-      }
-      return res.json();
-    })
+  loadBoard()
     .then(data => {
   renderOrders(data);
     })
@@ -1169,8 +1252,7 @@ function startOrderPolling() {
   if (pollingInterval) return;
   pollingInterval = setInterval(async () => {
     try {
-      const res = await fetch("/kitchen/orders");
-      const orders = await res.json();
+      const orders = await loadBoard();
       renderOrders(orders);
 
       if (orders && orders.length > 0) {
@@ -1195,13 +1277,20 @@ function stopOrderPolling() {
 function initializeEventSource() {
   const eventSource = new EventSource("/stream/orders");
   let updateTimeout = null;
+  let lastSeq = null;
   
-  eventSource.onmessage = () => {
+  eventSource.onmessage = (event) => {
+    // Snapshot tanpa celah seq berarti board ini sudah up to date (setiap delta memicu refetch)
+    try {
+      const message = JSON.parse(event.data);
+      const inSync = message.type === 'snapshot' && (lastSeq === null || message.seq === lastSeq);
+      lastSeq = message.seq;
+      if (inSync) return;
+    } catch (e) {}
     if (updateTimeout) clearTimeout(updateTimeout);
     updateTimeout = setTimeout(async () => {
       try {
-        const res = await fetch("/kitchen/orders");
-        const data = await res.json();
+        const data = await loadBoard();
         
         // Check for new orders
         const activeIds = data.filter(o => ["receive", "making", "deliver"].includes(o.status)).map(o => o.order_id);
@@ -1229,8 +1318,11 @@ function initializeEventSource() {
   eventSource.onerror = (error) => {
     console.error('EventSource error:', error);
     document.getElementById("offline-banner").classList.remove("hidden");
-    eventSource.close();
-    startOrderPolling();
+    // Browser reconnect sendiri dengan Last-Event-ID; polling hanya bila stream benar-benar ditutup
+    if (eventSource.readyState === EventSource.CLOSED) {
+      startOrderPolling();
+      setTimeout(initializeEventSource, 10000 + Math.random() * 10000);
+    }
   };
   
   eventSource.onopen = () => {
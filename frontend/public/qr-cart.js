@@ -412,15 +412,30 @@ class QRCartManager {
                 telegram_id: tg
             };
             
+            // Key yang sama dipakai ulang bila request sebelumnya putus di tengah jalan,
+            // tapi hanya untuk isi pesanan yang sama; keranjang yang diubah = key baru
+            const body = JSON.stringify(orderData);
+            if (!this.idempotencyKey || this.idempotencyBody !== body) {
+                this.idempotencyKey = (window.crypto && crypto.randomUUID)
+                    ? crypto.randomUUID()
+                    : `${Date.now()}-${Math.random().toString(16).slice(2)}`;
+                this.idempotencyBody = body;
+            }
             const response = await fetch('/create_order', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': this.idempotencyKey
                 },
-                body: JSON.stringify(orderData)
+                body
             });
             
             const result = await response.json();
+            // 409 = request dengan key ini masih diproses; simpan key untuk dicoba lagi
+            if (response.status !== 409) {
+                this.idempotencyKey = null;
+                this.idempotencyBody = null;
+            }
             
             if (result.status === 'success') {
                 console.log('Full order result:', result);
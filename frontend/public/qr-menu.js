@@ -93,8 +93,9 @@ class QRMenuManager {
 
   async loadMenus() {
     try {
-      const response = await fetch('/menu?cb=' + Date.now(), {
-        cache: 'no-store'
+      // no-cache: browser tetap revalidasi via ETag, server membalas 304 bila menu tidak berubah
+      const response = await fetch('/menu', {
+        cache: 'no-cache'
       });
 
       if (!response.ok) {
@@ -116,8 +117,8 @@ class QRMenuManager {
 
   async loadFlavors() {
     try {
-      const response = await fetch('/flavors/all?cb=' + Date.now(), {
-        cache: 'no-store'
+      const response = await fetch('/flavors/all', {
+        cache: 'no-cache'
       });
 
       if (!response.ok) {
@@ -35,6 +35,7 @@ let autoRefreshEnabled = false;
 let kitchenData = [];
 let ingredientData = {};
 let menuRecipes = {};
+let bootstrapRecipes = null; // resep dari /bootstrap/report terakhir, dipakai ulang tab dapur
 let menuConsumption = {}; // { menuName: { ingredientId: { totalQuantity, unit } } }
 let menuOrderCount = {};   // { menuName: totalQuantityOrdered }
 let menuFlavorUsage = {};  // { menuName: { flavorNameLower: totalQty } }
@@ -450,6 +451,35 @@ function hideIngredientAnalysis() {
     document.querySelectorAll('.dashboard-layout').forEach(el => el.classList.remove('hidden'));
 }
 
+// Ambil data awal analisis bahan dalam satu request bundle; fallback ke request terpisah
+async function loadReportBootstrap() {
+    try {
+        const res = await fetch('/bootstrap/report');
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        const bundle = await res.json();
+        const part = (name, fallback) => (bundle.parts && bundle.parts[name] && bundle.parts[name].ok)
+            ? bundle.parts[name].data
+            : fallback;
+        return {
+            menuData: part('menu', []),
+            inventoryData: part('inventory', []),
+            kitchenOrders: part('kitchen_orders', []),
+            flavorMapData: part('flavor_mapping', null),
+            bootstrapRecipes: part('recipes', null)
+        };
+    } catch (err) {
+        console.warn('Bootstrap bundle gagal, fallback ke request terpisah:', err);
+        const responses = await Promise.all([
+            fetch('/menu/list'),
+            fetch('/inventory/list'),
+            fetch('/kitchen/orders'),
+            fetch('/inventory/flavor_mapping')
+        ]);
+        const [menuData, inventoryData, kitchenOrders, flavorMapData] = await Promise.all(responses.map(r => r.json()));
+        return { menuData, inventoryData, kitchenOrders, flavorMapData, bootstrapRecipes: null };
+    }
+}
+
 async function loadIngredientAnalysisData() {
     // Helper lokal untuk empty/error agar bisa dipakai di try & catch
     const handleEmptyOrError = (message, options = {}) => {
@@ -526,18 +556,9 @@ async function loadIngredientAnalysisData() {
         const endDate = endVal ? new Date(endVal + 'T23:59:59') : null;
         
         // Load all menu data (optional) and inventory and kitchen orders and flavor mappings
-        const [menuResponse, inventoryResponse, kitchenResponse, flavorMapResp] = await Promise.all([
-            fetch('/menu/list'),
-            fetch('/inventory/list'),
-            fetch('/kitchen/orders'),
-            fetch('/inventory/flavor_mapping')
-        ]);
-        const [menuData, inventoryData, kitchenOrders, flavorMapData] = await Promise.all([
-            menuResponse.json(),
-            inventoryResponse.json(),
-            kitchenResponse.json(),
-            flavorMapResp.json()
-        ]);
+        const bootstrap = await loadReportBootstrap();
+        const { menuData, inventoryData, kitchenOrders, flavorMapData } = bootstrap;
+        bootstrapRecipes = bootstrap.bootstrapRecipes;
         kitchenOrdersCache = Array.isArray(kitchenOrders) ? kitchenOrders : [];
         
         // Build flavor mapping: flavor_name (lower) -> list of {ingredient_id, quantity_per_serving, unit}
@@ -581,12 +602,14 @@ async function loadIngredientAnalysisData() {
         }
         
         if (menuNames.length > 0) {
-            // Load recipes for these menus
-            const recipeResponse = await fetch('/recipes/batch', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ menu_names: menuNames })
-            });
+            // Load recipes for these menus (pakai hasil bootstrap bila sudah mencakup semua menu)
+            const recipeResponse = bootstrapRecipes && menuNames.every(name => name in bootstrapRecipes)
+                ? new Response(JSON.stringify({ recipes: bootstrapRecipes }))
+                : await fetch('/recipes/batch', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ menu_names: menuNames })
+                });
             if (recipeResponse.ok) {
                 const recipeData = await recipeResponse.json();
                 menuRecipes = recipeData.recipes || {};
@@ -3541,12 +3564,14 @@ async function loadIngredientAnalysis() {
         ))].filter(Boolean);
         
         if (menuNames.length > 0) {
-            // Load recipes for these menus
-            const recipeResponse = await fetch('/recipes/batch', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ menu_names: menuNames })
-            });
+            // Load recipes for these menus (pakai hasil bootstrap bila sudah mencakup semua menu)
+            const recipeResponse = bootstrapRecipes && menuNames.every(name => name in bootstrapRecipes)
+                ? new Response(JSON.stringify({ recipes: bootstrapRecipes }))
+                : await fetch('/recipes/batch', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ menu_names: menuNames })
+                });
             
             if (recipeResponse.ok) {
                 const recipeData = await recipeResponse.json();
@@ -8,6 +8,7 @@ const { error } = require("console");
 const app = express();
 const PORT = 8080;
 const N8N_WEBHOOK_URL = process.env.N8N_WEBHOOK_URL || "https://liberal-relative-panther.ngrok-free.app/webhook/trigger-order-status";
+const GATEWAY_URL = process.env.GATEWAY_URL || "http://gateway:2323";
 
 // Middleware
 app.use(express.json());
@@ -37,13 +38,21 @@ app.get("/health", (req, res) => {
   res.json({ status: "ok" });
 });
 
+// Teruskan Idempotency-Key dari client supaya retry tidak membuat order ganda
+function orderHeaders(req) {
+  const headers = { "Content-Type": "application/json" };
+  const idempotencyKey = req.get("Idempotency-Key");
+  if (idempotencyKey) headers["Idempotency-Key"] = idempotencyKey;
+  return headers;
+}
+
 // Order endpoints
 app.post("/create_order", async (req, res) => {
   try {
     const body = req.body;
     const resp = await fetch("http://order_service:8002/create_order", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: orderHeaders(req),
       body: JSON.stringify(body)
     });
     const data = await resp.json();
@@ -99,7 +108,7 @@ app.post("/custom_order", async (req, res) => {
     console.log('Received custom order request:', body);
     const resp = await fetch("http://order_service:8002/custom_order", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: orderHeaders(req),
       body: JSON.stringify(body)
     });
 
@@ -383,7 +392,9 @@ app.get("/get_cancelled_items", async (req, res) => {
 // Kitchen endpoints
 app.get("/kitchen/orders", async (req, res) => {
   try {
-    const resp = await fetch("http://kitchen_service:8003/kitchen/orders");
+    // Teruskan ?since=<version> untuk fetch inkremental
+    const qs = req.query.since !== undefined ? `?since=${encodeURIComponent(String(req.query.since))}` : "";
+    const resp = await fetch(`http://kitchen_service:8003/kitchen/orders${qs}`);
     const data = await resp.json();
     res.json(data);
   } catch (err) {
@@ -392,6 +403,41 @@ app.get("/kitchen/orders", async (req, res) => {
   }
 });
 
+// Harus sebelum route /:order_id supaya "batch" tidak dianggap order_id
+app.post("/kitchen/update_status/batch", async (req, res) => {
+  const updates = Array.isArray(req.body && req.body.updates) ? req.body.updates : [];
+  if (updates.length === 0) {
+    return res.status(400).json({ error: "updates tidak boleh kosong" });
+  }
+  try {
+    const resp = await fetch("http://kitchen_service:8003/kitchen/update_status/batch", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ updates })
+    });
+    const data = await resp.json();
+    if (!resp.ok) {
+      return res.status(resp.status).json(data);
+    }
+
+    // Webhook n8n tetap per order (notifikasi ke customer masing-masing), non-blocking
+    updates.forEach(({ order_id, status, reason = "" }) => {
+      const qs = new URLSearchParams({
+        order_id: String(order_id || ""),
+        status: String(status || ""),
+        reason: String(reason || "")
+      });
+      fetch(`${N8N_WEBHOOK_URL}?${qs.toString()}`, { method: "GET" })
+        .catch(err => console.error("Failed to call n8n webhook ", err));
+    });
+
+    res.json({ success: true, ...data });
+  } catch (err) {
+    console.error("Failed to update status batch ", err);
+    res.status(500).json({ error: "Failed to update status" });
+  }
+});
+
 app.post("/kitchen/update_status/:order_id", async (req, res) => {
   const { order_id } = req.params;
   const { status, reason = "" } = req.query;
@@ -450,38 +496,42 @@ app.post("/kitchen/status", async (req, res) => {
 });
 
 app.get("/stream/orders", (req, res) => {
-  const streamReq = fetch("http://kitchen_service:8003/stream/orders");
+  // Teruskan Last-Event-ID supaya kitchen_service me-replay event yang terlewat saat reconnect
+  const headers = {};
+  if (req.headers["last-event-id"]) headers["Last-Event-ID"] = req.headers["last-event-id"];
+  const streamReq = fetch("http://kitchen_service:8003/stream/orders", { headers });
   streamReq.then(resp => {
     res.setHeader('Content-Type', 'text/event-stream');
+    res.setHeader('Cache-Control', 'no-cache');
     resp.body.pipe(res);
+    // Tutup koneksi upstream begitu tablet disconnect
+    req.on('close', () => resp.body.destroy());
   }).catch(() => res.status(500).end());
 });
 
-// Menu endpoints
-app.get("/menu", async (req, res) => {
+// Conditional GET untuk katalog: teruskan If-None-Match, relay ETag dan 304 dari menu_service
+async function proxyConditionalGet(url, req, res, label) {
   try {
-    const resp = await fetch("http://menu_service:8001/menu");
+    const headers = {};
+    if (req.headers["if-none-match"]) headers["If-None-Match"] = req.headers["if-none-match"];
+    const resp = await fetch(url, { headers });
+    const etag = resp.headers.get("etag");
+    if (etag) res.set("ETag", etag);
+    res.set("Cache-Control", "no-cache");
+    if (resp.status === 304) return res.status(304).end();
     const data = await resp.json();
-    res.set('Cache-Control', 'no-store');
-    res.json(data);
+    res.status(resp.status).json(data);
   } catch (err) {
-    console.error("Failed to fetch menu ", err);
-    res.status(500).json({ error: "Failed to fetch menu" });
+    console.error(`Failed to fetch ${label} `, err);
+    res.status(500).json({ error: `Failed to fetch ${label}` });
   }
-});
+}
+
+// Menu endpoints
+app.get("/menu", (req, res) => proxyConditionalGet("http://menu_service:8001/menu", req, res, "menu"));
 
 // Admin passthrough for all menus (same as list, explicit path)
-app.get("/menu/all", async (req, res) => {
-  try {
-    const resp = await fetch("http://menu_service:8001/menu/all");
-    const data = await resp.json();
-    res.set('Cache-Control', 'no-store');
-    res.json(data);
-  } catch (err) {
-    console.error("Failed to fetch all menus ", err);
-    res.status(500).json({ error: "Failed to fetch all menus" });
-  }
-});
+app.get("/menu/all", (req, res) => proxyConditionalGet("http://menu_service:8001/menu/all", req, res, "all menus"));
 
 app.post("/menu", async (req, res) => {
   try {
@@ -616,27 +666,8 @@ app.delete("/menu/:menu_id", async (req, res) => {
 });
 
 // Flavor endpoints
-app.get("/flavors/all", async (req, res) => {
-  try {
-    const resp = await fetch("http://menu_service:8001/flavors/all");
-    const data = await resp.json();
-    res.set('Cache-Control', 'no-store');
-    res.status(resp.status).json(data);
-  } catch (err) {
-    console.error("Failed to fetch all flavors ", err);
-    res.status(500).json({ error: "Failed to fetch all flavors" });
-  }
-});
-app.get("/flavors", async (req, res) => {
-  try {
-    const resp = await fetch("http://menu_service:8001/flavors");
-    const data = await resp.json();
-    res.json(data);
-  } catch (err) {
-    console.error("Failed to fetch flavors ", err);
-    res.status(500).json({ error: "Failed to fetch flavors" });
-  }
-});
+app.get("/flavors/all", (req, res) => proxyConditionalGet("http://menu_service:8001/flavors/all", req, res, "all flavors"));
+app.get("/flavors", (req, res) => proxyConditionalGet("http://menu_service:8001/flavors", req, res, "flavors"));
 
 app.post("/flavors", async (req, res) => {
   try {
@@ -1264,6 +1295,25 @@ app.get("/order/:order_id/ingredients", async (req, res) => {
   }
 });
 
+// Bootstrap bundle dari gateway (report/kitchen/qr); body gzip diteruskan apa adanya
+app.get("/bootstrap/:bundle", async (req, res) => {
+  try {
+    const resp = await fetch(`${GATEWAY_URL}/bootstrap/${encodeURIComponent(req.params.bundle)}`, {
+      headers: { "Accept-Encoding": req.headers["accept-encoding"] || "identity" },
+      compress: false
+    });
+    res.status(resp.status);
+    ["content-type", "content-encoding", "vary", "cache-control"].forEach((name) => {
+      const value = resp.headers.get(name);
+      if (value) res.set(name, value);
+    });
+    resp.body.pipe(res);
+  } catch (err) {
+    console.error("Failed to fetch bootstrap bundle ", err);
+    res.status(500).json({ error: "Failed to fetch bootstrap bundle" });
+  }
+});
+
 // Menu endpoints
 app.get("/menu/list", async (req, res) => {
   try {
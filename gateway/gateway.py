@@ -1,15 +1,751 @@
 # gateway_service.py
-from fastapi import FastAPI, Request, Query, HTTPException
+from fastapi import FastAPI, Request, Response, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
+import asyncio
+import contextvars
+import gzip
+import hashlib
+import math
 import httpx
 import json
+import logging
+import os
+import random
+import re
+import time
+from collections import OrderedDict, deque
 from typing import Optional
 
+# Base URLs for microservices
+MENU_SERVICE_URL = "http://menu_service:8001"
+ORDER_SERVICE_URL = "http://order_service:8002"
+KITCHEN_SERVICE_URL = "http://kitchen_service:8003"
+REPORT_SERVICE_URL = "http://report_service:8004"
+INVENTORY_SERVICE_URL = "http://inventory_service:8006"
+
+# ========== UPSTREAM CLIENT POOL ==========
+# Satu httpx.AsyncClient per upstream, dibuat sekali saat startup supaya koneksi
+# keep-alive dipakai ulang antar request (tidak ada TCP setup per request).
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("GATEWAY_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("GATEWAY_MAX_KEEPALIVE_CONNECTIONS", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("GATEWAY_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_HTTP2 = os.getenv("GATEWAY_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Profil timeout per upstream (detik): (connect, read, write, pool)
+UPSTREAM_TIMEOUTS = {
+    "menu": (2.0, 10.0, 10.0, 5.0),
+    "order": (2.0, 30.0, 10.0, 5.0),
+    "kitchen": (2.0, 15.0, 10.0, 5.0),
+    "report": (2.0, 60.0, 10.0, 5.0),
+    "inventory": (2.0, 15.0, 10.0, 5.0),
+}
+
+UPSTREAM_URLS = {
+    "menu": MENU_SERVICE_URL,
+    "order": ORDER_SERVICE_URL,
+    "kitchen": KITCHEN_SERVICE_URL,
+    "report": REPORT_SERVICE_URL,
+    "inventory": INVENTORY_SERVICE_URL,
+}
+
+upstream_clients = {}
+
+def _http2_enabled() -> bool:
+    if not UPSTREAM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logging.warning("GATEWAY_HTTP2 aktif tetapi paket 'h2' tidak terpasang, fallback ke HTTP/1.1")
+        return False
+
+def _upstream_timeout(name: str) -> httpx.Timeout:
+    connect, read, write, pool = UPSTREAM_TIMEOUTS[name]
+    # Override via env, contoh: GATEWAY_TIMEOUT_REPORT=90 (read timeout)
+    read = float(os.getenv(f"GATEWAY_TIMEOUT_{name.upper()}", read))
+    return httpx.Timeout(connect=connect, read=read, write=write, pool=pool)
+
+# ========== CIRCUIT BREAKER & RETRY BUDGET ==========
+# Dipasang sebagai transport httpx, jadi semua route (termasuk SSE hub dan proxy MCP)
+# otomatis lewat breaker. Saat breaker OPEN request langsung gagal (503 + Retry-After)
+# tanpa menunggu timeout upstream.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("GATEWAY_BREAKER_FAILURES", "5"))
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv("GATEWAY_BREAKER_RECOVERY_TIMEOUT", "10"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("GATEWAY_BREAKER_HALF_OPEN_CALLS", "1"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("GATEWAY_RETRY_MAX_ATTEMPTS", "2"))
+RETRY_BUDGET_RATIO = float(os.getenv("GATEWAY_RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = float(os.getenv("GATEWAY_RETRY_BUDGET_MIN", "3"))
+RETRY_BACKOFF = float(os.getenv("GATEWAY_RETRY_BACKOFF", "0.1"))
+RETRYABLE_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRYABLE_STATUS = {502, 503, 504}
+BODY_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# Deadline dari client (header X-Request-Deadline-Ms = sisa waktu dalam ms) diteruskan ke upstream
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+class CircuitOpenError(httpx.TransportError):
+    def __init__(self, upstream: str, retry_after: float, request: httpx.Request = None):
+        super().__init__(f"Circuit breaker for '{upstream}' is open", request=request)
+        self.retry_after = retry_after
+
+class DeadlineExceededError(httpx.TimeoutException):
+    pass
+
+class CircuitBreaker:
+    """Breaker per upstream: closed -> open (setelah N gagal beruntun) -> half_open -> closed"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+        self.total_failures = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, BREAKER_RECOVERY_TIMEOUT - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if self.retry_after() > 0:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self.half_open_calls = 0
+        if self.state == "half_open":
+            if self.half_open_calls >= BREAKER_HALF_OPEN_CALLS:
+                self.rejected += 1
+                return False
+            self.half_open_calls += 1
+        return True
+
+    def record_success(self):
+        if self.state != "closed":
+            logging.info(f"Circuit breaker '{self.name}' CLOSED")
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_calls = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self.total_failures += 1
+        if self.state == "half_open" or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != "open":
+                logging.warning(f"Circuit breaker '{self.name}' OPEN setelah {self.failures} kegagalan")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.half_open_calls = 0
+
+    def release(self):
+        # Probe half-open yang dibatalkan client tidak menghitung sebagai sukses/gagal
+        if self.state == "half_open" and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def reset(self):
+        self.record_success()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+            "retry_after_seconds": round(self.retry_after(), 2) if self.state == "open" else 0,
+        }
+
+class RetryBudget:
+    """Retry hanya boleh sebesar RETRY_BUDGET_RATIO dari jumlah request (plus jatah minimum)"""
+
+    def __init__(self):
+        self.balance = RETRY_BUDGET_MIN
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        self.balance = min(self.balance + RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN + 100 * RETRY_BUDGET_RATIO)
+
+    def withdraw(self) -> bool:
+        if self.balance >= 1:
+            self.balance -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def stats(self) -> dict:
+        return {"balance": round(self.balance, 2), "retries": self.retries, "exhausted": self.exhausted}
+
+breakers = {name: CircuitBreaker(name) for name in UPSTREAM_URLS}
+retry_budgets = {name: RetryBudget() for name in UPSTREAM_URLS}
+
+def _apply_deadline(request: httpx.Request):
+    deadline = request_deadline.get()
+    if deadline is None:
+        return
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceededError("Request deadline exceeded before calling upstream", request=request)
+    request.headers[DEADLINE_HEADER] = str(int(remaining * 1000))
+    timeout = dict(request.extensions.get("timeout", {}))
+    for key in ("connect", "read", "write", "pool"):
+        timeout[key] = remaining if timeout.get(key) is None else min(timeout[key], remaining)
+    request.extensions["timeout"] = timeout
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """Transport httpx dengan circuit breaker, retry budget dan propagasi deadline"""
+
+    def __init__(self, name: str, transport: httpx.AsyncBaseTransport):
+        self.name = name
+        self.transport = transport
+        self.breaker = breakers[name]
+        self.budget = retry_budgets[name]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _apply_deadline(request)
+        # Body yang di-stream hanya bisa dibaca sekali, jadi hanya body di memori yang boleh diulang
+        retryable = request.method in RETRYABLE_METHODS and isinstance(request.stream, httpx.ByteStream)
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(self.name, self.breaker.retry_after(), request=request)
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                if not self._can_retry(retryable, attempt):
+                    raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if not self._can_retry(retryable, attempt):
+                    return response
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** (attempt - 1)))
+            _apply_deadline(request)
+
+    def _can_retry(self, retryable: bool, attempt: int) -> bool:
+        return retryable and attempt < RETRY_MAX_ATTEMPTS and self.budget.withdraw()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+# ========== UPSTREAM LOAD BALANCING ==========
+# Tiap upstream bisa punya beberapa replica, diatur lewat env
+# GATEWAY_UPSTREAM_ORDER="http://order_service_1:8002,http://order_service_2:8002"
+# atau file JSON GATEWAY_UPSTREAMS_FILE, contoh:
+# {"order": {"replicas": ["http://order_1:8002", "http://order_2:8002"], "strategy": "least_outstanding"}}
+LB_DEFAULT_STRATEGY = os.getenv("GATEWAY_LB_STRATEGY", "round_robin")
+LB_STRATEGIES = ("round_robin", "least_outstanding")
+LB_EJECT_FAILURES = int(os.getenv("GATEWAY_LB_EJECT_FAILURES", "3"))
+LB_EJECT_DURATION = float(os.getenv("GATEWAY_LB_EJECT_DURATION", "30"))
+
+class UpstreamReplica:
+    def __init__(self, url: str):
+        self.url = httpx.URL(url)
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def stats(self, now: float) -> dict:
+        return {
+            "url": str(self.url),
+            "healthy": self.available(now),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "total_failures": self.total_failures,
+            "ejected_for_seconds": round(max(0.0, self.ejected_until - now), 1),
+        }
+
+class UpstreamPool:
+    """Daftar replica satu upstream dengan pemilihan round-robin / least-outstanding"""
+
+    def __init__(self, name: str, urls: list, strategy: str):
+        if strategy not in LB_STRATEGIES:
+            logging.warning(f"Strategi LB '{strategy}' untuk '{name}' tidak dikenal, pakai round_robin")
+            strategy = "round_robin"
+        self.name = name
+        self.strategy = strategy
+        self.replicas = [UpstreamReplica(url) for url in urls]
+        self._cursor = 0
+
+    def choose(self, pinned: bool = False) -> UpstreamReplica:
+        now = time.monotonic()
+        # Semua replica ter-eject: fail open, lebih baik dicoba daripada pasti gagal
+        candidates = [r for r in self.replicas if r.available(now)] or self.replicas
+        if pinned:
+            # Replica sehat pertama sesuai urutan konfigurasi: sama untuk semua request
+            return candidates[0]
+        self._cursor += 1
+        if self.strategy == "least_outstanding":
+            offset = self._cursor % len(candidates)
+            rotated = candidates[offset:] + candidates[:offset]
+            return min(rotated, key=lambda r: r.outstanding)
+        return candidates[self._cursor % len(candidates)]
+
+    def record_success(self, replica: UpstreamReplica):
+        replica.failures = 0
+
+    def record_failure(self, replica: UpstreamReplica):
+        replica.failures += 1
+        replica.total_failures += 1
+        if replica.failures >= LB_EJECT_FAILURES and len(self.replicas) > 1:
+            replica.ejected_until = time.monotonic() + LB_EJECT_DURATION
+            replica.failures = 0
+            logging.warning(f"Replica {replica.url} ({self.name}) di-eject selama {LB_EJECT_DURATION:.0f}s")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {"strategy": self.strategy, "replicas": [r.stats(now) for r in self.replicas]}
+
+def load_upstream_replicas() -> dict:
+    """Gabungkan URL default, file GATEWAY_UPSTREAMS_FILE, lalu env GATEWAY_UPSTREAM_<NAME>"""
+    config = {name: {"replicas": [url], "strategy": LB_DEFAULT_STRATEGY} for name, url in UPSTREAM_URLS.items()}
+    path = os.getenv("GATEWAY_UPSTREAMS_FILE")
+    if path:
+        with open(path) as f:
+            for name, entry in json.load(f).items():
+                if name not in config:
+                    logging.warning(f"Upstream '{name}' di {path} tidak dikenal, diabaikan")
+                    continue
+                if isinstance(entry, dict):
+                    config[name]["replicas"] = list(entry.get("replicas") or config[name]["replicas"])
+                    config[name]["strategy"] = entry.get("strategy", config[name]["strategy"])
+                else:
+                    config[name]["replicas"] = [entry] if isinstance(entry, str) else list(entry)
+    for name in config:
+        urls = os.getenv(f"GATEWAY_UPSTREAM_{name.upper()}")
+        if urls:
+            config[name]["replicas"] = [u.strip() for u in urls.split(",") if u.strip()]
+        config[name]["strategy"] = os.getenv(f"GATEWAY_LB_STRATEGY_{name.upper()}", config[name]["strategy"])
+    return {
+        name: UpstreamPool(name, entry["replicas"], entry["strategy"])
+        for name, entry in config.items()
+    }
+
+upstream_pools = load_upstream_replicas()
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Body response yang menurunkan counter outstanding replica saat ditutup"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+# Request dengan extensions {LB_PIN_EXTENSION: True} selalu ke replica yang sama, untuk
+# state yang hanya ada di satu replica (session MCP SSE: GET stream dan POST messages)
+LB_PIN_EXTENSION = "gateway_lb_pin"
+
+class LoadBalancingTransport(httpx.AsyncBaseTransport):
+    """Arahkan tiap request ke salah satu replica dan catat kesehatannya secara pasif"""
+
+    def __init__(self, pool: UpstreamPool, transport: httpx.AsyncBaseTransport):
+        self.pool = pool
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        replica = self.pool.choose(pinned=bool(request.extensions.get(LB_PIN_EXTENSION)))
+        request.url = request.url.copy_with(
+            scheme=replica.url.scheme, host=replica.url.host, port=replica.url.port
+        )
+        request.headers["Host"] = replica.url.netloc.decode("ascii")
+        replica.outstanding += 1
+        replica.requests += 1
+
+        def release():
+            replica.outstanding -= 1
+
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            release()
+            self.pool.record_failure(replica)
+            raise
+        except BaseException:
+            release()
+            raise
+        if response.status_code in RETRYABLE_STATUS:
+            self.pool.record_failure(replica)
+        else:
+            self.pool.record_success(replica)
+        # Stream berumur panjang (SSE) bukan beban yang sedang dikerjakan replica;
+        # kalau ikut dihitung, least_outstanding akan menjauhi replica itu selamanya
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            release()
+            release = None
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def build_upstream_clients() -> dict:
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    http2 = _http2_enabled()
+    return {
+        name: httpx.AsyncClient(
+            base_url=str(pool.replicas[0].url),
+            timeout=_upstream_timeout(name),
+            transport=ResilientTransport(
+                name,
+                LoadBalancingTransport(pool, httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+            ),
+        )
+        for name, pool in upstream_pools.items()
+    }
+
+def upstream_error(e: Exception, message: str) -> HTTPException:
+    """Terjemahkan error upstream ke HTTPException yang sesuai (fast-fail saat breaker open)"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(
+            status_code=503,
+            detail=f"{message}: {str(e)}",
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
+    if isinstance(e, httpx.TimeoutException):
+        return HTTPException(status_code=504, detail=f"{message}: upstream timeout")
+    if isinstance(e, (httpx.TransportError, httpx.StreamError)):
+        return HTTPException(status_code=502, detail=f"{message}: {str(e)}")
+    return HTTPException(status_code=500, detail=f"{message}: {str(e)}")
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Ambil client pooled untuk upstream tertentu (menu/order/kitchen/report/inventory)"""
+    return upstream_clients[name]
+
+# ========== SSE FAN-OUT HUB ==========
+# Gateway hanya membuka satu subscription ke kitchen_service /stream/orders lalu
+# membagikan setiap event ke semua browser/tablet yang terhubung.
+SSE_CLIENT_BUFFER = int(os.getenv("GATEWAY_SSE_CLIENT_BUFFER", "32"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("GATEWAY_SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_RECONNECT_MAX_DELAY = float(os.getenv("GATEWAY_SSE_RECONNECT_MAX_DELAY", "30"))
+SSE_REPLAY_BUFFER = int(os.getenv("GATEWAY_SSE_REPLAY_BUFFER", "256"))
+SSE_RETRY_MS = int(os.getenv("GATEWAY_SSE_RETRY_MS", "2000"))
+SSE_HEARTBEAT = b": heartbeat\n\n"
+
+def _sse_field(event: bytes, name: bytes) -> Optional[bytes]:
+    prefix = name + b":"
+    for line in event.split(b"\n"):
+        if line.startswith(prefix):
+            return line[len(prefix):].strip()
+    return None
+
+class SSEBroadcaster:
+    """Multiplex satu stream SSE upstream ke banyak client downstream"""
+
+    def __init__(self, upstream: str, path: str, snapshot_marker: Optional[bytes] = None):
+        self.upstream = upstream
+        self.path = path
+        # Penanda event snapshot penuh; dipakai sebagai titik awal replay untuk client baru
+        self.snapshot_marker = snapshot_marker
+        self.subscribers = set()
+        self.history = deque(maxlen=SSE_REPLAY_BUFFER)
+        self.last_event_id = None
+        self.connected = False
+        self.reconnects = 0
+        self.dropped_events = 0
+        self.resumed = 0
+        self.resynced = 0
+        self._task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SSE_CLIENT_BUFFER)
+        self.subscribers.add(queue)
+        if self._task is None or self._task.done():
+            # Context kosong: deadline milik request pertama tidak boleh ikut ke stream upstream
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            self._stop()
+
+    def replay(self, last_event_id: Optional[str]) -> list:
+        """Event sesudah Last-Event-ID; bila id tidak ada di buffer, mulai dari snapshot terakhir"""
+        events = list(self.history)
+        if last_event_id:
+            wanted = last_event_id.strip().encode()
+            for i in range(len(events) - 1, -1, -1):
+                if events[i][0] == wanted:
+                    self.resumed += 1
+                    return [event for _, event in events[i + 1:]]
+            self.resynced += 1
+        if self.snapshot_marker is not None:
+            for i in range(len(events) - 1, -1, -1):
+                if self.snapshot_marker in events[i][1]:
+                    return [event for _, event in events[i:]]
+        return []
+
+    def publish(self, event: bytes):
+        event_id = _sse_field(event, b"id")
+        if event_id is not None:
+            self.last_event_id = event_id.decode()
+        self.history.append((event_id, event))
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Client lambat: buang event tertua; client mendeteksi celah seq lalu resync
+                try:
+                    queue.get_nowait()
+                    self.dropped_events += 1
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(event)
+
+    def stats(self) -> dict:
+        return {
+            "upstream": f"{self.upstream}{self.path}",
+            "connected": self.connected,
+            "subscribers": len(self.subscribers),
+            "reconnects": self.reconnects,
+            "dropped_events": self.dropped_events,
+            "buffered_events": len(self.history),
+            "last_event_id": self.last_event_id,
+            "resumed": self.resumed,
+            "resynced": self.resynced,
+        }
+
+    def _stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        # history & last_event_id dipertahankan: saat aktif lagi stream upstream dilanjutkan
+        self._task = None
+
+    async def close(self):
+        task = self._task
+        self._stop()
+        if task is not None:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        delay = 1.0
+        while self.subscribers:
+            try:
+                headers = {"Last-Event-ID": self.last_event_id} if self.last_event_id else None
+                async with get_client(self.upstream).stream(
+                    "GET", self.path, headers=headers, timeout=httpx.Timeout(10.0, read=None)
+                ) as response:
+                    response.raise_for_status()
+                    self.connected = True
+                    delay = 1.0
+                    buffer = b""
+                    async for chunk in response.aiter_bytes():
+                        buffer += chunk.replace(b"\r\n", b"\n")
+                        while b"\n\n" in buffer:
+                            event, buffer = buffer.split(b"\n\n", 1)
+                            # Hanya event berisi data yang diteruskan; retry/komentar upstream diabaikan
+                            if _sse_field(event, b"data") is not None:
+                                self.publish(event + b"\n\n")
+                logging.warning(f"Upstream SSE {self.upstream}{self.path} ditutup, reconnect...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Upstream SSE {self.upstream}{self.path} gagal: {e}, reconnect dalam {delay:.0f}s")
+            finally:
+                self.connected = False
+            if not self.subscribers:
+                break
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SSE_RECONNECT_MAX_DELAY)
+
+order_stream_hub = SSEBroadcaster(
+    "kitchen", "/stream/orders?snapshot=true", snapshot_marker=b'"type": "snapshot"'
+)
+
+# ========== REQUEST COALESCING ==========
+# GET idempotent yang sering di-poll tablet (/kitchen/orders, /kitchen/status/now,
+# /menu) digabung: request identik yang bersamaan berbagi satu panggilan upstream,
+# dan hasilnya disimpan sebentar (micro-TTL) untuk meredam burst polling.
+COALESCE_TTL = float(os.getenv("GATEWAY_COALESCE_TTL", "1.0"))
+# Batas jumlah key: path seperti /kitchen/orders?since=<version> terus berganti dan key lama
+# tidak pernah dibaca lagi, jadi tidak bisa mengandalkan eviksi saat key yang sama diakses
+COALESCE_MAX_KEYS = int(os.getenv("GATEWAY_COALESCE_MAX_KEYS", "1024"))
+VALIDATOR_MAX_KEYS = int(os.getenv("GATEWAY_VALIDATOR_MAX_KEYS", "256"))
+
+class SingleFlight:
+    """Satu panggilan upstream in-flight per key, plus cache hasil berumur pendek"""
+
+    def __init__(self, ttl: float, max_keys: int = COALESCE_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight = {}
+        # Urutan sisip = urutan kedaluwarsa (TTL sama untuk semua key)
+        self._cache = OrderedDict()
+
+    async def do(self, key, fn):
+        cached = self._cache.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self.hits += 1
+                return cached[1]
+            del self._cache[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        # shield: request yang dibatalkan tidak ikut membatalkan request lain yang menunggu
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if self.ttl > 0 and not task.cancelled() and task.exception() is None:
+            now = time.monotonic()
+            self._cache.pop(key, None)
+            self._cache[key] = (now + self.ttl, task.result())
+            self._prune(now)
+
+    def _prune(self, now: float):
+        # Buang dari depan: entry kedaluwarsa, lalu yang tertua bila melebihi max_keys
+        while self._cache:
+            oldest_key, (expires_at, _) = next(iter(self._cache.items()))
+            if expires_at > now and len(self._cache) <= self.max_keys:
+                break
+            del self._cache[oldest_key]
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._cache.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "cached_keys": len(self._cache),
+            "max_keys": self.max_keys,
+        }
+
+hot_get_cache = SingleFlight(COALESCE_TTL)
+
+# Validator terakhir per resource (etag, data), dipakai untuk revalidasi If-None-Match
+# ke upstream saat micro-TTL habis, sehingga upstream cukup membalas 304.
+# LRU berukuran tetap: key yang tidak pernah diminta lagi akhirnya tergeser.
+upstream_validators = OrderedDict()
+
+async def _fetch_validated(upstream: str, path: str):
+    key = (upstream, path)
+    cached = upstream_validators.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else None
+    response = await get_client(upstream).get(path, headers=headers)
+    if response.status_code == 304 and cached:
+        if key in upstream_validators:
+            upstream_validators.move_to_end(key)
+        return cached
+    response.raise_for_status()
+    entry = (response.headers.get("etag"), response.json())
+    if entry[0]:
+        upstream_validators[key] = entry
+        upstream_validators.move_to_end(key)
+        while len(upstream_validators) > VALIDATOR_MAX_KEYS:
+            upstream_validators.popitem(last=False)
+    return entry
+
+async def coalesced_get(upstream: str, path: str):
+    """GET JSON dari upstream lewat single-flight layer"""
+    _, data = await hot_get_cache.do((upstream, path), lambda: _fetch_validated(upstream, path))
+    return data
+
+def etag_matches(request: Request, etag: Optional[str]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not etag or not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+def _etag_headers(etag: Optional[str]) -> Optional[dict]:
+    return {"ETag": etag, "Cache-Control": "no-cache"} if etag else None
+
+async def conditional_coalesced_get(request: Request, upstream: str, path: str) -> Response:
+    """Seperti coalesced_get, tetapi membalas 304 ke client bila ETag masih sama"""
+    etag, data = await hot_get_cache.do((upstream, path), lambda: _fetch_validated(upstream, path))
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=_etag_headers(etag))
+    return JSONResponse(content=data, headers=_etag_headers(etag))
+
+async def conditional_get(request: Request, upstream: str, path: str) -> Response:
+    """Teruskan If-None-Match ke upstream dan kembalikan 304/ETag apa adanya"""
+    headers = {}
+    if request.headers.get("if-none-match"):
+        headers["If-None-Match"] = request.headers["if-none-match"]
+    response = await get_client(upstream).get(path, headers=headers)
+    etag = response.headers.get("etag")
+    if response.status_code == 304:
+        return Response(status_code=304, headers=_etag_headers(etag))
+    response.raise_for_status()
+    return Response(content=response.content, media_type="application/json", headers=_etag_headers(etag))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    upstream_clients.update(build_upstream_clients())
+    try:
+        yield
+    finally:
+        await order_stream_hub.close()
+        if background_tasks:
+            await asyncio.wait(set(background_tasks), timeout=5)
+        for client in upstream_clients.values():
+            await client.aclose()
+        upstream_clients.clear()
+
 app = FastAPI(
     title="Infinity Gateway", 
     description="Gateway untuk routing requests ke menu, order, kitchen, dan report services", 
-    version="1.0"
+    version="1.0",
+    lifespan=lifespan
 )
 
 # Enable CORS
@@ -21,168 +757,636 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Base URLs for microservices
-MENU_SERVICE_URL = "http://menu_service:8001"
-ORDER_SERVICE_URL = "http://order_service:8002"
-KITCHEN_SERVICE_URL = "http://kitchen_service:8003"
-REPORT_SERVICE_URL = "http://report_service:8004"
+class DeadlineMiddleware:
+    """Baca header deadline dari client dan simpan di context untuk ResilientTransport"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = None
+        if scope["type"] == "http":
+            header = dict(scope["headers"]).get(DEADLINE_HEADER.lower().encode())
+            if header:
+                try:
+                    token = request_deadline.set(time.monotonic() + float(header) / 1000)
+                except ValueError:
+                    pass
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if token is not None:
+                request_deadline.reset(token)
+
+app.add_middleware(DeadlineMiddleware)
 
 @app.get("/health", tags=["Gateway"])
 def health_check():
     return {"status": "ok", "gateway": "Infinity Gateway"}
 
+@app.get("/gateway/breakers", tags=["Gateway"])
+def get_breakers():
+    """Status circuit breaker dan retry budget per upstream"""
+    return {
+        name: {**breaker.stats(), "retry_budget": retry_budgets[name].stats()}
+        for name, breaker in breakers.items()
+    }
+
+@app.get("/gateway/upstreams", tags=["Gateway"])
+def get_upstreams():
+    """Daftar replica per upstream beserta status kesehatannya"""
+    return {name: pool.stats() for name, pool in upstream_pools.items()}
+
+@app.post("/gateway/breakers/{name}/reset", tags=["Gateway"])
+def reset_breaker(name: str):
+    """Tutup paksa circuit breaker upstream tertentu"""
+    breaker = breakers.get(name)
+    if breaker is None:
+        raise HTTPException(status_code=404, detail=f"Unknown upstream '{name}'")
+    breaker.reset()
+    return {"success": True, "upstream": name, **breaker.stats()}
+
 # ========== KITCHEN ENDPOINTS ==========
 @app.get("/kitchen/orders", tags=["Kitchen"])
-async def get_kitchen_orders():
-    """Ambil daftar semua pesanan dari dapur"""
+async def get_kitchen_orders(since: Optional[int] = Query(None)):
+    """Ambil daftar semua pesanan dari dapur (atau hanya perubahan sejak versi `since`)"""
+    path = "/kitchen/orders" if since is None else f"/kitchen/orders?since={since}"
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{KITCHEN_SERVICE_URL}/kitchen/orders")
-            response.raise_for_status()
-            return response.json()
+        return await coalesced_get("kitchen", path)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch kitchen orders: {str(e)}")
+        raise upstream_error(e, "Failed to fetch kitchen orders")
 
 @app.get("/kitchen/status/now", tags=["Kitchen"])
 async def get_kitchen_status():
     """Cek status dapur saat ini"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{KITCHEN_SERVICE_URL}/kitchen/status/now")
-            response.raise_for_status()
-            return response.json()
+        return await coalesced_get("kitchen", "/kitchen/status/now")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch kitchen status: {str(e)}")
+        raise upstream_error(e, "Failed to fetch kitchen status")
 
 @app.post("/kitchen/status", tags=["Kitchen"])
 async def set_kitchen_status(request: Request):
     """Atur status dapur ON/OFF"""
     try:
         body = await request.json()
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{KITCHEN_SERVICE_URL}/kitchen/status", json=body)
-            response.raise_for_status()
-            return response.json()
+        client = get_client("kitchen")
+        response = await client.post("/kitchen/status", json=body)
+        response.raise_for_status()
+        hot_get_cache.invalidate(("kitchen", "/kitchen/status/now"))
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to update kitchen status: {str(e)}")
+        raise upstream_error(e, "Failed to update kitchen status")
+
+# ========== STATUS FAN-OUT ==========
+# Status dipropagasikan lewat satu jalur saja: gateway meminta kitchen_service
+# untuk tidak mem-notify order_service (notify_order=false), lalu gateway sendiri
+# meneruskan status ke order_service setelah kitchen menerimanya.
+KITCHEN_STATUSES = ["receive", "making", "deliver", "done", "cancelled", "habis"]
+REASON_REQUIRED_STATUSES = ["cancelled", "habis"]
+STATUS_ORDER_WAIT = float(os.getenv("GATEWAY_STATUS_ORDER_WAIT", "0.5"))
+STATUS_PROPAGATION_RETRIES = int(os.getenv("GATEWAY_STATUS_PROPAGATION_RETRIES", "2"))
+
+class StatusSequencer:
+    """Urutkan update status per order_id.
+
+    Kitchen leg untuk order yang sama berjalan bergiliran. Setiap update yang diterima
+    kitchen mendapat tiket; order leg dengan tiket lama (mis. retry "making" yang tertunda
+    setelah "deliver" masuk) dibuang, sehingga order_service tidak tertinggal dari kitchen.
+    """
+
+    def __init__(self):
+        self._locks = {}   # (leg, order_id) -> [Lock, jumlah pemakai]
+        self._latest = {}  # order_id -> tiket terbaru yang diterima kitchen
+        self._ticket = 0
+
+    @asynccontextmanager
+    async def hold(self, leg: str, order_ids):
+        # Urutan tetap supaya batch yang saling tumpang tindih tidak deadlock
+        keys = [(leg, order_id) for order_id in sorted(set(order_ids))]
+        joined = []
+        held = []
+        try:
+            for key in keys:
+                entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                joined.append((key, entry))
+                await entry[0].acquire()
+                held.append(entry[0])
+            yield
+        finally:
+            for lock in held:
+                lock.release()
+            for key, entry in joined:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(key, None)
+
+    def issue(self, order_ids) -> dict:
+        tickets = {}
+        for order_id in order_ids:
+            self._ticket += 1
+            tickets[order_id] = self._latest[order_id] = self._ticket
+        return tickets
+
+    def is_stale(self, order_id: str, ticket: int) -> bool:
+        return self._latest.get(order_id) != ticket
+
+    def release(self, tickets: dict):
+        for order_id, ticket in tickets.items():
+            if self._latest.get(order_id) == ticket:
+                del self._latest[order_id]
+
+status_sequencer = StatusSequencer()
+status_update_flight = SingleFlight(0)
+background_tasks = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def missing_reason_error(updates: list) -> Optional[HTTPException]:
+    """Aturan yang sama dengan kitchen_service, dicek sebelum request apa pun dikirim"""
+    missing = [u["order_id"] for u in updates if u["status"].lower() in REASON_REQUIRED_STATUSES and not u["reason"]]
+    if not missing:
+        return None
+    return HTTPException(status_code=400, detail=f"Alasan wajib untuk status cancel, atau habis (order {', '.join(missing)})")
+
+async def propagate_order_statuses(updates: list, tickets: dict) -> dict:
+    """Kirim status ke order_service (satu request untuk banyak order), retry hanya untuk
+    error jaringan/5xx. Update yang sudah didahului tap lebih baru tidak dikirim."""
+    try:
+        async with status_sequencer.hold("order", tickets):
+            def build_body():
+                fresh = [u for u in updates if not status_sequencer.is_stale(u["order_id"], tickets[u["order_id"]])]
+                if not fresh:
+                    return None
+                if len(updates) == 1:
+                    return f"/internal/update_status/{fresh[0]['order_id']}", {"status": fresh[0]["status"]}
+                return "/internal/update_status/batch", {"updates": fresh}
+            return await _post_order_status(build_body)
+    finally:
+        status_sequencer.release(tickets)
+
+async def _post_order_status(build_request) -> dict:
+    delay = 0.5
+    for attempt in range(STATUS_PROPAGATION_RETRIES + 1):
+        request = build_request()
+        if request is None:
+            return {"status": "superseded"}
+        path, body = request
+        try:
+            response = await get_client("order").post(path, json=body)
+            if response.status_code < 500 or attempt == STATUS_PROPAGATION_RETRIES:
+                response.raise_for_status()
+                return response.json()
+        except CircuitOpenError:
+            raise
+        except httpx.TransportError:
+            if attempt == STATUS_PROPAGATION_RETRIES:
+                raise
+        await asyncio.sleep(delay)
+        delay *= 2
+
+def _log_order_leg(order_id: str, status: str):
+    def callback(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Gagal propagasi status '{status}' order {order_id} ke order_service: {task.exception()}")
+    return callback
+
+async def _fan_out(updates: list, kitchen_call, label: str) -> tuple:
+    """Kitchen dulu; order leg baru dimulai setelah kitchen menerima update"""
+    order_ids = [u["order_id"] for u in updates]
+    async with status_sequencer.hold("kitchen", order_ids):
+        try:
+            kitchen_response = await kitchen_call()
+            kitchen_response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            try:
+                detail = e.response.json().get("detail", str(e))
+            except ValueError:
+                detail = str(e)
+            raise HTTPException(status_code=e.response.status_code, detail=detail)
+        except Exception as e:
+            raise upstream_error(e, "Failed to update status")
+        # Tiket diambil selagi kitchen leg masih dikunci: urutan tiket = urutan di kitchen
+        tickets = status_sequencer.issue(order_ids)
+    hot_get_cache.invalidate(("kitchen", "/kitchen/orders"))
+
+    order_updates = [{"order_id": u["order_id"], "status": u["status"]} for u in updates]
+    order_leg = run_in_background(propagate_order_statuses(order_updates, tickets))
+
+    # Tap dari barista tidak menunggu order_service yang lambat; sisanya selesai di background
+    await asyncio.wait({order_leg}, timeout=STATUS_ORDER_WAIT)
+    if not order_leg.done():
+        order_leg.add_done_callback(_log_order_leg(*label))
+        order_sync = "pending"
+    elif order_leg.exception() is not None:
+        logging.error(f"Gagal propagasi status '{label[1]}' order {label[0]} ke order_service: {order_leg.exception()}")
+        order_sync = "failed"
+    elif order_leg.result().get("status") == "superseded":
+        order_sync = "superseded"
+    else:
+        order_sync = "synced"
+    return order_updates, order_sync
+
+async def _fan_out_status(order_id: str, status: str, reason: str) -> dict:
+    _, order_sync = await _fan_out(
+        [{"order_id": order_id, "status": status, "reason": reason}],
+        lambda: get_client("kitchen").post(
+            f"/kitchen/update_status/{order_id}",
+            params={"status": status, "reason": reason, "notify_order": "false"}
+        ),
+        (order_id, status)
+    )
+    return {
+        "success": True,
+        "message": f"Order {order_id} status updated to {status}",
+        "order_sync": order_sync
+    }
+
+@app.post("/kitchen/update_status/batch", tags=["Kitchen"])
+async def update_kitchen_status_batch(request: Request):
+    """Perbarui status banyak pesanan sekaligus (satu transaksi di kitchen, satu notifikasi ke order)"""
+    try:
+        body = await request.json()
+        updates = [
+            {"order_id": str(u["order_id"]), "status": str(u["status"]).strip(), "reason": str(u.get("reason") or "")}
+            for u in body["updates"]
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Body harus berisi 'updates': [{order_id, status, reason}]")
+    invalid = [u["order_id"] for u in updates if u["status"].lower() not in KITCHEN_STATUSES]
+    if invalid:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Status tidak valid untuk order {', '.join(invalid)}. Status yang diizinkan: {', '.join(KITCHEN_STATUSES)}"
+        )
+    reason_error = missing_reason_error(updates)
+    if reason_error:
+        raise reason_error
+
+    order_updates, order_sync = await _fan_out(
+        updates,
+        lambda: get_client("kitchen").post(
+            "/kitchen/update_status/batch",
+            params={"notify_order": "false"},
+            json={"updates": updates}
+        ),
+        (f"batch({len(updates)})", "batch")
+    )
+    return {
+        "success": True,
+        "message": f"{len(updates)} order updated",
+        "updated": order_updates,
+        "order_sync": order_sync
+    }
 
 @app.post("/kitchen/update_status/{order_id}", tags=["Kitchen"])
 async def update_kitchen_status(order_id: str, status: str = Query(...), reason: str = Query("")):
     """Perbarui status pesanan tertentu"""
-    try:
-        async with httpx.AsyncClient() as client:
-            # Update di kitchen service
-            kitchen_response = await client.post(
-                f"{KITCHEN_SERVICE_URL}/kitchen/update_status/{order_id}",
-                params={"status": status, "reason": reason}
-            )
-            kitchen_response.raise_for_status()
-            
-            # Update di order service
-            order_response = await client.post(
-                f"{ORDER_SERVICE_URL}/internal/update_status/{order_id}",
-                json={"status": status}
-            )
-            order_response.raise_for_status()
-            
-            return {"success": True, "message": f"Order {order_id} status updated to {status}"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to update status: {str(e)}")
+    status = status.strip()
+    if status.lower() not in KITCHEN_STATUSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Status tidak valid. Status yang diizinkan: {', '.join(KITCHEN_STATUSES)}"
+        )
+    reason_error = missing_reason_error([{"order_id": order_id, "status": status, "reason": reason}])
+    if reason_error:
+        raise reason_error
+    # Tap ganda dengan status yang sama cukup dijalankan sekali
+    return await status_update_flight.do(
+        (order_id, status, reason),
+        lambda: _fan_out_status(order_id, status, reason)
+    )
 
 @app.get("/stream/orders", tags=["Kitchen"])
-async def stream_orders():
-    """Streaming data pesanan aktif via SSE"""
+async def stream_orders(request: Request):
+    """Streaming data pesanan aktif via SSE (satu koneksi upstream untuk semua client)"""
+    queue = order_stream_hub.subscribe()
+    # Tanpa await di antara subscribe dan replay, jadi tidak ada event yang terlewat atau dobel
+    backlog = order_stream_hub.replay(request.headers.get("last-event-id"))
+
+    async def event_generator():
+        try:
+            # Jitter retry supaya tablet tidak reconnect serentak setelah Wi-Fi putus
+            yield f"retry: {SSE_RETRY_MS + random.randint(0, SSE_RETRY_MS)}\n\n".encode()
+            for data in backlog:
+                yield data
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    data = SSE_HEARTBEAT
+                yield data
+        finally:
+            order_stream_hub.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "*"
+        }
+    )
+
+@app.get("/gateway/stream/stats", tags=["Gateway"])
+def get_stream_stats():
+    """Statistik SSE hub (subscriber, reconnect, event yang dibuang)"""
+    return order_stream_hub.stats()
+
+@app.get("/gateway/cache/stats", tags=["Gateway"])
+def get_cache_stats():
+    """Counter hit/miss/coalesce untuk GET yang digabung"""
+    return hot_get_cache.stats()
+
+# ========== ADMISSION CONTROL ==========
+# Burst create_order saat jam istirahat meeting diratakan: hanya N order diproses
+# bersamaan, sisanya antre FIFO per room dan dilayani bergiliran (round-robin antar room)
+# supaya satu room yang pesan banyak tidak menahan room lain.
+ADMISSION_MAX_CONCURRENT = int(os.getenv("GATEWAY_ADMISSION_MAX_CONCURRENT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("GATEWAY_ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_MAX_WAIT = float(os.getenv("GATEWAY_ADMISSION_MAX_WAIT", "15"))
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int, position: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.position = position
+
+class AdmissionController:
+    """Budget konkurensi dengan antrean adil per room"""
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.queues = OrderedDict()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.avg_service_time = 1.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def _estimate_position(self, room: str) -> int:
+        # Perkiraan posisi dengan round-robin: tiap room lain maksimal mendahului sebanyak
+        # jumlah antrean room ini + 1
+        own = len(self.queues.get(room, ()))
+        others = sum(min(len(q), own + 1) for r, q in self.queues.items() if r != room)
+        return own + others + 1
+
+    def retry_after(self, position: Optional[int] = None) -> int:
+        ahead = self.waiting if position is None else position
+        return max(1, math.ceil(ahead / max(self.max_concurrent, 1) * self.avg_service_time))
+
+    def _remove(self, room: str, waiter: asyncio.Future):
+        queue = self.queues.get(room)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self.queues[room]
+
+    async def acquire(self, room: str) -> int:
+        """Tunggu giliran; return posisi antrean saat masuk (0 = langsung diproses)"""
+        if self.active < self.max_concurrent and not self.queues:
+            self.active += 1
+            self.admitted += 1
+            return 0
+        if self.waiting >= self.max_queue:
+            self.shed += 1
+            raise AdmissionRejected("Antrean order penuh", self.retry_after(), self.waiting + 1)
+
+        position = self._estimate_position(room)
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(room, deque()).append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait({waiter}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self._remove(room, waiter)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._remove(room, waiter)
+            self.shed += 1
+            raise AdmissionRejected("Waktu tunggu antrean order habis", self.retry_after(position), position)
+        self.admitted += 1
+        return position
+
+    def release(self, service_time: Optional[float] = None):
+        if service_time is not None:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        # Slot langsung diberikan ke waiter berikutnya (room bergiliran), active tidak berubah
+        while self.queues:
+            room, queue = self.queues.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                self.queues[room] = queue
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "waiting": self.waiting,
+            "waiting_per_room": {room: len(q) for room, q in self.queues.items()},
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "avg_service_time_seconds": round(self.avg_service_time, 3),
+        }
+
+order_admission = AdmissionController(ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT)
+
+async def admitted_order_call(path: str, body: dict, response: Response, headers: Optional[dict] = None) -> dict:
+    """Teruskan order ke order_service setelah lolos admission control"""
+    room = str(body.get("room_name") or "").strip().lower() if isinstance(body, dict) else ""
+    start = time.monotonic()
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{KITCHEN_SERVICE_URL}/stream/orders")
-            response.raise_for_status()
-            
-            async def event_generator():
-                async for chunk in response.aiter_bytes():
-                    yield chunk
-                    
-            return StreamingResponse(
-                event_generator(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Headers": "*"
-                }
-            )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to stream orders: {str(e)}")
+        position = await order_admission.acquire(room)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail={"message": str(e), "queue_position": e.position, "retry_after": e.retry_after},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    admitted_at = time.monotonic()
+    response.headers["X-Queue-Position"] = str(position)
+    response.headers["X-Queue-Wait-Ms"] = str(int((admitted_at - start) * 1000))
+    try:
+        upstream_response = await get_client("order").post(path, json=body, headers=headers)
+    finally:
+        order_admission.release(time.monotonic() - admitted_at)
+    upstream_response.raise_for_status()
+    return upstream_response.json()
+
+# ========== IDEMPOTENCY ==========
+# Retry create_order dari HP dengan Idempotency-Key yang sama dijawab dari cache,
+# tanpa masuk antrean admission maupun menyentuh menu/kitchen/inventory.
+# order_service juga menyimpan key ini, jadi replay antar replica gateway tetap aman.
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL = float(os.getenv("GATEWAY_IDEMPOTENCY_TTL", "600"))
+
+class IdempotencyConflict(Exception):
+    pass
+
+class _UncachedResult(Exception):
+    """Response error bisnis yang diteruskan ke client tapi tidak disimpan"""
+
+    def __init__(self, result):
+        super().__init__("uncached result")
+        self.result = result
+
+class IdempotencyCache(SingleFlight):
+    """SingleFlight per Idempotency-Key plus cek fingerprint body request"""
+
+    def __init__(self, ttl: float):
+        super().__init__(ttl)
+        self._fingerprints = {}
+
+    def seen(self, key) -> bool:
+        cached = self._cache.get(key)
+        return key in self._inflight or (cached is not None and cached[0] > time.monotonic())
+
+    async def run(self, key, fingerprint: str, fn):
+        self._prune()
+        known = self._fingerprints.get(key)
+        if known is not None and known != fingerprint:
+            raise IdempotencyConflict(key)
+        self._fingerprints[key] = fingerprint
+        return await self.do(key, fn)
+
+    def _finish(self, key, task: asyncio.Task):
+        super()._finish(key, task)
+        # Gagal: key dilepas supaya retry berikutnya benar-benar dijalankan ulang
+        if key not in self._cache:
+            self._fingerprints.pop(key, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+            self._fingerprints.pop(key, None)
+
+order_idempotency = IdempotencyCache(IDEMPOTENCY_TTL)
+
+async def idempotent_order_call(request: Request, path: str, body: dict, response: Response) -> dict:
+    """Jalankan create/custom order sekali per Idempotency-Key"""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return await admitted_order_call(path, body, response)
+
+    cache_key = (path, key)
+    fingerprint = hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+    if order_idempotency.seen(cache_key):
+        response.headers["Idempotent-Replayed"] = "true"
+
+    async def call():
+        result = await admitted_order_call(path, body, response, headers={IDEMPOTENCY_HEADER: key})
+        if isinstance(result, dict) and result.get("status") == "error":
+            # Error bisnis (stok habis, dapur OFF) tidak di-cache: retry boleh mencoba lagi
+            raise _UncachedResult(result)
+        return result
+
+    try:
+        return await order_idempotency.run(cache_key, fingerprint, call)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key sudah dipakai untuk request dengan isi berbeda")
+    except _UncachedResult as e:
+        return e.result
 
 # ========== ORDER ENDPOINTS ==========
 @app.post("/create_order", tags=["Order"])
-async def create_order(request: Request):
+async def create_order(request: Request, response: Response):
     """Buat pesanan baru"""
     try:
         body = await request.json()
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{ORDER_SERVICE_URL}/create_order", json=body)
-            response.raise_for_status()
-            return response.json()
+        return await idempotent_order_call(request, "/create_order", body, response)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
+        raise upstream_error(e, "Failed to create order")
 
 @app.post("/custom_order", tags=["Order"])
-async def create_custom_order(request: Request):
+async def create_custom_order(request: Request, response: Response):
     """Buat pesanan custom"""
     try:
         body = await request.json()
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{ORDER_SERVICE_URL}/custom_order", json=body)
-            response.raise_for_status()
-            return response.json()
+        return await idempotent_order_call(request, "/custom_order", body, response)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to create custom order: {str(e)}")
+        raise upstream_error(e, "Failed to create custom order")
+
+@app.get("/gateway/admission/stats", tags=["Gateway"])
+def get_admission_stats():
+    """Status antrean admission control untuk create_order/custom_order"""
+    return order_admission.stats()
+
+@app.get("/gateway/idempotency/stats", tags=["Gateway"])
+def get_idempotency_stats():
+    """Statistik cache Idempotency-Key create_order/custom_order"""
+    return order_idempotency.stats()
 
 @app.post("/cancel_order", tags=["Order"])
 async def cancel_order(request: Request):
     """Batalkan pesanan"""
     try:
         body = await request.json()
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{ORDER_SERVICE_URL}/cancel_order", json=body)
-            response.raise_for_status()
-            return response.json()
+        client = get_client("order")
+        response = await client.post("/cancel_order", json=body)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to cancel order: {str(e)}")
+        raise upstream_error(e, "Failed to cancel order")
 
 @app.get("/order_status/{order_id}", tags=["Order"])
 async def get_order_status(order_id: str):
     """Status pesanan"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{ORDER_SERVICE_URL}/order_status/{order_id}")
-            response.raise_for_status()
-            return response.json()
+        client = get_client("order")
+        response = await client.get(f"/order_status/{order_id}")
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get order status: {str(e)}")
+        raise upstream_error(e, "Failed to get order status")
 
 @app.get("/order", tags=["Order"])
 async def get_all_orders():
     """Semua pesanan"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{ORDER_SERVICE_URL}/order")
-            response.raise_for_status()
-            return response.json()
+        client = get_client("order")
+        response = await client.get("/order")
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get orders: {str(e)}")
+        raise upstream_error(e, "Failed to get orders")
 
 @app.get("/today_orders", tags=["Order"])
-async def get_today_orders():
+async def get_today_orders(request: Request):
     """Pesanan hari ini"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{ORDER_SERVICE_URL}/today_orders")
-            response.raise_for_status()
-            return response.json()
+        return await conditional_get(request, "order", "/today_orders")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get today orders: {str(e)}")
+        raise upstream_error(e, "Failed to get today orders")
 
 # ========== REPORT ENDPOINTS ==========
 @app.get("/report", tags=["Report"])
@@ -197,12 +1401,12 @@ async def get_report(
         if menu_name:
             params["menu_name"] = menu_name
             
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{REPORT_SERVICE_URL}/report", params=params)
-            response.raise_for_status()
-            return response.json()
+        client = get_client("report")
+        response = await client.get("/report", params=params)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get report: {str(e)}")
+        raise upstream_error(e, "Failed to get report")
 
 @app.get("/report/top_customers", tags=["Report"])
 async def get_top_customers(
@@ -211,15 +1415,15 @@ async def get_top_customers(
 ):
     """Ambil pelanggan loyal"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{REPORT_SERVICE_URL}/report/top_customers",
-                params={"start_date": start_date, "end_date": end_date}
-            )
-            response.raise_for_status()
-            return response.json()
+        client = get_client("report")
+        response = await client.get(
+            "/report/top_customers",
+            params={"start_date": start_date, "end_date": end_date}
+        )
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get top customers: {str(e)}")
+        raise upstream_error(e, "Failed to get top customers")
 
 @app.get("/report/suggested_menu", tags=["Report"])
 async def get_suggested_menu(
@@ -228,60 +1432,228 @@ async def get_suggested_menu(
 ):
     """Ambil daftar menu usulan pelanggan"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{REPORT_SERVICE_URL}/report/suggested_menu",
-                params={"start_date": start_date, "end_date": end_date}
-            )
-            response.raise_for_status()
-            return response.json()
+        client = get_client("report")
+        response = await client.get(
+            "/report/suggested_menu",
+            params={"start_date": start_date, "end_date": end_date}
+        )
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get suggested menu: {str(e)}")
+        raise upstream_error(e, "Failed to get suggested menu")
 
 # ========== MENU ENDPOINTS ==========
 @app.get("/menu", tags=["Menu"])
-async def get_menu():
+async def get_menu(request: Request):
     """Ambil daftar menu"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{MENU_SERVICE_URL}/menu")
-            response.raise_for_status()
-            return response.json()
+        return await conditional_coalesced_get(request, "menu", "/menu")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get menu: {str(e)}")
+        raise upstream_error(e, "Failed to get menu")
+
+@app.get("/menu/all", tags=["Menu"])
+async def get_all_menus(request: Request):
+    """Ambil semua menu (admin)"""
+    try:
+        return await conditional_coalesced_get(request, "menu", "/menu/all")
+    except Exception as e:
+        raise upstream_error(e, "Failed to get all menus")
+
+@app.get("/flavors", tags=["Menu"])
+async def get_flavors(request: Request):
+    """Ambil varian rasa yang tersedia"""
+    try:
+        return await conditional_coalesced_get(request, "menu", "/flavors")
+    except Exception as e:
+        raise upstream_error(e, "Failed to get flavors")
+
+@app.get("/flavors/all", tags=["Menu"])
+async def get_all_flavors(request: Request):
+    """Ambil semua varian rasa (admin)"""
+    try:
+        return await conditional_coalesced_get(request, "menu", "/flavors/all")
+    except Exception as e:
+        raise upstream_error(e, "Failed to get all flavors")
 
 @app.post("/menu_suggestion", tags=["Menu"])
 async def submit_menu_suggestion(request: Request):
     """Submit usulan menu"""
     try:
         body = await request.json()
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{REPORT_SERVICE_URL}/menu_suggestion", json=body)
-            response.raise_for_status()
-            return response.json()
+        client = get_client("report")
+        response = await client.post("/menu_suggestion", json=body)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to submit menu suggestion: {str(e)}")
+        raise upstream_error(e, "Failed to submit menu suggestion")
 
-# ========== MCP ENDPOINTS (untuk kompatibilitas) ==========
-@app.api_route("/mcp/menus", methods=["POST"])
-async def proxy_menus(request: Request):
-    return await forward(request, f"{MENU_SERVICE_URL}/mcp")
-
-@app.api_route("/mcp/orders", methods=["POST"])
-async def proxy_orders(request: Request):
-    return await forward(request, f"{ORDER_SERVICE_URL}/mcp")
-
-@app.api_route("/mcp/kitchen", methods=["POST"])
-async def proxy_kitchen(request: Request):
-    return await forward(request, f"{KITCHEN_SERVICE_URL}/mcp")
-
-# Util fungsi forwarding request
-async def forward(request: Request, target_url: str):
-    async with httpx.AsyncClient() as client:
-        response = await client.request(
-            method=request.method,
-            url=target_url,
-            headers=dict(request.headers),
-            content=await request.body()
+# ========== BOOTSTRAP BUNDLES ==========
+# Satu round trip untuk load awal dashboard: semua bagian diambil paralel dari upstream,
+# kegagalan satu bagian tidak menggagalkan bagian lain.
+BOOTSTRAP_PART_TIMEOUT = float(os.getenv("GATEWAY_BOOTSTRAP_PART_TIMEOUT", "10"))
+BOOTSTRAP_GZIP_MIN_SIZE = 1024
+
+BOOTSTRAP_BUNDLES = {
+    "report": {
+        "menu": ("menu", "/menu"),
+        "inventory": ("inventory", "/list_ingredients?show_unavailable=true"),
+        "kitchen_orders": ("kitchen", "/kitchen/orders"),
+        "flavor_mapping": ("inventory", "/flavor_mapping"),
+    },
+    "kitchen": {
+        "kitchen_orders": ("kitchen", "/kitchen/orders"),
+        "kitchen_status": ("kitchen", "/kitchen/status/now"),
+        "menu": ("menu", "/menu"),
+        "flavors": ("menu", "/flavors"),
+    },
+    "qr": {
+        "menu": ("menu", "/menu"),
+        "flavors": ("menu", "/flavors/all"),
+        "kitchen_status": ("kitchen", "/kitchen/status/now"),
+        "rooms": ("order", "/rooms"),
+    },
+}
+
+async def _bootstrap_part(fetch) -> dict:
+    start = time.monotonic()
+    try:
+        data = await asyncio.wait_for(fetch(), timeout=BOOTSTRAP_PART_TIMEOUT)
+        part = {"ok": True, "data": data}
+    except Exception as e:
+        error = upstream_error(e, "Failed to fetch part")
+        part = {"ok": False, "status": error.status_code, "error": error.detail}
+    part["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+    return part
+
+async def _fetch_report_recipes(parts: dict):
+    # Nama menu dari order yang sudah selesai, fallback ke daftar menu (sama seperti report.js)
+    names = []
+    if parts.get("kitchen_orders", {}).get("ok"):
+        for order in parts["kitchen_orders"]["data"] or []:
+            if order.get("status") == "done":
+                names.extend(item.get("menu_name") for item in order.get("items") or [])
+    if not names and parts.get("menu", {}).get("ok"):
+        names = [m.get("base_name_en") for m in parts["menu"]["data"] or [] if isinstance(m, dict)]
+    names = sorted({name for name in names if name})
+    if not names:
+        return {}
+    response = await get_client("menu").post("/recipes/batch", json={"menu_names": names})
+    response.raise_for_status()
+    return response.json().get("recipes", {})
+
+def _compressed_json(request: Request, payload: dict) -> Response:
+    body = json.dumps(payload, default=str).encode()
+    headers = {"Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+    if len(body) >= BOOTSTRAP_GZIP_MIN_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/bootstrap/{bundle}", tags=["Gateway"])
+async def get_bootstrap_bundle(bundle: str, request: Request):
+    """Ambil data awal dashboard (report/kitchen/qr) dalam satu response"""
+    parts_spec = BOOTSTRAP_BUNDLES.get(bundle)
+    if parts_spec is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Bundle tidak dikenal. Pilihan: {', '.join(BOOTSTRAP_BUNDLES)}"
         )
-        return response.json()
+    start = time.monotonic()
+    names = list(parts_spec)
+    results = await asyncio.gather(*[
+        _bootstrap_part(lambda upstream=upstream, path=path: coalesced_get(upstream, path))
+        for upstream, path in parts_spec.values()
+    ])
+    parts = dict(zip(names, results))
+    if bundle == "report":
+        parts["recipes"] = await _bootstrap_part(lambda: _fetch_report_recipes(parts))
+
+    return _compressed_json(request, {
+        "bundle": bundle,
+        "ok": all(part["ok"] for part in parts.values()),
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+        "parts": parts,
+    })
+
+# ========== MCP ENDPOINTS (untuk kompatibilitas) ==========
+# MCP server di tiap service di-mount dengan transport SSE (GET /mcp untuk stream,
+# POST /mcp/messages/ untuk pesan), jadi proxy harus streaming, bukan buffer JSON.
+MCP_UPSTREAMS = {"menus": "menu", "orders": "order", "kitchen": "kitchen"}
+
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+SSE_EVENT_END = re.compile(rb"\r?\n\r?\n")
+
+@app.api_route("/mcp/{service}", methods=["GET", "POST"])
+@app.api_route("/mcp/{service}/{path:path}", methods=["GET", "POST"])
+async def proxy_mcp(service: str, request: Request, path: str = ""):
+    upstream = MCP_UPSTREAMS.get(service)
+    if upstream is None:
+        raise HTTPException(status_code=404, detail=f"Unknown MCP service '{service}'")
+    target = "/mcp" + (f"/{path}" if path else "")
+    # Session MCP hanya dikenal replica yang membuka stream-nya, jadi semua /mcp/* di-pin
+    return await forward(request, upstream, target, rewrite_prefix=f"/mcp/{service}", pinned=True)
+
+def _filter_headers(headers) -> dict:
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+def _rewrite_endpoint_event(event: bytes, prefix: str) -> bytes:
+    # Event 'endpoint' dari MCP berisi path /mcp/messages/?session_id=...;
+    # arahkan ke path gateway supaya POST berikutnya lewat proxy ini juga.
+    if not event.lstrip().startswith(b"event: endpoint"):
+        return event
+    return event.replace(b"data: /mcp/", f"data: {prefix}/".encode(), 1)
+
+# Util fungsi forwarding request (streaming, body request dan response tidak di-buffer)
+async def forward(request: Request, upstream: str, path: str, rewrite_prefix: Optional[str] = None,
+                  pinned: bool = False):
+    client = get_client(upstream)
+    upstream_request = client.build_request(
+        method=request.method,
+        url=path,
+        params=request.query_params,
+        headers=_filter_headers(request.headers),
+        # GET/HEAD/OPTIONS tanpa body, supaya tidak dikirim chunked dan tetap bisa di-retry
+        content=request.stream() if request.method in BODY_METHODS else None,
+        timeout=httpx.Timeout(10.0, read=None),
+        extensions={LB_PIN_EXTENSION: True} if pinned else None
+    )
+    try:
+        response = await client.send(upstream_request, stream=True)
+    except (httpx.HTTPError, httpx.StreamError) as e:
+        raise upstream_error(e, f"Failed to reach {upstream} MCP")
+
+    is_event_stream = response.headers.get("content-type", "").startswith("text/event-stream")
+    rewrite = rewrite_prefix if is_event_stream and "content-encoding" not in response.headers else None
+
+    async def body():
+        chunks = response.aiter_raw()
+        try:
+            if rewrite:
+                buffer = b""
+                async for chunk in chunks:
+                    buffer += chunk
+                    match = SSE_EVENT_END.search(buffer)
+                    if match:
+                        event, rest = buffer[:match.start()], buffer[match.start():]
+                        yield _rewrite_endpoint_event(event, rewrite) + rest
+                        buffer = None
+                        break
+                if buffer:
+                    yield buffer
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            # Dipanggil juga saat client disconnect, sehingga koneksi upstream ikut ditutup
+            await response.aclose()
+
+    headers = _filter_headers(response.headers)
+    if is_event_stream:
+        headers["X-Accel-Buffering"] = "no"
+    return StreamingResponse(
+        body(),
+        status_code=response.status_code,
+        headers=headers
+    )
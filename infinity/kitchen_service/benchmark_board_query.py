@@ -0,0 +1,109 @@
+"""Benchmark query board kitchen_orders dengan data pesanan setahun.
+
+Data di-seed ke schema terpisah (kitchen_bench) di database DATABASE_URL_KITCHEN,
+lalu schema dihapus lagi setelah selesai.
+
+    DATABASE_URL_KITCHEN=postgresql://... python benchmark_board_query.py
+    DATABASE_URL_KITCHEN=postgresql://... python benchmark_board_query.py --no-index
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from main import Base, KitchenOrder, kitchen_orders_query, jakarta_tz  # noqa: E402
+
+SCHEMA = "kitchen_bench"
+
+SEED_SQL = """
+INSERT INTO kitchen_orders (order_id, queue_number, status, detail, customer_name, room_name,
+                            time_receive, time_done)
+SELECT 'BENCH' || d || '-' || n, n,
+       CASE WHEN random() < 0.9 THEN 'done' WHEN random() < 0.5 THEN 'cancelled' ELSE 'habis' END,
+       '1x Kopi Susu', 'Customer ' || n, 'Ruang ' || (n % 10),
+       ts, ts + interval '7 minutes'
+FROM generate_series(1, :days) AS d,
+     generate_series(1, :per_day) AS n,
+     LATERAL (SELECT date_trunc('day', now()) - d * interval '1 day'
+                     + (n * interval '1 minute') AS ts) t
+"""
+
+TODAY_SQL = """
+INSERT INTO kitchen_orders (order_id, queue_number, status, detail, customer_name, room_name, time_receive)
+SELECT 'TODAY-' || n, n, (ARRAY['receive', 'making', 'deliver', 'done', 'done', 'cancelled'])[1 + n % 6],
+       '1x Kopi Susu', 'Customer ' || n, 'Ruang ' || (n % 10),
+       date_trunc('day', now()) + n * interval '2 minutes'
+FROM generate_series(1, :today) AS n
+"""
+
+def sync_url(url: str) -> str:
+    return re.sub(r"^postgres(ql)?(\+\w+)?://", "postgresql+psycopg2://", url)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=150)
+    parser.add_argument("--today", type=int, default=60, help="pesanan hari ini (aktif + selesai)")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--no-index", action="store_true", help="tanpa index baru, sebagai pembanding")
+    args = parser.parse_args()
+
+    engine = create_engine(sync_url(os.environ["DATABASE_URL_KITCHEN"]))
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        conn.execute(text(f"SET search_path TO {SCHEMA}"))
+        try:
+            Base.metadata.create_all(conn, tables=[KitchenOrder.__table__])
+            if args.no_index:
+                for index in KitchenOrder.__table__.indexes:
+                    if index.name.startswith("ix_kitchen_orders_") and "order_id" not in index.name:
+                        index.drop(conn)
+            started = time.perf_counter()
+            conn.execute(text(SEED_SQL), {"days": args.days, "per_day": args.per_day})
+            conn.execute(text(TODAY_SQL), {"today": args.today})
+            conn.execute(text("ANALYZE kitchen_orders"))
+            conn.commit()
+            total = conn.execute(text("SELECT count(*) FROM kitchen_orders")).scalar()
+            print(f"Seed {total} baris dalam {time.perf_counter() - started:.1f}s")
+
+            stmt = kitchen_orders_query(datetime.now(jakarta_tz))
+            sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")).scalar()
+            plan = plan if isinstance(plan, list) else json.loads(plan)
+            print("\n".join(
+                row[0] for row in conn.execute(text(f"EXPLAIN (ANALYZE, COSTS OFF) {sql}"))
+            ))
+
+            server_ms = []
+            for _ in range(args.runs):
+                result = conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}")).scalar()
+                result = result if isinstance(result, list) else json.loads(result)
+                server_ms.append(result[0]["Execution Time"])
+            roundtrip_ms = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                rows = conn.execute(stmt).all()
+                roundtrip_ms.append((time.perf_counter() - started) * 1000)
+            server_ms.sort()
+            roundtrip_ms.sort()
+            print(f"\nBaris board: {len(rows)}  (index baru: {'tidak' if args.no_index else 'ya'})")
+            print(f"Eksekusi server: p50={statistics.median(server_ms):.3f}ms "
+                  f"p95={server_ms[int(len(server_ms) * 0.95) - 1]:.3f}ms")
+            print(f"Round-trip ORM : p50={statistics.median(roundtrip_ms):.3f}ms "
+                  f"p95={roundtrip_ms[int(len(roundtrip_ms) * 0.95) - 1]:.3f}ms")
+        finally:
+            conn.rollback()
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            conn.commit()
+
+if __name__ == "__main__":
+    main()
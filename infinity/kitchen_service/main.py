@@ -4,11 +4,13 @@ from fastapi import FastAPI, HTTPException, Depends, Request, Body
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional
-from sqlalchemy import create_engine, Column, String, Text, DateTime, Integer
+from sqlalchemy import Column, String, Text, DateTime, Integer, BigInteger, Float, Index, FetchedValue, event, text, select, bindparam, literal_column, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, insert as pg_insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 from datetime import datetime, timezone, date, timedelta
 from pytz import timezone as pytz_timezone
@@ -19,19 +21,81 @@ import socket
 import logging
 import asyncio
 import json
-import requests
+import random
+import time
+import httpx
+import asyncpg
 from fastapi_mcp import FastApiMCP
+from contextlib import asynccontextmanager
+from collections import deque
 import re
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL_KITCHEN")
 ORDER_SERVICE_URL = os.getenv("ORDER_SERVICE_URL", "http://order_service:8002")
+ORDER_STATUS_TIMEOUT = float(os.getenv("ORDER_STATUS_TIMEOUT", "2"))
+ORDER_STATUS_BATCH = 500
+BOARD_SNAPSHOT_INTERVAL = float(os.getenv("KITCHEN_BOARD_SNAPSHOT_INTERVAL", "30"))
+SSE_REPLAY_BUFFER = int(os.getenv("KITCHEN_SSE_REPLAY_BUFFER", "256"))
+SSE_RETRY_MS = int(os.getenv("KITCHEN_SSE_RETRY_MS", "2000"))
+SSE_CLIENT_BUFFER = int(os.getenv("KITCHEN_SSE_CLIENT_BUFFER", "64"))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("KITCHEN_SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_HEARTBEAT = ": heartbeat\n\n"
+NOTIFY_CHANNEL = os.getenv("KITCHEN_NOTIFY_CHANNEL", "kitchen_orders")
+STATUS_NOTIFY_CHANNEL = os.getenv("KITCHEN_STATUS_NOTIFY_CHANNEL", "kitchen_status")
+LISTEN_RECONNECT_MAX_DELAY = 30.0
+# Client async dipakai ulang supaya koneksi ke order_service tetap keep-alive
+order_http = httpx.AsyncClient(timeout=5)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def async_database_url(url: str) -> str:
+    # Endpoint kitchen async, jadi akses DB lewat driver asyncpg supaya event loop tidak terblokir
+    return re.sub(r"^postgres(ql)?(\+\w+)?://", "postgresql+asyncpg://", url)
+
+class KitchenSession(Session):
+    """Session sync di balik AsyncSession; dipakai sebagai target event after_flush"""
+
+engine = create_async_engine(async_database_url(DATABASE_URL), pool_pre_ping=True)
+# expire_on_commit=False: atribut tetap bisa dibaca setelah commit tanpa lazy load
+SessionLocal = async_sessionmaker(
+    engine, autoflush=False, expire_on_commit=False, sync_session_class=KitchenSession
+)
 Base = declarative_base()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text("ALTER TABLE kitchen_orders ADD COLUMN IF NOT EXISTS items JSONB"))
+    except Exception as e:
+        logging.warning(f"Gagal menambah kolom items: {e}")
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(ROW_VERSION_MIGRATION))
+    except Exception as e:
+        logging.warning(f"Gagal memasang row_version kitchen_orders: {e}")
+    await backfill_order_items()
+    # create_all tidak menambah index ke tabel yang sudah ada
+    for index in KitchenOrder.__table__.indexes:
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+        except Exception as e:
+            logging.warning(f"Gagal membuat index {index.name}: {e}")
+    async with SessionLocal() as db:
+        await kitchen_board.load(db)
+        await kitchen_status.load(db)
+    snapshot_task = asyncio.create_task(kitchen_board.run_snapshots())
+    listener_task = asyncio.create_task(order_listener.run())
+    yield
+    listener_task.cancel()
+    snapshot_task.cancel()
+    await order_http.aclose()
+    await engine.dispose()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Kitchen Service API",
     description="Service untuk mengelola pesanan masuk ke dapur Infinity Cafe.",
     version="1.0.0"
@@ -95,9 +159,135 @@ class KitchenOrder(Base):
     time_deliver = Column(DateTime(timezone=True), nullable=True)
     time_done = Column(DateTime(timezone=True), nullable=True)
     cancel_reason = Column(Text, nullable=True)
-    orders_json = Column(Text, nullable=True)
+    orders_json = Column(Text, nullable=True)  # legacy, digantikan kolom items
+    # none_as_null: None tersimpan sebagai SQL NULL (= belum di-backfill), bukan JSON null
+    items = Column(JSONB(none_as_null=True), nullable=True)
+    # Diisi trigger setiap INSERT/UPDATE; dipakai /kitchen/orders?since=<version>
+    row_version = Column(BigInteger, nullable=True, server_default=FetchedValue(), server_onupdate=FetchedValue())
+
+    # Ambil row_version baru lewat RETURNING, supaya tidak perlu lazy load di AsyncSession
+    __mapper_args__ = {"eager_defaults": True}
+
+class KitchenOrderTombstone(Base):
+    """Jejak order yang dihapus, supaya client ?since bisa ikut membuangnya"""
+    __tablename__ = "kitchen_order_tombstones"
+    order_id = Column(String, primary_key=True)
+    row_version = Column(BigInteger, nullable=False, index=True)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Versi baris = xid transaksi penulis, bukan nextval di bawah advisory lock global (lock itu
+# membuat semua tulis ke kitchen_orders antre sampai commit). xid tidak berurutan menurut
+# commit, jadi `version` yang dikirim ke client adalah watermark pg_snapshot_xmin: xid tertua
+# yang masih berjalan. Tulisan yang belum commit saat dibaca selalu punya xid >= watermark,
+# sehingga ikut terambil di fetch ?since berikutnya. Trade-off: selama ada transaksi panjang
+# (di database mana pun dalam cluster) watermark tertahan dan order yang sama bisa terkirim
+# ulang beberapa kali; client menimpa per order_id jadi hasilnya tetap benar.
+#
+# Dijalankan sekali: startup berikutnya hanya mengecek trigger, tanpa DROP/CREATE (yang
+# mengambil ACCESS EXCLUSIVE lock di kitchen_orders).
+ROW_VERSION_MIGRATION = """
+DO $migration$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_trigger
+               WHERE tgname = 'kitchen_orders_version_xid' AND tgrelid = 'kitchen_orders'::regclass) THEN
+        RETURN;
+    END IF;
+    -- Beberapa worker bisa start bersamaan; yang kalah cukup melihat trigger sudah ada
+    PERFORM pg_advisory_xact_lock(hashtext('kitchen_orders_version_migration'));
+    IF EXISTS (SELECT 1 FROM pg_trigger
+               WHERE tgname = 'kitchen_orders_version_xid' AND tgrelid = 'kitchen_orders'::regclass) THEN
+        RETURN;
+    END IF;
 
-Base.metadata.create_all(bind=engine)
+    ALTER TABLE kitchen_orders ADD COLUMN IF NOT EXISTS row_version BIGINT;
+    DROP TRIGGER IF EXISTS kitchen_orders_version ON kitchen_orders;
+    -- Versi lama (sequence) tidak sebanding dengan xid: baris yang mungkin masih di board
+    -- distempel ulang, sisanya 0 supaya tidak terkirim ulang ke client ?since
+    UPDATE kitchen_orders SET row_version = CASE
+        WHEN status IN ('receive', 'making', 'deliver') OR time_receive >= now() - interval '1 day'
+        THEN pg_current_xact_id()::text::bigint ELSE 0 END;
+    UPDATE kitchen_order_tombstones SET row_version = 0;
+    DROP SEQUENCE IF EXISTS kitchen_orders_version_seq;
+
+    CREATE OR REPLACE FUNCTION kitchen_orders_bump_version() RETURNS trigger AS $fn$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO kitchen_order_tombstones (order_id, row_version)
+            VALUES (OLD.order_id, pg_current_xact_id()::text::bigint)
+            ON CONFLICT (order_id) DO UPDATE
+                SET row_version = EXCLUDED.row_version, deleted_at = now();
+            RETURN OLD;
+        END IF;
+        IF TG_OP = 'INSERT' THEN
+            DELETE FROM kitchen_order_tombstones WHERE order_id = NEW.order_id;
+        END IF;
+        NEW.row_version := pg_current_xact_id()::text::bigint;
+        RETURN NEW;
+    END
+    $fn$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER kitchen_orders_version_xid
+    BEFORE INSERT OR UPDATE OR DELETE ON kitchen_orders
+    FOR EACH ROW EXECUTE FUNCTION kitchen_orders_bump_version();
+END
+$migration$
+"""
+
+BOARD_ACTIVE_STATUSES = ('receive', 'making', 'deliver')
+BOARD_FINISHED_STATUSES = ('done', 'cancelled', 'habis')
+
+def status_in(statuses: tuple):
+    # Dirender literal (bukan bind param) supaya planner bisa mencocokkan predicate partial index
+    return KitchenOrder.status.in_(bindparam(None, list(statuses), expanding=True, literal_execute=True))
+
+# Pesanan aktif cuma segelintir, sedangkan yang selesai terus bertambah: partial index
+# menjaga board tetap index scan kecil walau tabel sudah berisi data bertahun-tahun
+Index("ix_kitchen_orders_active_time_receive", KitchenOrder.time_receive,
+      postgresql_where=KitchenOrder.status.in_(BOARD_ACTIVE_STATUSES))
+Index("ix_kitchen_orders_finished_time_receive", KitchenOrder.time_receive,
+      postgresql_where=KitchenOrder.status.in_(BOARD_FINISHED_STATUSES))
+Index("ix_kitchen_orders_status_time_receive", KitchenOrder.status, KitchenOrder.time_receive)
+Index("ix_kitchen_orders_row_version", KitchenOrder.row_version)
+
+# Batas atas bucket histogram durasi (detik); bucket terakhir untuk yang melebihi batas
+DURATION_BUCKETS = (30, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1800, 2700, 3600, 7200)
+
+class KitchenStageStats(Base):
+    """Agregat durasi per tahap, di-update setiap transisi status (tanpa scan riwayat)"""
+    __tablename__ = "kitchen_stage_stats"
+    stage = Column(String, primary_key=True)      # receive_to_making, making_to_deliver, ...
+    dimension = Column(String, primary_key=True)  # all, menu, hour, day
+    bucket = Column(String, primary_key=True)     # nama menu / jam 0-23 / tanggal
+    count = Column(BigInteger, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0)
+    total_sq = Column(Float, nullable=False, default=0)
+    min_seconds = Column(Float, nullable=True)
+    max_seconds = Column(Float, nullable=True)
+    histogram = Column(ARRAY(BigInteger), nullable=False)
+
+@event.listens_for(KitchenSession, "after_flush")
+def notify_order_changes(session, flush_context):
+    """NOTIFY per order yang berubah; Postgres baru mengirimnya saat commit (batal bila rollback)."""
+    order_ids = {
+        obj.order_id
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        if isinstance(obj, KitchenOrder)
+    }
+    for order_id in order_ids:
+        session.connection().execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": NOTIFY_CHANNEL, "payload": order_id}
+        )
+
+@event.listens_for(KitchenSession, "after_flush")
+def notify_kitchen_status(session, flush_context):
+    """NOTIFY status ON/OFF supaya cache di worker lain ikut berubah setelah commit."""
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, KitchenStatus):
+            session.connection().execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": STATUS_NOTIFY_CHANNEL, "payload": "1" if obj.is_open else "0"}
+            )
 
 class OrderItem(BaseModel):
     menu_name: str
@@ -106,6 +296,105 @@ class OrderItem(BaseModel):
     preference: Optional[str] = ""
     notes: Optional[str] = ""
 
+class KitchenItem(BaseModel):
+    """Struktur item yang disimpan di kolom items (JSONB)"""
+    menu_name: str
+    quantity: int = Field(1, ge=1)
+    preference: Optional[str] = None
+    notes: Optional[str] = None
+
+def normalize_items(raw_items: list) -> list:
+    """Validasi daftar item; item yang tidak valid dibuang"""
+    items = []
+    for raw in raw_items or []:
+        try:
+            item = KitchenItem.model_validate(raw if isinstance(raw, dict) else dict(raw))
+        except (ValidationError, TypeError, ValueError):
+            logging.warning(f"Item pesanan tidak valid diabaikan: {raw}")
+            continue
+        items.append(item.model_dump())
+    return items
+
+def parse_detail_items(detail_str: Optional[str]) -> list:
+    """Parse string detail lama ("2x Menu (varian) - Notes: ..."); hanya untuk backfill"""
+    items = []
+    for item in (detail_str or '').split('\n'):
+        item = item.strip()
+        if not item:
+            continue
+        main, *notesPart = item.split(' - Notes:')
+        notes = notesPart[0].strip() if notesPart else ''
+        name = main
+        variant = ''
+        qty = 1  # Default quantity
+        
+        # Pattern 1: "2x Menu Name (variant)"
+        variantMatch = re.match(r'^(\d+)x ([^(]+) \(([^)]+)\)$', main)
+        if variantMatch:
+            qty = int(variantMatch.group(1))
+            name = variantMatch.group(2).strip()
+            variant = variantMatch.group(3).strip()
+        else:
+            # Pattern 2: "2x Menu Name" (no variant)
+            noVarMatch = re.match(r'^(\d+)x ([^(]+)$', main)
+            if noVarMatch:
+                qty = int(noVarMatch.group(1))
+                name = noVarMatch.group(2).strip()
+            else:
+                # Pattern 3: "Menu Name (variant)" (no quantity, default to 1)
+                simpleVariantMatch = re.match(r'^([^(]+) \(([^)]+)\)$', main)
+                if simpleVariantMatch:
+                    name = simpleVariantMatch.group(1).strip()
+                    variant = simpleVariantMatch.group(2).strip()
+                else:
+                    # Pattern 4: Just "Menu Name" (no quantity, no variant)
+                    name = main.strip()
+        
+        items.append({
+            'menu_name': name,
+            'quantity': qty,
+            'preference': variant or None,
+            'notes': notes
+        })
+    return items
+
+def legacy_items(orders_json: Optional[str], detail: Optional[str]) -> list:
+    if orders_json:
+        try:
+            items = normalize_items(json.loads(orders_json))
+            if items:
+                return items
+        except ValueError:
+            pass
+    return normalize_items(parse_detail_items(detail))
+
+BACKFILL_BATCH = 500
+
+async def backfill_order_items():
+    """Migrasi sekali jalan: isi kolom items baris lama dari orders_json / parsing detail"""
+    table = KitchenOrder.__table__
+    total = 0
+    try:
+        while True:
+            # Lewat Core (bukan ORM) supaya tidak memicu NOTIFY per baris
+            async with engine.begin() as conn:
+                rows = (await conn.execute(
+                    select(table.c.order_id, table.c.orders_json, table.c.detail)
+                    .where(table.c["items"].is_(None))
+                    .limit(BACKFILL_BATCH)
+                )).all()
+                if not rows:
+                    break
+                await conn.execute(
+                    update(table).where(table.c.order_id == bindparam("b_order_id")).values(items=bindparam("b_items")),
+                    [{"b_order_id": r.order_id, "b_items": legacy_items(r.orders_json, r.detail)} for r in rows]
+                )
+            total += len(rows)
+    except Exception as e:
+        logging.warning(f"Backfill kolom items kitchen_orders gagal: {e}")
+    if total:
+        logging.info(f"Backfill kolom items: {total} pesanan lama dimigrasi")
+
 class KitchenStatusRequest(BaseModel):
     is_open: bool
 
@@ -116,50 +405,103 @@ class KitchenOrderRequest(BaseModel):
     customer_name: str
     room_name: str
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-def get_kitchen_status(db: Session):  # 
-    status = db.query(KitchenStatus).filter(KitchenStatus.id == "kitchen").first()
+async def get_kitchen_status(db: AsyncSession):  # 
+    status = await db.get(KitchenStatus, "kitchen")
     if not status:
         status = KitchenStatus(id="kitchen", is_open=True)
         db.add(status)
-        db.commit()
+        await db.commit()
     return status
 
+class KitchenStatusCache:
+    """Status ON/OFF dapur di memori; perubahan dikirim ke subscriber /kitchen/status/stream"""
+
+    def __init__(self):
+        self.is_open = None
+        self.subscribers = set()
+
+    async def load(self, db: AsyncSession):
+        status = await get_kitchen_status(db)
+        self.set(status.is_open)
+
+    async def current(self, db: AsyncSession) -> bool:
+        if self.is_open is None:
+            await self.load(db)
+        return self.is_open
+
+    def set(self, is_open: bool):
+        if is_open == self.is_open:
+            return
+        self.is_open = is_open
+        data = self.event()
+        for queue in list(self.subscribers):
+            # Cukup nilai terakhir yang relevan, jadi isi lama dibuang
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    def event(self) -> str:
+        return f"data: {json.dumps({'is_open': self.is_open})}\n\n"
+
+kitchen_status = KitchenStatusCache()
+
 class KitchenStatusRequest(BaseModel):
     is_open: bool
 
 @app.get("/kitchen/status", summary="Cek status dapur saat ini", tags=["Kitchen"])
-def get_kitchen_status_simple(db: Session = Depends(get_db)):
-    status = get_kitchen_status(db)
+async def get_kitchen_status_simple(db: AsyncSession = Depends(get_db)):
     return {
         "status": "success",
         "data": {
-            "is_open": status.is_open
+            "is_open": await kitchen_status.current(db)
         }
     }
 
 @app.get("/kitchen/status/now", summary="Cek status dapur saat ini (format sederhana)", tags=["Kitchen"])
-def get_kitchen_status_now(db: Session = Depends(get_db)):
-    status = get_kitchen_status(db)
+async def get_kitchen_status_now(db: AsyncSession = Depends(get_db)):
     return {
-        "is_open": status.is_open
+        "is_open": await kitchen_status.current(db)
     }
 
+@app.get("/kitchen/status/stream", summary="Stream perubahan status dapur ON/OFF", tags=["Kitchen"])
+async def stream_kitchen_status(request: Request, db: AsyncSession = Depends(get_db)):
+    await kitchen_status.current(db)
+    queue = asyncio.Queue(maxsize=1)
+    kitchen_status.subscribers.add(queue)
+    async def event_generator():
+        try:
+            # Kirim status saat ini dulu, lalu hanya perubahan
+            yield kitchen_status.event()
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    data = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    data = SSE_HEARTBEAT
+                yield data
+        finally:
+            kitchen_status.subscribers.discard(queue)
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/kitchen/status", summary="Atur status dapur ON/OFF", tags=["Kitchen"])
 async def set_kitchen_status(
     status_request: KitchenStatusRequest, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
 
-    status = get_kitchen_status(db)
+    status = await get_kitchen_status(db)
     status.is_open = status_request.is_open
-    db.commit()
+    await db.commit()
+    kitchen_status.set(status_request.is_open)
     return {
         "status": "success",
         "message": f"Kitchen status set to {'ON' if status_request.is_open else 'OFF'}",
@@ -167,7 +509,7 @@ async def set_kitchen_status(
     }
 
 @app.post("/receive_order", summary="Terima pesanan", tags=["Kitchen"], operation_id="receive order")
-async def receive_order(order: KitchenOrderRequest, db: Session = Depends(get_db)):
+async def receive_order(order: KitchenOrderRequest, db: AsyncSession = Depends(get_db)):
     # Validasi order_id tidak boleh kosong atau hanya whitespace
     if not order.order_id or not order.order_id.strip():
         raise HTTPException(
@@ -212,13 +554,12 @@ async def receive_order(order: KitchenOrderRequest, db: Session = Depends(get_db
                 detail=f"Quantity pada item ke-{i+1} harus lebih dari 0"
             )
     
-    status = get_kitchen_status(db)
-    if not status.is_open:
+    if not await kitchen_status.current(db):
         # Jika status dapur OFF, tolak pesanan baru
         raise HTTPException(status_code=400, detail="Kitchen is currently OFF. Tidak bisa menerima pesanan baru.")
 
     # Cek apakah order sudah ada
-    existing_order = db.query(KitchenOrder).filter(KitchenOrder.order_id == order.order_id).first()
+    existing_order = await db.get(KitchenOrder, order.order_id)
     if existing_order:
         raise HTTPException(status_code=400, detail="Order already exists")
 
@@ -229,7 +570,6 @@ async def receive_order(order: KitchenOrderRequest, db: Session = Depends(get_db
         (f" - Notes: {item.notes}" if getattr(item, 'notes', None) else "")
         for item in order.orders
     ])
-    import json
     now = datetime.now(jakarta_tz)
     new_order = KitchenOrder(
         order_id=order.order_id,
@@ -238,12 +578,12 @@ async def receive_order(order: KitchenOrderRequest, db: Session = Depends(get_db
         customer_name=order.customer_name,
         room_name=order.room_name,
         time_receive=now,
-        orders_json=json.dumps([item.model_dump() if hasattr(item, 'model_dump') else dict(item) for item in order.orders])
+        items=normalize_items([item.model_dump() for item in order.orders])
     )
     db.add(new_order)
-    db.commit()
+    await db.commit()
     # Broadcast ke semua client yang terhubung
-    await broadcast_orders(db)
+    await kitchen_board.apply(new_order)
     return {
         "message": "Order received by kitchen",
         "order_id": order.order_id,
@@ -251,8 +591,9 @@ async def receive_order(order: KitchenOrderRequest, db: Session = Depends(get_db
         "time_receive": now.isoformat()
     }
 
-@app.post("/kitchen/update_status/{order_id}", summary="Update status pesanan", tags=["Kitchen"], operation_id="change status")
-async def update_status(order_id: str, status: str, reason: str = "", db: Session = Depends(get_db)):
+ALLOWED_STATUSES = ["receive", "making", "deliver", "done", "cancelled", "habis"]
+
+def validate_status(status: str) -> str:
     # Validasi status tidak boleh kosong atau hanya whitespace
     if not status or not status.strip():
         raise HTTPException(
@@ -261,32 +602,27 @@ async def update_status(order_id: str, status: str, reason: str = "", db: Sessio
         )
     
     # Validasi status values (daftar status yang diizinkan)
-    allowed_statuses = ["receive", "making", "deliver", "done", "cancelled", "habis"]
-    if status.strip().lower() not in [s.lower() for s in allowed_statuses]:
+    if status.strip().lower() not in [s.lower() for s in ALLOWED_STATUSES]:
         raise HTTPException(
             status_code=400,
-            detail=f"Status tidak valid. Status yang diizinkan: {', '.join(allowed_statuses)}"
+            detail=f"Status tidak valid. Status yang diizinkan: {', '.join(ALLOWED_STATUSES)}"
         )
     
     # Normalize status (gunakan yang sudah di-strip)
-    status = status.strip()
-    
-    timestamp = datetime.now(jakarta_tz)
-    order = db.query(KitchenOrder).filter(KitchenOrder.order_id == order_id).first()
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    # Validasi status dan reason
-    if status in ["cancelled", "habis"] and not reason:
-        raise HTTPException(status_code=400, detail="Alasan wajib untuk status cancel, atau habis")
+    return status.strip()
 
+async def apply_status_change(db: AsyncSession, order: KitchenOrder, status: str, reason: str, timestamp: datetime):
+    """Terapkan status ke order (belum di-commit): timestamp tahap, agregat durasi, alasan cancel"""
     # Update timestamp sesuai status
     if status == "making" and not order.time_making:
         order.time_making = timestamp
+        await record_stage_durations(db, order, status)
     elif status == "deliver" and not order.time_deliver:
         order.time_deliver = timestamp
+        await record_stage_durations(db, order, status)
     elif status == "done" and not order.time_done:
         order.time_done = timestamp
+        await record_stage_durations(db, order, status)
 
     if status in ["cancelled", "habis"]:
         if not reason:
@@ -298,21 +634,94 @@ async def update_status(order_id: str, status: str, reason: str = "", db: Sessio
 
     # Update status
     order.status = status
-    db.commit()
 
-    # Notify order_service (jika bukan dari order_service)
-    try:
-        requests.post(
-            f"http://order_service:8002/internal/update_status/{order_id}",
-            json={"status": status},
-            timeout=3
-        )
-        logging.info(f"✅ Berhasil mengirim update status '{status}' untuk order {order_id} ke order_service.")
-    except Exception as e:
-        logging.error(f"❌ Gagal mengirim update status ke order_service untuk order {order_id}: {e}")
+class StatusUpdateItem(BaseModel):
+    order_id: str
+    status: str
+    reason: str = ""
+
+class BatchStatusUpdateRequest(BaseModel):
+    updates: List[StatusUpdateItem] = Field(..., min_length=1, max_length=100)
+
+@app.post("/kitchen/update_status/batch", summary="Update status banyak pesanan sekaligus", tags=["Kitchen"])
+async def update_status_batch(req: BatchStatusUpdateRequest, notify_order: bool = True, db: AsyncSession = Depends(get_db)):
+    """Semua update dalam satu transaksi: gagal satu, tidak ada yang berubah."""
+    updates = []
+    for item in req.updates:
+        status = validate_status(item.status)
+        if status in ["cancelled", "habis"] and not item.reason:
+            raise HTTPException(status_code=400, detail=f"Alasan wajib untuk status cancel, atau habis (order {item.order_id})")
+        updates.append((item.order_id.strip(), status, item.reason))
+    order_ids = [order_id for order_id, _, _ in updates]
+    if len(set(order_ids)) != len(order_ids):
+        raise HTTPException(status_code=400, detail="Order ID tidak boleh duplikat dalam satu batch")
+
+    orders = {
+        o.order_id: o for o in (await db.execute(
+            select(KitchenOrder).where(KitchenOrder.order_id.in_(order_ids))
+        )).scalars().all()
+    }
+    missing = [order_id for order_id in order_ids if order_id not in orders]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Order not found: {', '.join(missing)}")
+
+    timestamp = datetime.now(jakarta_tz)
+    for order_id, status, reason in updates:
+        await apply_status_change(db, orders[order_id], status, reason, timestamp)
+    await db.commit()
+
+    # Satu notifikasi gabungan ke order_service, bukan satu request per order
+    if notify_order:
+        try:
+            await order_http.post(
+                f"{ORDER_SERVICE_URL}/internal/update_status/batch",
+                json={"updates": [{"order_id": order_id, "status": status} for order_id, status, _ in updates]},
+                timeout=3
+            )
+            logging.info(f"✅ Berhasil mengirim batch update status {len(updates)} order ke order_service.")
+        except Exception as e:
+            logging.error(f"❌ Gagal mengirim batch update status ke order_service: {e}")
+
+    # Satu event broadcast untuk seluruh batch
+    await kitchen_board.apply_many(list(orders.values()))
+
+    return {
+        "message": f"{len(updates)} order updated",
+        "updated": [{"order_id": order_id, "status": status} for order_id, status, _ in updates],
+        "timestamp": timestamp.isoformat()
+    }
+
+@app.post("/kitchen/update_status/{order_id}", summary="Update status pesanan", tags=["Kitchen"], operation_id="change status")
+async def update_status(order_id: str, status: str, reason: str = "", notify_order: bool = True, db: AsyncSession = Depends(get_db)):
+    status = validate_status(status)
+    
+    timestamp = datetime.now(jakarta_tz)
+    order = await db.get(KitchenOrder, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    # Validasi status dan reason
+    if status in ["cancelled", "habis"] and not reason:
+        raise HTTPException(status_code=400, detail="Alasan wajib untuk status cancel, atau habis")
+
+    await apply_status_change(db, order, status, reason, timestamp)
+    await db.commit()
+
+    # Notify order_service (jika bukan dari order_service).
+    # notify_order=false dipakai gateway yang sudah mempropagasikan status ke order_service sendiri.
+    if notify_order:
+        try:
+            await order_http.post(
+                f"{ORDER_SERVICE_URL}/internal/update_status/{order_id}",
+                json={"status": status},
+                timeout=3
+            )
+            logging.info(f"✅ Berhasil mengirim update status '{status}' untuk order {order_id} ke order_service.")
+        except Exception as e:
+            logging.error(f"❌ Gagal mengirim update status ke order_service untuk order {order_id}: {e}")
 
     # Broadcast ke semua client
-    await broadcast_orders(db)
+    await kitchen_board.apply(order)
 
     return {
         "message": f"Order {order_id} updated to status '{status}'",
@@ -323,8 +732,8 @@ async def update_status(order_id: str, status: str, reason: str = "", db: Sessio
     
     
 @app.get("/kitchen/duration/{order_id}", summary="Lihat durasi pesanan", tags=["Kitchen"], operation_id="durasi")
-def get_order_durations(order_id: str, db: Session = Depends(get_db)):
-    order = db.query(KitchenOrder).filter(KitchenOrder.order_id == order_id).first()
+async def get_order_durations(order_id: str, db: AsyncSession = Depends(get_db)):
+    order = await db.get(KitchenOrder, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     durations = {}
@@ -334,48 +743,426 @@ def get_order_durations(order_id: str, db: Session = Depends(get_db)):
         durations["making_to_done"] = (order.time_done - order.time_making).total_seconds()
     return durations
 
+# ========== ANALYTICS DURASI ==========
+# Tahap yang selesai pada transisi ke status tertentu: (nama tahap, kolom awal, kolom akhir)
+STAGES_BY_STATUS = {
+    "making": [("receive_to_making", "time_receive", "time_making")],
+    "deliver": [("making_to_deliver", "time_making", "time_deliver")],
+    "done": [("deliver_to_done", "time_deliver", "time_done"), ("receive_to_done", "time_receive", "time_done")],
+}
+STAGE_NAMES = [stage for stages in STAGES_BY_STATUS.values() for stage, _, _ in stages]
+STAT_DIMENSIONS = ("all", "menu", "hour", "day")
+
+def order_menu_names(order: KitchenOrder) -> set:
+    return {item["menu_name"] for item in order.items or [] if item.get("menu_name")}
+
+def duration_bucket_index(seconds: float) -> int:
+    for i, upper in enumerate(DURATION_BUCKETS):
+        if seconds <= upper:
+            return i
+    return len(DURATION_BUCKETS)
+
+async def record_stage_durations(db: AsyncSession, order: KitchenOrder, status: str):
+    """Tambahkan durasi tahap yang baru selesai ke agregat, dalam transaksi yang sama dengan update status"""
+    received = order.time_receive.astimezone(jakarta_tz) if order.time_receive else None
+    buckets = [("all", "all")] + [("menu", name) for name in order_menu_names(order)]
+    if received:
+        buckets += [("hour", str(received.hour)), ("day", received.date().isoformat())]
+    for stage, start_attr, end_attr in STAGES_BY_STATUS.get(status, []):
+        start, end = getattr(order, start_attr), getattr(order, end_attr)
+        if not start or not end:
+            continue
+        seconds = max((end - start).total_seconds(), 0.0)
+        # Index array Postgres dimulai dari 1
+        slot = duration_bucket_index(seconds) + 1
+        histogram = [0] * (len(DURATION_BUCKETS) + 1)
+        histogram[slot - 1] = 1
+        for dimension, bucket in buckets:
+            stmt = pg_insert(KitchenStageStats).values(
+                stage=stage, dimension=dimension, bucket=bucket, count=1, total=seconds,
+                total_sq=seconds * seconds, min_seconds=seconds, max_seconds=seconds, histogram=histogram
+            )
+            table = KitchenStageStats.__table__.c
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=["stage", "dimension", "bucket"],
+                set_={
+                    "count": table.count + 1,
+                    "total": table.total + seconds,
+                    "total_sq": table.total_sq + seconds * seconds,
+                    "min_seconds": func.least(table.min_seconds, seconds),
+                    "max_seconds": func.greatest(table.max_seconds, seconds),
+                    # Upsert atomik per bucket histogram, aman untuk update paralel
+                    "histogram": literal_column(f"kitchen_stage_stats.histogram[:{slot - 1}] || "
+                                      f"(kitchen_stage_stats.histogram[{slot}] + 1) || "
+                                      f"kitchen_stage_stats.histogram[{slot + 1}:]"),
+                }
+            ))
+
+def approx_percentile(stats: KitchenStageStats, q: float) -> Optional[float]:
+    """Perkiraan persentil dari histogram, interpolasi linear di dalam bucket"""
+    if not stats.count:
+        return None
+    target = q * stats.count
+    cumulative = 0
+    for i, n in enumerate(stats.histogram):
+        if n and cumulative + n >= target:
+            lower = DURATION_BUCKETS[i - 1] if i > 0 else 0
+            upper = DURATION_BUCKETS[i] if i < len(DURATION_BUCKETS) else stats.max_seconds
+            lower, upper = max(lower, stats.min_seconds), min(upper, stats.max_seconds)
+            return round(lower + (upper - lower) * (target - cumulative) / n, 1)
+        cumulative += n
+    return stats.max_seconds
+
+def summarize_stats(stats: KitchenStageStats) -> dict:
+    mean = stats.total / stats.count
+    variance = max(stats.total_sq / stats.count - mean * mean, 0.0)
+    return {
+        "count": stats.count,
+        "mean_seconds": round(mean, 1),
+        "stddev_seconds": round(variance ** 0.5, 1),
+        "min_seconds": round(stats.min_seconds, 1),
+        "max_seconds": round(stats.max_seconds, 1),
+        "p50_seconds": approx_percentile(stats, 0.5),
+        "p90_seconds": approx_percentile(stats, 0.9),
+        "p95_seconds": approx_percentile(stats, 0.95),
+    }
+
+@app.get("/kitchen/analytics/durations", summary="Statistik durasi tahap pesanan", tags=["Kitchen"])
+async def get_duration_analytics(
+    group_by: str = "all",
+    stage: Optional[str] = None,
+    since: Optional[date] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """Statistik durasi receive→making→deliver→done per menu, jam masuk atau tanggal."""
+    if group_by not in STAT_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"group_by tidak valid. Pilihan: {', '.join(STAT_DIMENSIONS)}")
+    if stage is not None and stage not in STAGE_NAMES:
+        raise HTTPException(status_code=400, detail=f"stage tidak valid. Pilihan: {', '.join(STAGE_NAMES)}")
+    query = select(KitchenStageStats).where(KitchenStageStats.dimension == group_by)
+    if stage:
+        query = query.where(KitchenStageStats.stage == stage)
+    if since and group_by == "day":
+        query = query.where(KitchenStageStats.bucket >= since.isoformat())
+    rows = (await db.execute(query)).scalars().all()
+    result = {name: {} for name in ([stage] if stage else STAGE_NAMES)}
+    for row in rows:
+        result[row.stage][row.bucket] = summarize_stats(row)
+    return {
+        "status": "success",
+        "data": {"group_by": group_by, "stages": result}
+    }
+
 @app.get("/stream/orders", summary="SSE stream pesanan hari ini", tags=["Kitchen"], operation_id="order stream")
-async def stream_orders(request: Request, db: Session = Depends(get_db)):
-    queue = asyncio.Queue()
-    subscribers.add(queue)
+async def stream_orders(request: Request, snapshot: bool = False):
+    subscriber = StreamSubscriber()
+    subscribers.add(subscriber)
+    # Dihitung tanpa await setelah subscribe, jadi tidak ada event yang terlewat atau dobel
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        backlog = kitchen_board.replay(last_event_id)
+    elif snapshot:
+        backlog = [kitchen_board.snapshot_event()]
+    else:
+        backlog = []
     async def event_generator():
         try:
+            # Jitter retry supaya tablet tidak reconnect serentak setelah Wi-Fi putus
+            yield f"retry: {SSE_RETRY_MS + random.randint(0, SSE_RETRY_MS)}\n\n"
+            for data in backlog:
+                yield data
             while True:
                 if await request.is_disconnected():
                     break
-                data = await queue.get()
+                try:
+                    data = await subscriber.next(SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Heartbeat juga memaksa write, sehingga client mati terdeteksi tanpa menunggu event
+                    data = SSE_HEARTBEAT
                 yield data
         finally:
-            subscribers.remove(queue)
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
-
-async def broadcast_orders(db: Session):
-    today = datetime.now(jakarta_tz).date()
-    orders_today = db.query(KitchenOrder).filter(
-        KitchenOrder.status.in_(['receive', 'making', 'deliver'])
-    ).order_by(KitchenOrder.time_receive.asc()).all()
-    
-    result = []
-    for o in orders_today:
-        ts = o.time_done or o.time_deliver or o.time_making or o.time_receive or datetime.now(jakarta_tz)
-        result.append({
-            "id": o.order_id,
-            "queue_number": o.queue_number,
-            "menu": o.detail,
-            "status": o.status,
-            "timestamp": ts.isoformat(),
-            "timestamp_receive": o.time_receive.isoformat() if o.time_receive else None,
-            "customer_name": o.customer_name,
-            "room_name": o.room_name,
-            "cancel_reason": o.cancel_reason or ""
-        })
-    
-    data = f"data: {json.dumps({'orders': result})}\n\n"
-    for queue in list(subscribers):
-        try:
-            await queue.put(data)
-        except Exception as e:
-            logging.error(f"Error broadcasting to subscriber: {e}")
+            subscribers.discard(subscriber)
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/stream/stats", summary="Statistik subscriber SSE", tags=["Utility"])
+def get_stream_stats():
+    return {
+        "subscribers": len(subscribers),
+        "queued_events": sum(sub.queue.qsize() for sub in subscribers),
+        "lagging_subscribers": sum(1 for sub in subscribers if sub.resync),
+        "dropped_events": kitchen_board.dropped_events,
+        "overflows": kitchen_board.overflows,
+        "resyncs": kitchen_board.resyncs,
+        "seq": kitchen_board.seq,
+        "buffered_events": len(kitchen_board.history),
+        "board_size": len(kitchen_board.orders),
+        "status_subscribers": len(kitchen_status.subscribers),
+        "listener": order_listener.stats(),
+    }
+
+# ========== KITCHEN BOARD ==========
+# Board pesanan aktif disimpan di memori dan di-update per mutasi, sehingga
+# receive/update/sync cukup menyiarkan delta satu order, bukan seluruh board.
+
+def board_entry(o: KitchenOrder) -> dict:
+    ts = o.time_done or o.time_deliver or o.time_making or o.time_receive or datetime.now(jakarta_tz)
+    return {
+        "id": o.order_id,
+        "queue_number": o.queue_number,
+        "menu": o.detail,
+        "status": o.status,
+        "timestamp": ts.isoformat(),
+        "timestamp_receive": o.time_receive.isoformat() if o.time_receive else None,
+        "customer_name": o.customer_name,
+        "room_name": o.room_name,
+        "cancel_reason": o.cancel_reason or ""
+    }
+
+class StreamSubscriber:
+    """Queue SSE terbatas per client; bila penuh, isi antrean diganti satu snapshot terbaru"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=SSE_CLIENT_BUFFER)
+        self.resync = False
+
+    def offer(self, data: str) -> int:
+        """Masukkan event, return jumlah event yang dibuang"""
+        if self.resync:
+            # Sudah tertinggal: event ini ikut tercakup snapshot yang akan dikirim
+            return 1
+        if self.queue.full():
+            dropped = self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resync = True
+            self.queue.put_nowait(None)
+            return dropped
+        self.queue.put_nowait(data)
+        return 0
+
+    async def next(self, timeout: float) -> str:
+        data = await asyncio.wait_for(self.queue.get(), timeout)
+        if self.resync:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.resync = False
+            kitchen_board.resyncs += 1
+            return kitchen_board.snapshot_event()
+        return data
+
+class KitchenBoard:
+    """Materialized view pesanan aktif + siaran delta bernomor urut (seq)"""
+
+    def __init__(self):
+        self.orders = {}
+        self.seq = 0
+        # Epoch membedakan stream antar restart; id event = "<epoch>-<seq>"
+        self.epoch = str(int(time.time() * 1000))
+        self.history = deque(maxlen=SSE_REPLAY_BUFFER)
+        self.resyncs = 0
+        self.dropped_events = 0
+        self.overflows = 0
+
+    async def load(self, db: AsyncSession):
+        active = (await db.execute(
+            select(KitchenOrder)
+            .where(status_in(BOARD_ACTIVE_STATUSES))
+            .order_by(KitchenOrder.time_receive.asc())
+        )).scalars().all()
+        self.orders = {o.order_id: board_entry(o) for o in active}
+
+    def snapshot(self) -> list:
+        return sorted(self.orders.values(), key=lambda e: e["timestamp_receive"] or "")
+
+    def _diff(self, order: KitchenOrder) -> list:
+        """Update board dengan state terbaru satu order, return delta [(type, payload)]"""
+        current = self.orders.get(order.order_id)
+        if order.status not in BOARD_ACTIVE_STATUSES:
+            if self.orders.pop(order.order_id, None) is None:
+                return []
+            return [("removed", {"id": order.order_id, "status": order.status,
+                                 "cancel_reason": order.cancel_reason or ""})]
+
+        entry = board_entry(order)
+        self.orders[order.order_id] = entry
+        if current is None:
+            return [("added", {"order": entry})]
+        deltas = []
+        if current["status"] != entry["status"]:
+            deltas.append(("status_changed", {"id": order.order_id, "status": entry["status"],
+                                              "timestamp": entry["timestamp"]}))
+        if current["menu"] != entry["menu"] or current["cancel_reason"] != entry["cancel_reason"]:
+            deltas.append(("items_changed", {"id": order.order_id, "menu": entry["menu"],
+                                             "cancel_reason": entry["cancel_reason"]}))
+        return deltas
+
+    async def apply(self, order: KitchenOrder):
+        """Bandingkan state terbaru satu order dengan board lalu siarkan delta-nya"""
+        for event_type, payload in self._diff(order):
+            await self.publish(event_type, **payload)
+
+    async def apply_many(self, orders: List[KitchenOrder]):
+        """Seperti apply, tapi semua delta dikirim sebagai satu event 'batch'"""
+        events = [{"type": event_type, **payload} for order in orders for event_type, payload in self._diff(order)]
+        if len(events) == 1:
+            await self.publish(events[0].pop("type"), **events[0])
+        elif events:
+            await self.publish("batch", events=events)
+
+    async def remove(self, order_id: str, status: Optional[str] = None, cancel_reason: str = ""):
+        if self.orders.pop(order_id, None) is not None:
+            await self.publish("removed", id=order_id, status=status, cancel_reason=cancel_reason)
+
+    async def resync(self, db: AsyncSession):
+        """Samakan board dengan DB (mis. perubahan dari worker lain) lewat delta biasa"""
+        fresh = (await db.execute(
+            select(KitchenOrder).where(
+                or_(
+                    status_in(BOARD_ACTIVE_STATUSES),
+                    KitchenOrder.order_id.in_(list(self.orders))
+                )
+            )
+        )).scalars().all()
+        for o in fresh:
+            await self.apply(o)
+        # Order yang sudah tidak ada di DB
+        for order_id in set(self.orders) - {o.order_id for o in fresh}:
+            await self.remove(order_id)
+
+    def _event(self, event_type: str, seq: int, **payload) -> str:
+        return f"id: {self.epoch}-{seq}\ndata: {json.dumps({'type': event_type, 'seq': seq, **payload})}\n\n"
+
+    def replay(self, last_event_id: Optional[str]) -> list:
+        """Event sejak Last-Event-ID, atau snapshot bila celahnya sudah tidak ada di buffer"""
+        if not last_event_id:
+            return []
+        epoch, _, seq = last_event_id.strip().partition("-")
+        last_seq = int(seq) if seq.isdigit() else None
+        if epoch == self.epoch and last_seq is not None and last_seq <= self.seq:
+            oldest = self.history[0][0] if self.history else self.seq + 1
+            if last_seq >= oldest - 1:
+                return [data for event_seq, data in self.history if event_seq > last_seq]
+        self.resyncs += 1
+        return [self.snapshot_event()]
+
+    def snapshot_event(self) -> str:
+        return self._event("snapshot", self.seq, orders=self.snapshot())
+
+    async def publish(self, event_type: str, **payload):
+        if event_type == "snapshot":
+            # Snapshot tidak menaikkan seq: client yang tidak ketinggalan cukup mengabaikannya
+            data = self._event(event_type, self.seq, **payload)
+        else:
+            self.seq += 1
+            data = self._event(event_type, self.seq, **payload)
+            self.history.append((self.seq, data))
+        for subscriber in list(subscribers):
+            was_lagging = subscriber.resync
+            self.dropped_events += subscriber.offer(data)
+            if subscriber.resync and not was_lagging:
+                self.overflows += 1
+                logging.warning("Subscriber SSE tertinggal, antrean diganti snapshot terbaru")
+
+    async def run_snapshots(self):
+        """Snapshot penuh berkala supaya client bisa resync bila ada delta yang terlewat"""
+        while True:
+            await asyncio.sleep(BOARD_SNAPSHOT_INTERVAL)
+            try:
+                async with SessionLocal() as db:
+                    await self.resync(db)
+                if subscribers:
+                    await self.publish("snapshot", orders=self.snapshot())
+            except Exception as e:
+                logging.error(f"Gagal membuat snapshot board kitchen: {e}")
+
+kitchen_board = KitchenBoard()
+
+def asyncpg_dsn(url: str) -> str:
+    # asyncpg tidak mengenal suffix driver SQLAlchemy seperti postgresql+psycopg2://
+    return re.sub(r"^postgres(ql)?\+\w+://", "postgresql://", url)
+
+class OrderChangeListener:
+    """LISTEN di DB kitchen: perubahan dari worker/replica lain diteruskan ke board lokal"""
+
+    def __init__(self):
+        self.pending = set()
+        self.connected = False
+        self.notifications = 0
+        self.reconnects = 0
+        self._wakeup = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.pending.add(payload)
+        self.notifications += 1
+        self._wakeup.set()
+
+    def _on_status_notify(self, connection, pid, channel, payload):
+        kitchen_status.set(payload == "1")
+
+    async def _apply_pending(self):
+        order_ids, self.pending = self.pending, set()
+        async with SessionLocal() as db:
+            orders = (await db.execute(
+                select(KitchenOrder).where(KitchenOrder.order_id.in_(order_ids))
+            )).scalars().all()
+        for order in orders:
+            await kitchen_board.apply(order)
+        # Order yang sudah dihapus dari DB
+        for order_id in order_ids - {o.order_id for o in orders}:
+            await kitchen_board.remove(order_id)
+
+    async def _resync(self):
+        async with SessionLocal() as db:
+            await kitchen_board.resync(db)
+            await kitchen_status.load(db)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        delay = 1.0
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(asyncpg_dsn(DATABASE_URL))
+                await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                await conn.add_listener(STATUS_NOTIFY_CHANNEL, self._on_status_notify)
+                self.connected = True
+                delay = 1.0
+                # Notifikasi selama koneksi putus tidak dikirim ulang, jadi samakan dulu dengan DB
+                await self._resync()
+                while not conn.is_closed():
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                    except asyncio.TimeoutError:
+                        continue
+                    self._wakeup.clear()
+                    await self._apply_pending()
+                logging.warning("Koneksi LISTEN kitchen terputus, reconnect...")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"LISTEN {NOTIFY_CHANNEL} gagal: {e}, reconnect dalam {delay:.0f}s")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LISTEN_RECONNECT_MAX_DELAY)
+
+    def stats(self) -> dict:
+        return {
+            "channel": NOTIFY_CHANNEL,
+            "connected": self.connected,
+            "notifications": self.notifications,
+            "pending": len(self.pending),
+            "reconnects": self.reconnects,
+        }
+
+order_listener = OrderChangeListener()
 
 @app.get("/health", summary="Health check", tags=["Utility"], operation_id="health kitchen")
 def health_check():
@@ -413,103 +1200,99 @@ logging.info(f"✅ kitchen_service sudah running di http://{local_ip}:8003 add c
 
 mcp.setup_server()
 
-@app.get("/kitchen/orders", summary="Lihat semua pesanan", tags=["Kitchen"], operation_id="kitchen order list")
-def get_kitchen_orders(db: Session = Depends(get_db)):
-    now = datetime.now(jakarta_tz)
-    start_of_day = datetime(now.year, now.month, now.day, tzinfo=jakarta_tz)
+async def fetch_order_statuses(order_ids: List[str]) -> dict:
+    """Ambil status + item aktif banyak order dari order_service lewat endpoint bulk."""
+    statuses = {}
+    for i in range(0, len(order_ids), ORDER_STATUS_BATCH):
+        try:
+            resp = await order_http.post(
+                f"{ORDER_SERVICE_URL}/order/status/bulk",
+                json={"order_ids": order_ids[i:i + ORDER_STATUS_BATCH]},
+                timeout=ORDER_STATUS_TIMEOUT
+            )
+            resp.raise_for_status()
+            statuses.update(resp.json().get("orders", {}))
+        except Exception as e:
+            logging.warning(f"Gagal mengambil status bulk dari order_service, pakai data lokal: {e}")
+    return statuses
+
+def kitchen_orders_query(now: datetime):
+    """Query board: semua pesanan aktif + pesanan selesai hari ini, urut waktu masuk"""
+    start_of_day = jakarta_tz.localize(datetime(now.year, now.month, now.day))
     end_of_day = start_of_day + timedelta(days=1)
-    orders = db.query(KitchenOrder).filter(
+    return select(KitchenOrder).where(
         or_(
-            KitchenOrder.status.in_(['receive', 'making', 'deliver']),
+            status_in(BOARD_ACTIVE_STATUSES),
             and_(
-                KitchenOrder.status.in_(['done', 'cancelled', 'habis']),
+                status_in(BOARD_FINISHED_STATUSES),
                 KitchenOrder.time_receive >= start_of_day,
                 KitchenOrder.time_receive < end_of_day
             )
         )
-    ).order_by(KitchenOrder.time_receive.asc()).all()
-    import json
+    ).order_by(KitchenOrder.time_receive.asc())
+
+def on_board(order: KitchenOrder, now: datetime) -> bool:
+    """Padanan Python dari filter kitchen_orders_query untuk satu order"""
+    if order.status in BOARD_ACTIVE_STATUSES:
+        return True
+    if order.status not in BOARD_FINISHED_STATUSES or not order.time_receive:
+        return False
+    return order.time_receive.astimezone(jakarta_tz).date() == now.date()
+
+async def board_version(db: AsyncSession) -> int:
+    """Watermark: semua transaksi dengan xid < versi ini sudah selesai (lihat ROW_VERSION_MIGRATION)"""
+    return (await db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))).scalar()
+
+@app.get("/kitchen/orders", summary="Lihat semua pesanan", tags=["Kitchen"], operation_id="kitchen order list")
+async def get_kitchen_orders(since: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    """Tanpa `since`: list board lengkap. Dengan `since=<version>`: hanya order yang berubah
+    sejak versi itu + `removed` (order yang keluar dari board), dan `version` baru.
+    `since=0` (atau versi yang tidak dikenal) mengembalikan board lengkap dengan `full: true`.
+    Board berganti hari tidak menghasilkan tombstone; client perlu fetch ulang `since=0`."""
+    now = datetime.now(jakarta_tz)
+    if since is None:
+        orders = (await db.execute(kitchen_orders_query(now))).scalars().all()
+        return await serialize_board_orders(orders)
+
+    # Versi dibaca sebelum data: perubahan yang commit di antaranya paling buruk terkirim dua kali
+    version = await board_version(db)
+    full = since <= 0 or since > version
+    removed = []
+    if full:
+        orders = (await db.execute(kitchen_orders_query(now))).scalars().all()
+    else:
+        changed = (await db.execute(
+            select(KitchenOrder)
+            .where(KitchenOrder.row_version >= since)
+            .order_by(KitchenOrder.time_receive.asc())
+        )).scalars().all()
+        orders = [o for o in changed if on_board(o, now)]
+        removed = [o.order_id for o in changed if not on_board(o, now)]
+        removed += (await db.execute(
+            select(KitchenOrderTombstone.order_id).where(KitchenOrderTombstone.row_version >= since)
+        )).scalars().all()
+    return {
+        "version": version,
+        "full": full,
+        "orders": await serialize_board_orders(orders),
+        "removed": removed
+    }
+
+async def serialize_board_orders(orders: List[KitchenOrder]) -> list:
     result = []
+    # Satu request bulk ke order_service untuk seluruh board, bukan satu request per order
+    live_orders = await fetch_order_statuses([o.order_id for o in orders])
     for o in orders:
-        # Debug logging
-        print(f"Processing order {o.order_id}")
-        print(f"orders_json: {getattr(o, 'orders_json', None)}")
-        
         # Ambil items yang masih aktif dari order_service untuk data terbaru
         items = []
-        try:
-            # Fetch active items from order service
-            import requests
-            order_response = requests.get(f"http://order_service:8002/order/status/{o.queue_number}", timeout=5)
-            if order_response.status_code == 200:
-                order_data = order_response.json()
-                # Hanya ambil active items, exclude cancelled
-                items = order_data.get('items', [])  # 'items' contains only active items
-                print(f"Successfully fetched active items from order service: {items}")
-            else:
-                print(f"Failed to fetch order data from order service: {order_response.status_code}")
-                raise Exception("Order service unavailable")
-        except Exception as e:
-            print(f"Error fetching from order service, using fallback: {e}")
+        live = live_orders.get(o.order_id)
+        if live is not None:
+            # Hanya ambil active items, exclude cancelled
+            items = live.get('items', [])
+        else:
             # Fallback ke data lokal jika order service tidak tersedia
-            if getattr(o, 'orders_json', None):
-                try:
-                    items = json.loads(o.orders_json)
-                    print(f"Successfully parsed orders_json: {items}")
-                except Exception as e:
-                    print(f"Error parsing orders_json: {e}")
-                    items = []
-            if not items:
-                print(f"No items from orders_json, parsing detail: {o.detail}")
-                def parse_items(detail_str):
-                    items = []
-                    for item in (detail_str or '').split('\n'):
-                        item = item.strip()
-                        if not item:
-                            continue
-                        main, *notesPart = item.split(' - Notes:')
-                        notes = notesPart[0].strip() if notesPart else ''
-                        name = main
-                        variant = ''
-                        qty = 1  # Default quantity
-                        
-                        # Pattern 1: "2x Menu Name (variant)"
-                        variantMatch = re.match(r'^(\d+)x ([^(]+) \(([^)]+)\)$', main)
-                        if variantMatch:
-                            qty = int(variantMatch.group(1))
-                            name = variantMatch.group(2).strip()
-                            variant = variantMatch.group(3).strip()
-                        else:
-                            # Pattern 2: "2x Menu Name" (no variant)
-                            noVarMatch = re.match(r'^(\d+)x ([^(]+)$', main)
-                            if noVarMatch:
-                                qty = int(noVarMatch.group(1))
-                                name = noVarMatch.group(2).strip()
-                            else:
-                                # Pattern 3: "Menu Name (variant)" (no quantity, default to 1)
-                                simpleVariantMatch = re.match(r'^([^(]+) \(([^)]+)\)$', main)
-                                if simpleVariantMatch:
-                                    name = simpleVariantMatch.group(1).strip()
-                                    variant = simpleVariantMatch.group(2).strip()
-                                else:
-                                    # Pattern 4: Just "Menu Name" (no quantity, no variant)
-                                    name = main.strip()
-                        
-                        # Clean up empty variant
-                        if variant == '':
-                            variant = None
-                        
-                        items.append({
-                            'menu_name': name,
-                            'quantity': qty,
-                            'preference': variant,
-                            'notes': notes
-                        })
-                    return items
-                items = parse_items(o.detail)
-        
-        print(f"Final items for order {o.order_id}: {items}")
-        
+            items = o.items or []
+
         order_dict = {
             'order_id': o.order_id,
             'queue_number': o.queue_number,
@@ -522,19 +1305,17 @@ def get_kitchen_orders(db: Session = Depends(get_db)):
             'room_name': o.room_name,
             'cancel_reason': o.cancel_reason or ''
         }
-        print(f"Order dict for {o.order_id}: {order_dict}")
         result.append(order_dict)
-    
-    print(f"Final result: {result}")
+
     return result
 
 # --- Sync endpoint: reconcile kitchen_orders with order_service ---
 @app.post("/kitchen/sync_order_items/{order_id}", summary="Sync kitchen order with order_service", tags=["Kitchen"])
-async def sync_order_items(order_id: str, db: Session = Depends(get_db)):
+async def sync_order_items(order_id: str, db: AsyncSession = Depends(get_db)):
     """Fetch current items and status from order_service by queue_number and update kitchen_orders.
     This keeps kitchen detail/items/status aligned after item or full cancellations.
     """
-    order = db.query(KitchenOrder).filter(KitchenOrder.order_id == order_id).first()
+    order = await db.get(KitchenOrder, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found in kitchen")
 
@@ -542,12 +1323,12 @@ async def sync_order_items(order_id: str, db: Session = Depends(get_db)):
     od = None
     try:
         if order.queue_number is not None:
-            resp = requests.get(f"{ORDER_SERVICE_URL}/order/status/{order.queue_number}", timeout=5)
+            resp = await order_http.get(f"{ORDER_SERVICE_URL}/order/status/{order.queue_number}", timeout=5)
             if resp.status_code == 200:
                 od = resp.json()
         if od is None:
             # Fallback to by-id status endpoint
-            resp2 = requests.get(f"{ORDER_SERVICE_URL}/order_status/{order_id}", timeout=5)
+            resp2 = await order_http.get(f"{ORDER_SERVICE_URL}/order_status/{order_id}", timeout=5)
             if resp2.status_code == 200:
                 js = resp2.json()
                 od = js.get("data") if isinstance(js, dict) else js
@@ -561,8 +1342,7 @@ async def sync_order_items(order_id: str, db: Session = Depends(get_db)):
     items = od.get("items") or []
     cancelled = od.get("cancelled_orders") or []
 
-    # Update detail string and orders_json to reflect current active items
-    import json as _json
+    # Update detail string and items to reflect current active items
     detail_str = "\n".join([
         f"{it.get('quantity', 1)}x {it.get('menu_name','')}" +
         (f" ({it.get('preference')})" if it.get('preference') else "") +
@@ -571,10 +1351,7 @@ async def sync_order_items(order_id: str, db: Session = Depends(get_db)):
     ])
 
     order.detail = detail_str
-    try:
-        order.orders_json = _json.dumps(items)
-    except Exception:
-        order.orders_json = None
+    order.items = normalize_items(items)
 
     # Sync status and cancel reason
     new_status = (od.get("status") or order.status) or "receive"
@@ -605,10 +1382,10 @@ async def sync_order_items(order_id: str, db: Session = Depends(get_db)):
         if reason_summary:
             order.cancel_reason = reason_summary
 
-    db.commit()
+    await db.commit()
 
     # Broadcast updated orders to clients
-    await broadcast_orders(db)
+    await kitchen_board.apply(order)
 
     return {
         "status": "success",
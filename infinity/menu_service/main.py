@@ -1,8 +1,8 @@
-from fastapi import Body, FastAPI, HTTPException, Depends, Request, Query
+from fastapi import Body, FastAPI, HTTPException, Depends, Request, Response, Query
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, validator, Field, ValidationError
-from sqlalchemy import create_engine, Column, String, Integer, Boolean, DateTime, Table, ForeignKey, Float, Text, text
+from sqlalchemy import create_engine, Column, String, Integer, BigInteger, Boolean, DateTime, Table, ForeignKey, Float, Text, text, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship, joinedload
 from typing import List, Optional
@@ -11,6 +11,11 @@ from dotenv import load_dotenv
 import logging
 import socket
 import uuid
+import json
+import select
+import asyncio
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pytz import timezone as pytz_timezone
 jakarta_tz = pytz_timezone('Asia/Jakarta')
@@ -21,12 +26,22 @@ from fastapi import APIRouter
 from fastapi.middleware.cors import CORSMiddleware
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL_MENU")
+CATALOG_NOTIFY_CHANNEL = os.getenv("MENU_CATALOG_NOTIFY_CHANNEL", "menu_catalog_changed")
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("MENU_SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_HEARTBEAT = ": heartbeat\n\n"
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    catalog_feed.start(asyncio.get_running_loop())
+    yield
+    catalog_feed.stop()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Menu Service API",
     description="Manajemen menu dan usulan menu untuk Infinity Cafe",
     version="1.0.0"
@@ -296,8 +311,59 @@ class RecipeIngredient(Base):
     menu_item = relationship("MenuItem", back_populates="recipe_ingredients")
     ingredient = relationship("SyncedInventory", back_populates="recipe_ingredients")
 
+class ResourceVersion(Base):
+    """Counter versi per resource, dipakai sebagai ETag untuk GET katalog"""
+    __tablename__ = "resource_versions"
+    resource = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
 Base.metadata.create_all(bind=engine)
 
+# Resource yang versinya naik bila model tertentu berubah. Menu ikut naik saat flavor
+# berubah karena response /menu menyertakan flavor.
+VERSIONED_RESOURCES = {
+    MenuItem: ("menu",),
+    Flavor: ("flavors", "menu"),
+}
+
+@event.listens_for(SessionLocal, "after_flush")
+def bump_resource_versions(session, flush_context):
+    """Naikkan versi resource di transaksi yang sama dengan perubahan datanya."""
+    touched = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        touched.update(VERSIONED_RESOURCES.get(type(obj), ()))
+    for resource in touched:
+        # Nilai awal berbasis waktu supaya versi tidak terulang bila tabel dibuat ulang
+        session.connection().execute(
+            text(
+                "INSERT INTO resource_versions (resource, version) "
+                "VALUES (:resource, (extract(epoch from clock_timestamp()) * 1000)::bigint) "
+                "ON CONFLICT (resource) DO UPDATE SET version = resource_versions.version + 1"
+            ),
+            {"resource": resource}
+        )
+    if touched:
+        # Dikirim Postgres saat commit; rollback tidak menghasilkan notifikasi
+        session.connection().execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CATALOG_NOTIFY_CHANNEL, "payload": ",".join(sorted(touched))}
+        )
+
+def resource_etag(db: Session, variant: str, resource: str) -> str:
+    version = db.query(ResourceVersion.version).filter(ResourceVersion.resource == resource).scalar() or 0
+    return f'"{variant}-{version}"'
+
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return 304 bila If-None-Match cocok, jika tidak pasang ETag di response normal."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 # Safe migration: add description column if it does not exist
 try:
     with engine.connect() as conn:
@@ -313,6 +379,78 @@ def get_db():
     finally:
         db.close()
 
+# ========== FEED KATALOG ==========
+# order_service menyimpan replika katalog (menu + flavor) di memori. Versi katalog mengikuti
+# versi resource "menu" (ikut naik saat flavor berubah). Perubahan dari worker mana pun sampai
+# lewat NOTIFY, lalu versi barunya disiarkan ke subscriber /menu/catalog/stream.
+def catalog_version(db: Session) -> int:
+    return db.query(ResourceVersion.version).filter(ResourceVersion.resource == "menu").scalar() or 0
+
+class CatalogFeed:
+    """Versi katalog terbaru dari LISTEN Postgres, diteruskan ke subscriber SSE"""
+
+    def __init__(self):
+        self.version = None
+        self.subscribers = set()
+        self.loop = None
+        self._stop = threading.Event()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        threading.Thread(target=self._listen, name="catalog-feed", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen(self):
+        delay = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                # Koneksi khusus LISTEN, dilepas dari pool karena mode autocommit
+                conn = engine.raw_connection()
+                conn.detach()
+                pg = conn.dbapi_connection
+                pg.autocommit = True
+                with pg.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CATALOG_NOTIFY_CHANNEL}")
+                delay = 1.0
+                # Baca ulang setelah (re)connect supaya perubahan selama putus tidak terlewat
+                self._reload()
+                while not self._stop.is_set():
+                    if select.select([pg], [], [], 5) == ([], [], []):
+                        continue
+                    pg.poll()
+                    if pg.notifies:
+                        pg.notifies.clear()
+                        self._reload()
+            except Exception as e:
+                logging.warning(f"⚠️ Listener katalog menu terputus: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _reload(self):
+        with SessionLocal() as db:
+            version = catalog_version(db)
+        if version != self.version:
+            self.version = version
+            self.loop.call_soon_threadsafe(self._broadcast, self.event())
+
+    def _broadcast(self, data: str):
+        for queue in list(self.subscribers):
+            # Cukup versi terakhir yang relevan, jadi isi lama dibuang
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    def event(self) -> str:
+        return f"data: {json.dumps({'version': self.version})}\n\n"
+
+catalog_feed = CatalogFeed()
+
 def generate_id(prefix: str, length: int = 8):
     return f"{prefix.upper()}{uuid.uuid4().hex[:length].upper()}"
 
@@ -362,13 +500,19 @@ def create_flavor(flavor: FlavorCreate, db: Session = Depends(get_db)):
     }
 
 @app.get("/flavors", summary="Lihat Varian Rasa Tersedia", tags=["Flavor"], response_model=List[FlavorOut], operation_id="list available flavors")
-def get_available_flavors(db: Session = Depends(get_db)):
+def get_available_flavors(request: Request, response: Response, db: Session = Depends(get_db)):
     """Mengambil semua varian rasa yang statusnya tersedia."""
+    not_modified = conditional_response(request, response, resource_etag(db, "flavors", "flavors"))
+    if not_modified:
+        return not_modified
     return db.query(Flavor).filter(Flavor.isAvail == True).all()
 
 @app.get("/flavors/all", summary="Lihat Semua Varian Rasa (Admin)", tags=["Flavor"], response_model=List[FlavorOut], operation_id="list all flavors")
-def get_all_flavors_admin(db: Session = Depends(get_db)):
+def get_all_flavors_admin(request: Request, response: Response, db: Session = Depends(get_db)):
     """Mengambil semua varian rasa dari database"""
+    not_modified = conditional_response(request, response, resource_etag(db, "flavors-all", "flavors"))
+    if not_modified:
+        return not_modified
     return db.query(Flavor).all()
 
 @app.get("/flavors/{flavor_id}", summary="Lihat Detail Varian Rasa", tags=["Flavor"], response_model=FlavorOut, operation_id="get flavor by id")
@@ -569,8 +713,11 @@ def create_menu_item(item: MenuItemCreate, db: Session = Depends(get_db)):
     }
 
 @app.get("/menu", summary="Daftar Menu Tersedia", tags=["Menu"], response_model=List[MenuItemOut], operation_id="list menu")
-def get_menu(db: Session = Depends(get_db)):
+def get_menu(request: Request, response: Response, db: Session = Depends(get_db)):
     """Mengambil semua menu yang tersedia beserta varian rasanya (hanya flavor yang available)."""
+    not_modified = conditional_response(request, response, resource_etag(db, "menu", "menu"))
+    if not_modified:
+        return not_modified
     menus = db.query(MenuItem).options(joinedload(MenuItem.flavors)).filter(MenuItem.isAvail == True).all()
     result = []
     for m in menus:
@@ -597,11 +744,75 @@ def get_menu(db: Session = Depends(get_db)):
     return result
 
 @app.get("/menu/all", summary="Daftar Semua Menu (Untuk Admin)", tags=["Menu"], response_model=List[MenuItemOut])
-def get_all_menus_admin(db: Session = Depends(get_db)):
+def get_all_menus_admin(request: Request, response: Response, db: Session = Depends(get_db)):
     """Mengambil semua data menu dari database"""
+    not_modified = conditional_response(request, response, resource_etag(db, "menu-all", "menu"))
+    if not_modified:
+        return not_modified
     all_menus = db.query(MenuItem).options(joinedload(MenuItem.flavors)).all()
     return all_menus    
 
+@app.get("/menu/catalog", summary="Katalog menu dan rasa untuk replika", tags=["Menu"])
+def get_menu_catalog(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Semua menu beserta semua varian rasa (termasuk yang tidak tersedia) dan versi katalog.
+
+    Versi dibaca sebelum data, jadi data tidak pernah lebih lama dari versinya.
+    """
+    version = catalog_version(db)
+    not_modified = conditional_response(request, response, f'"catalog-{version}"')
+    if not_modified:
+        return not_modified
+    menus = db.query(MenuItem).options(joinedload(MenuItem.flavors)).order_by(MenuItem.id).all()
+    return {
+        "version": version,
+        "menus": [
+            {
+                "id": m.id,
+                "base_name_en": m.base_name_en,
+                "base_name_id": m.base_name_id,
+                "base_price": m.base_price,
+                "isAvail": m.isAvail,
+                "making_time_minutes": m.making_time_minutes,
+                "flavors": [
+                    {
+                        "id": f.id,
+                        "flavor_name_en": f.flavor_name_en,
+                        "flavor_name_id": f.flavor_name_id,
+                        "additional_price": f.additional_price,
+                        "isAvail": f.isAvail,
+                    }
+                    for f in (m.flavors or [])
+                ]
+            }
+            for m in menus
+        ]
+    }
+
+@app.get("/menu/catalog/stream", summary="Stream versi katalog menu", tags=["Menu"])
+async def stream_menu_catalog(request: Request):
+    queue = asyncio.Queue(maxsize=1)
+    catalog_feed.subscribers.add(queue)
+    async def event_generator():
+        try:
+            # Kirim versi saat ini dulu, lalu hanya perubahan
+            if catalog_feed.version is not None:
+                yield catalog_feed.event()
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    data = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    data = SSE_HEARTBEAT
+                yield data
+        finally:
+            catalog_feed.subscribers.discard(queue)
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/menu/{menu_id}", summary="Lihat Detail Menu", tags=["Menu"], response_model=MenuItemOut, operation_id="get menu by id")
 def get_menu_item(menu_id: str, db: Session = Depends(get_db)):
     """Mengambil informasi detail dari sebuah menu berdasarkan ID. Hanya mengembalikan flavor yang available."""
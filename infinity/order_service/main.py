@@ -1,8 +1,8 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field, validator
-from sqlalchemy import Boolean,create_engine, Column, String, Integer, ForeignKey, Text, DateTime, func, Index, and_
+from sqlalchemy import Boolean,create_engine, Column, String, Integer, BigInteger, ForeignKey, Text, DateTime, func, Index, and_, or_, text, Sequence
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 from typing import List, Optional
@@ -15,6 +15,11 @@ from datetime import datetime, date
 from pytz import timezone as pytz_timezone
 import json
 import uuid
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from contextlib import asynccontextmanager
 from fastapi_mcp import FastApiMCP
 import uvicorn
 from fastapi import APIRouter
@@ -24,11 +29,30 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL_ORDER")
 MENU_SERVICE_URL = os.getenv("MENU_SERVICE_URL", "http://menu_service:8001")
 INVENTORY_SERVICE_URL = os.getenv("INVENTORY_SERVICE_URL", "http://inventory_service:8006")
+KITCHEN_SERVICE_URL = os.getenv("KITCHEN_SERVICE_URL", "http://kitchen_service:8003")
+KITCHEN_STATUS_TTL = float(os.getenv("KITCHEN_STATUS_TTL", "10"))
+KITCHEN_STATUS_READ_TIMEOUT = 60
+MENU_CATALOG_TTL = float(os.getenv("MENU_CATALOG_TTL", "60"))
+MENU_CATALOG_READ_TIMEOUT = 60
+ORDER_VALIDATION_DEADLINE = float(os.getenv("ORDER_VALIDATION_DEADLINE", "10"))
+ORDER_VALIDATION_WORKERS = int(os.getenv("ORDER_VALIDATION_WORKERS", "16"))
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "3"))
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "15"))
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    kitchen_status.start()
+    menu_catalog.start()
+    yield
+    kitchen_status.stop()
+    menu_catalog.stop()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Order Service API",
     description="Manajemen pemesanan untuk Infinity Cafe",
     version="1.0.0"
@@ -99,6 +123,10 @@ class Room(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(jakarta_tz))
 
+# Versi baris untuk ETag daftar order. Sequence, bukan satu baris counter bersama:
+# nextval tidak menahan lock sampai commit, jadi tulis order tidak saling antre.
+ORDERS_VERSION_SEQ = Sequence("orders_version_seq", metadata=Base.metadata)
+
 class Order(Base):
     __tablename__ = "orders"
     order_id = Column(String, primary_key=True)
@@ -109,6 +137,7 @@ class Order(Base):
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(jakarta_tz))
     cancel_reason = Column(Text, nullable=True)
     is_custom = Column(Boolean, default=False)
+    row_version = Column(BigInteger, server_default=ORDERS_VERSION_SEQ.next_value(), onupdate=ORDERS_VERSION_SEQ.next_value())
     items = relationship("OrderItem", back_populates="order", cascade="all, delete")
 
     __table_args__ = (
@@ -123,7 +152,7 @@ class Order(Base):
 class OrderItem(Base):
     __tablename__ = "order_items"
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(String, ForeignKey("orders.order_id"))
+    order_id = Column(String, ForeignKey("orders.order_id"), index=True)
     telegram_id = Column(String, nullable=False)
     menu_name = Column(String)
     quantity = Column(Integer)
@@ -132,10 +161,84 @@ class OrderItem(Base):
     status = Column(String, default="active")  # active, cancelled
     cancelled_reason = Column(Text, nullable=True)
     cancelled_at = Column(DateTime(timezone=True), nullable=True)
+    row_version = Column(BigInteger, server_default=ORDERS_VERSION_SEQ.next_value(), onupdate=ORDERS_VERSION_SEQ.next_value())
     order = relationship("Order", back_populates="items")
 
+class IdempotencyKey(Base):
+    """Hasil create_order per Idempotency-Key, supaya retry dari client tidak membuat order ganda"""
+    __tablename__ = "idempotency_keys"
+    endpoint = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    state = Column(String, nullable=False, default="processing")
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(jakarta_tz))
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    # Lease klaim 'processing': diperpanjang heartbeat selama handler jalan, sehingga klaim
+    # milik worker yang crash bisa diambil alih setelah lease habis (bukan menunggu expires_at)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+
 Base.metadata.create_all(bind=engine)
 
+# Safe migration: index order_id di order_items untuk lookup status massal
+try:
+    with engine.connect() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)"))
+        conn.commit()
+except Exception:
+    pass
+
+# Safe migration: row_version order/item untuk ETag (baris lama NULL sampai ditulis ulang).
+# Dicek dulu supaya ALTER TABLE (ACCESS EXCLUSIVE lock) tidak jalan di setiap startup.
+try:
+    with engine.connect() as conn:
+        for table in ("orders", "order_items"):
+            has_default = conn.execute(text(
+                "SELECT column_default IS NOT NULL FROM information_schema.columns "
+                "WHERE table_name = :table AND column_name = 'row_version'"
+            ), {"table": table}).scalar()
+            if has_default:
+                continue
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_version BIGINT"))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN row_version SET DEFAULT nextval('orders_version_seq')"))
+        conn.commit()
+except Exception:
+    pass
+
+# Safe migration: kolom lease untuk klaim Idempotency-Key
+try:
+    with engine.connect() as conn:
+        conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS lease_owner VARCHAR"))
+        conn.execute(text("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ"))
+        conn.commit()
+except Exception:
+    pass
+
+def orders_etag(db: Session, variant: str, start, end) -> str:
+    """ETag dari jumlah dan total row_version order (beserta item-nya) dalam rentang waktu.
+    Setiap insert/update memberi nilai nextval baru ke barisnya, jadi totalnya ikut berubah
+    walau transaksi commit tidak berurutan (berbeda dengan max yang bisa tertinggal)."""
+    in_range = and_(Order.created_at >= start, Order.created_at <= end)
+    orders_count, orders_sum = db.query(
+        func.count(Order.order_id), func.coalesce(func.sum(Order.row_version), 0)
+    ).filter(in_range).one()
+    items_count, items_sum = db.query(
+        func.count(OrderItem.id), func.coalesce(func.sum(OrderItem.row_version), 0)
+    ).join(Order, Order.order_id == OrderItem.order_id).filter(in_range).one()
+    return f'"{variant}-{orders_count}.{orders_sum}-{items_count}.{items_sum}"'
+
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return 304 bila If-None-Match cocok, jika tidak pasang ETag di response normal."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in candidates or etag in candidates:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 class OrderItemSchema(BaseModel):
     menu_name: str = Field(..., min_length=1, description="Nama menu tidak boleh kosong.")
     quantity: int = Field(..., gt=0, description="Jumlah pesanan harus lebih dari 0.")
@@ -180,6 +283,17 @@ class CancelOrderItemRequest(BaseModel):
 class StatusUpdateRequest(BaseModel):
     status: str
 
+class BatchStatusUpdateItem(BaseModel):
+    order_id: str
+    status: str
+
+class BatchStatusUpdateRequest(BaseModel):
+    updates: List[BatchStatusUpdateItem] = Field(..., min_length=1, max_length=100)
+
+class BulkOrderStatusRequest(BaseModel):
+    order_ids: List[str] = Field(default_factory=list, max_length=500)
+    queue_numbers: List[int] = Field(default_factory=list, max_length=500)
+
 class RoomSchema(BaseModel):
     id: int
     name: str
@@ -196,6 +310,322 @@ def get_db():
     finally:
         db.close()
 
+class KitchenStatusReplica:
+    """Replika lokal status ON/OFF dapur, di-update dari stream kitchen_service; TTL sebagai fallback"""
+
+    def __init__(self):
+        self.is_open = None
+        self.updated_at = 0.0
+        self.connected = False
+        self.fallbacks = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _set(self, is_open: bool):
+        self.is_open = is_open
+        self.updated_at = time.monotonic()
+
+    def get(self) -> bool:
+        """Status dapur; bila stream putus dan replika kedaluwarsa, cek langsung ke kitchen_service."""
+        if self.is_open is not None and (self.connected or time.monotonic() - self.updated_at < KITCHEN_STATUS_TTL):
+            return self.is_open
+        self.fallbacks += 1
+        response = requests.get(f"{KITCHEN_SERVICE_URL}/kitchen/status/now", timeout=5)
+        response.raise_for_status()
+        self._set(bool(response.json().get("is_open", False)))
+        return self.is_open
+
+    def _listen(self):
+        delay = 1.0
+        while not self._stop.is_set():
+            try:
+                with requests.get(
+                    f"{KITCHEN_SERVICE_URL}/kitchen/status/stream",
+                    stream=True, timeout=(5, KITCHEN_STATUS_READ_TIMEOUT)
+                ) as response:
+                    response.raise_for_status()
+                    delay = 1.0
+                    for line in response.iter_lines(decode_unicode=True):
+                        if self._stop.is_set():
+                            break
+                        if line.startswith("data:"):
+                            self._set(bool(json.loads(line[5:]).get("is_open", False)))
+                            self.connected = True
+                        elif line.startswith(":") and self.is_open is not None:
+                            # Heartbeat: nilai terakhir masih berlaku
+                            self.updated_at = time.monotonic()
+            except Exception as e:
+                logging.warning(f"⚠️ Stream status dapur terputus: {e}")
+            self.connected = False
+            self._stop.wait(delay)
+            delay = min(delay * 2, 30.0)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, name="kitchen-status", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "is_open": self.is_open,
+            "connected": self.connected,
+            "age_seconds": round(time.monotonic() - self.updated_at, 1) if self.is_open is not None else None,
+            "fallbacks": self.fallbacks,
+        }
+
+kitchen_status = KitchenStatusReplica()
+
+def build_catalog_index(menus: list) -> dict:
+    """Index katalog: lookup nama EN/ID, set rasa per menu, dan waktu pembuatan."""
+    by_name = {}
+    available_names = set()
+    making_times = {}
+    for menu in menus:
+        all_flavors = menu.get("flavors") or []
+        flavors = [f for f in all_flavors if f.get("isAvail")]
+        entry = {
+            "menu": menu,
+            "flavors": flavors,
+            "all_flavors": all_flavors,
+            "flavor_names": {
+                name for f in flavors
+                for name in (f.get("flavor_name_en"), f.get("flavor_name_id")) if name
+            },
+        }
+        for name in (menu.get("base_name_en"), menu.get("base_name_id")):
+            if not name:
+                continue
+            # Sama seperti /menu/by_name: menu pertama yang cocok yang dipakai
+            by_name.setdefault(name, entry)
+            making_times.setdefault(name, float(menu.get("making_time_minutes") or 0))
+            if menu.get("isAvail"):
+                available_names.add(name)
+    return {"by_name": by_name, "available_names": available_names, "making_times": making_times}
+
+class MenuCatalogReplica:
+    """Replika katalog menu & rasa di memori, di-refresh saat versi di stream menu_service berubah; TTL sebagai fallback"""
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.etag = None
+        self.updated_at = 0.0
+        self.connected = False
+        self.refreshes = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fresh(self) -> bool:
+        return self.index is not None and (self.connected or time.monotonic() - self.updated_at < MENU_CATALOG_TTL)
+
+    def _refresh(self):
+        headers = {"If-None-Match": self.etag} if self.etag and self.index is not None else {}
+        response = requests.get(f"{MENU_SERVICE_URL}/menu/catalog", headers=headers, timeout=5)
+        if response.status_code != 304:
+            response.raise_for_status()
+            catalog = response.json()
+            self.index = build_catalog_index(catalog.get("menus") or [])
+            self.version = catalog.get("version")
+            self.etag = response.headers.get("etag")
+            self.refreshes += 1
+        self.updated_at = time.monotonic()
+
+    def refresh(self):
+        """Ambil katalog dari menu_service; 304 bila versi tidak berubah."""
+        with self._lock:
+            self._refresh()
+
+    def current(self) -> dict:
+        """Index katalog; bila stream putus dan replika kedaluwarsa, refresh langsung ke menu_service."""
+        if self._fresh():
+            return self.index
+        with self._lock:
+            # Request lain mungkin sudah refresh selama menunggu lock
+            if not self._fresh():
+                self.fallbacks += 1
+                try:
+                    self._refresh()
+                except requests.RequestException as e:
+                    if self.index is None:
+                        raise
+                    logging.warning(f"⚠️ Gagal refresh katalog menu, memakai versi {self.version}: {e}")
+        return self.index
+
+    def menu(self, name: str) -> Optional[dict]:
+        return self.current()["by_name"].get(name)
+
+    def _listen(self):
+        delay = 1.0
+        while not self._stop.is_set():
+            try:
+                with requests.get(
+                    f"{MENU_SERVICE_URL}/menu/catalog/stream",
+                    stream=True, timeout=(5, MENU_CATALOG_READ_TIMEOUT)
+                ) as response:
+                    response.raise_for_status()
+                    delay = 1.0
+                    # Perubahan selama stream putus tidak disiarkan ulang, jadi cek dulu
+                    self.refresh()
+                    self.connected = True
+                    for line in response.iter_lines(decode_unicode=True):
+                        if self._stop.is_set():
+                            break
+                        if line.startswith("data:") and json.loads(line[5:]).get("version") != self.version:
+                            self.refresh()
+            except Exception as e:
+                logging.warning(f"⚠️ Stream katalog menu terputus: {e}")
+            self.connected = False
+            self._stop.wait(delay)
+            delay = min(delay * 2, 30.0)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._listen, name="menu-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "menus": len({id(entry) for entry in self.index["by_name"].values()}) if self.index else None,
+            "connected": self.connected,
+            "age_seconds": round(time.monotonic() - self.updated_at, 1) if self.index is not None else None,
+            "refreshes": self.refreshes,
+            "fallbacks": self.fallbacks,
+        }
+
+menu_catalog = MenuCatalogReplica()
+
+def _lease_deadline() -> datetime:
+    return datetime.fromtimestamp(time.time() + IDEMPOTENCY_LEASE_SECONDS, jakarta_tz)
+
+def _claim_idempotency_key(endpoint: str, key: str, fingerprint: str, owner: str) -> Optional[IdempotencyKey]:
+    """Klaim key untuk request ini. Return None bila berhasil, atau record milik request lain.
+
+    Klaim 'processing' yang lease-nya sudah habis (worker crash/restart) diambil alih.
+    """
+    now = datetime.now(jakarta_tz)
+    with SessionLocal() as session:
+        session.query(IdempotencyKey).filter(
+            IdempotencyKey.endpoint == endpoint,
+            IdempotencyKey.key == key,
+            IdempotencyKey.expires_at <= now
+        ).delete(synchronize_session=False)
+        claimed = session.execute(
+            text(
+                "INSERT INTO idempotency_keys (endpoint, key, fingerprint, state, created_at, expires_at, "
+                "                              lease_owner, lease_expires_at) "
+                "VALUES (:endpoint, :key, :fingerprint, 'processing', :now, :expires_at, :owner, :lease) "
+                "ON CONFLICT (endpoint, key) DO UPDATE SET "
+                "    fingerprint = EXCLUDED.fingerprint, lease_owner = EXCLUDED.lease_owner, "
+                "    lease_expires_at = EXCLUDED.lease_expires_at "
+                "WHERE idempotency_keys.state = 'processing' "
+                "  AND (idempotency_keys.lease_expires_at IS NULL OR idempotency_keys.lease_expires_at <= :now) "
+                "RETURNING key"
+            ),
+            {
+                "endpoint": endpoint, "key": key, "fingerprint": fingerprint, "now": now, "owner": owner,
+                "expires_at": datetime.fromtimestamp(now.timestamp() + IDEMPOTENCY_TTL_SECONDS, jakarta_tz),
+                "lease": _lease_deadline()
+            }
+        ).first()
+        session.commit()
+        if claimed:
+            return None
+        record = session.get(IdempotencyKey, (endpoint, key))
+        if record is not None:
+            session.expunge(record)
+        return record
+
+def _renew_idempotency_lease(endpoint: str, key: str, owner: str, stop: threading.Event):
+    """Heartbeat: perpanjang lease selama handler masih berjalan."""
+    while not stop.wait(IDEMPOTENCY_LEASE_SECONDS / 3):
+        try:
+            with SessionLocal() as session:
+                session.query(IdempotencyKey).filter(
+                    IdempotencyKey.endpoint == endpoint,
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.lease_owner == owner,
+                    IdempotencyKey.state == "processing"
+                ).update({IdempotencyKey.lease_expires_at: _lease_deadline()}, synchronize_session=False)
+                session.commit()
+        except Exception as e:
+            logging.warning(f"⚠️ Gagal memperpanjang lease Idempotency-Key {key}: {e}")
+
+def _finish_idempotency_key(endpoint: str, key: str, owner: str, response: Optional[Response]):
+    """Simpan response sukses; response error dilepas supaya client boleh mencoba lagi.
+
+    Hanya pemilik lease yang boleh menyelesaikan, supaya request lama yang klaimnya sudah
+    diambil alih tidak menimpa hasil request baru.
+    """
+    with SessionLocal() as session:
+        record = session.get(IdempotencyKey, (endpoint, key))
+        if record is None or record.lease_owner != owner:
+            return
+        if response is None:
+            session.delete(record)
+        else:
+            record.state = "completed"
+            record.response_body = response.body.decode("utf-8")
+            record.lease_expires_at = None
+        session.commit()
+
+def run_idempotent(request: Request, endpoint: str, req: BaseModel, handler):
+    """Jalankan handler sekali per Idempotency-Key; replay mengembalikan response yang tersimpan."""
+    key = request.headers.get("idempotency-key")
+    if not key:
+        return handler()
+
+    fingerprint = hashlib.sha256(
+        json.dumps(req.model_dump(), sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        record = _claim_idempotency_key(endpoint, key, fingerprint, owner)
+        if record is None:
+            break
+        if record.fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key sudah dipakai untuk request dengan isi berbeda")
+        if record.state == "completed":
+            return Response(
+                content=record.response_body,
+                media_type="application/json",
+                headers={"Idempotent-Replayed": "true"}
+            )
+        # Request pertama masih diproses: tunggu sebentar, jangan ikut menjalankan pipeline
+        if time.monotonic() > deadline:
+            lease_left = (record.lease_expires_at.timestamp() - time.time()) if record.lease_expires_at else 0
+            raise HTTPException(
+                status_code=409,
+                detail="Request dengan Idempotency-Key ini masih diproses",
+                headers={"Retry-After": str(max(1, int(lease_left + 0.999)))}
+            )
+        time.sleep(0.1)
+
+    stop_heartbeat = threading.Event()
+    threading.Thread(
+        target=_renew_idempotency_lease, args=(endpoint, key, owner, stop_heartbeat),
+        name="idempotency-lease", daemon=True
+    ).start()
+    response = None
+    try:
+        response = handler()
+    finally:
+        stop_heartbeat.set()
+        succeeded = (
+            isinstance(response, Response)
+            and response.status_code < 400
+            and json.loads(response.body).get("status") != "error"
+        )
+        _finish_idempotency_key(endpoint, key, owner, response if succeeded else None)
+    return response
+
 def generate_order_id():
     timestamp = datetime.now(jakarta_tz).strftime("%Y%m%d%H%M%S%f")
     unique_code = uuid.uuid4().hex[:6].upper()
@@ -214,31 +644,13 @@ def get_next_queue_number(db: Session) -> int:
         return 1
     
 def validate_order_items(order_items: List[OrderItemSchema]) -> Optional[str]:
-    """Menghubungi menu_service untuk memvalidasi item."""
+    """Memvalidasi item terhadap replika katalog menu_service."""
     try:
-        response = requests.get(f"{MENU_SERVICE_URL}/menu", timeout=5)
-        response.raise_for_status()
-        available_menus = response.json()
+        valid_menu_names = menu_catalog.current()["available_names"]
     except requests.RequestException as e:
         logging.error(f"Gagal menghubungi menu_service: {e}")
         return "Tidak dapat memvalidasi menu saat ini, layanan menu sedang OFF."
 
-    # Menggunakan field dwi bahasa baru untuk validasi
-    valid_menu_names = set()
-    for menu in available_menus:
-        # Tambahkan nama bahasa Inggris dan Indonesia
-        if menu.get('base_name_en'):
-            valid_menu_names.add(menu.get('base_name_en'))
-        if menu.get('base_name_id'):
-            valid_menu_names.add(menu.get('base_name_id'))
-        # Fallback untuk compatibility dengan nama lama
-        if menu.get('base_name'):
-            valid_menu_names.add(menu.get('base_name'))
-        if menu.get('menu_name'):
-            valid_menu_names.add(menu.get('menu_name'))
-    
-    valid_menu_names.discard(None)
-
     invalid_items = [
         item.menu_name for item in order_items if item.menu_name not in valid_menu_names
     ]
@@ -370,47 +782,438 @@ def cancel_order_item_by_stock(order_id: str, menu_name: str, reason: str, db: S
         "order_status": order_status
     }
 
-def check_stock_per_item(order_items: List[OrderItemSchema], order_id: str) -> tuple[bool, list, list]:
+def check_stock_item(item: OrderItemSchema, order_id: str) -> Optional[dict]:
     """
-    Cek stok per item dan pisahkan yang bisa dipenuhi vs yang tidak.
-    Returns: (can_fulfill_all, available_items, unavailable_items)
+    Cek stok satu item untuk partial cancellation.
+    Returns: None bila tersedia, atau {'item', 'shortages', 'reason'} bila tidak
     """
-    available_items = []
-    unavailable_items = []
-    
-    for item in order_items:
+    try:
+        inventory_payload = {
+            "order_id": f"{order_id}_check_{item.menu_name}",
+            "items": [{"menu_name": item.menu_name, "quantity": item.quantity, "preference": item.preference}]
+        }
+        
+        stock_resp = requests.post(
+            f"{INVENTORY_SERVICE_URL}/stock/check_availability",
+            json=inventory_payload,
+            timeout=7
+        )
+        stock_data = stock_resp.json()
+        
+        if stock_data.get("can_fulfill", False):
+            return None
+        return {
+            "item": item,
+            "shortages": stock_data.get("shortages", []),
+            "reason": f"Stok tidak mencukupi untuk {item.menu_name}"
+        }
+    except Exception as e:
+        logging.error(f"Error checking stock for {item.menu_name}: {e}")
+        return {
+            "item": item,
+            "shortages": [],
+            "reason": f"Error saat cek stok: {e}"
+        }
+
+def check_combined_stock(order_items: List[OrderItemSchema], order_id: str) -> Optional[JSONResponse]:
+    """Guard: pastikan kombinasi item bisa dipenuhi (cek agregat sekali)."""
+    combined_check = check_stock_combined(order_items, order_id)
+    if combined_check.get("can_fulfill", False):
+        return None
+    shortages = combined_check.get("shortages") or []
+    # Format pesan ringkas berdasarkan bahan yang kurang
+    if shortages:
+        detail = "; ".join([
+            f"{s.get('ingredient_name','?')}: perlu {s.get('required',0)} tersedia {s.get('available',0)}"
+            for s in shortages[:5]
+        ])
+        extra = f" dan {max(0, len(shortages)-5)} item lainnya" if len(shortages) > 5 else ""
+        msg = f"Stok tidak mencukupi untuk kombinasi menu ini. Detail: {detail}{extra}"
+    else:
+        msg = combined_check.get("message", "Stok tidak mencukupi untuk kombinasi menu ini")
+    return JSONResponse(status_code=200, content={
+        "status": "error",
+        "message": msg,
+        "data": {
+            "order_id": order_id,
+            "shortages": shortages
+        }
+    })
+
+def check_kitchen_open() -> Optional[str]:
+    try:
+        if not kitchen_status.get():
+            return "Dapur sedang OFF. Tidak dapat menerima pesanan."
+    except Exception as e:
+        logging.warning(f"⚠️ Gagal mengakses kitchen_service untuk cek status: {e}")
+        return "Gagal menghubungi layanan dapur. Coba lagi nanti."
+    return None
+
+def check_duplicate_order(order_id: str, db: Session) -> Optional[str]:
+    if db.query(Order).filter(Order.order_id == order_id).first():
+        return f"Pesanan dengan ID {order_id} sudah dalam proses."
+    return None
+
+# Menu yang memerlukan flavor (menggunakan nama dwi bahasa)
+FLAVOR_REQUIRED_MENUS = [
+    "Caffe Latte", "Kafe Latte",  # Bahasa Inggris dan Indonesia
+    "Cappuccino", "Kapucino", 
+    "Milkshake", "Milkshake",
+    "Squash", "Skuas"
+]
+
+def check_item_flavor(item: OrderItemSchema, temp_order_id: str) -> Optional[JSONResponse]:
+    """Validasi pilihan rasa satu item pesanan reguler terhadap replika katalog menu."""
+    # Jika item memiliki preference, validasi apakah menu tersebut boleh memiliki flavor
+    if item.preference and item.preference.strip():
         try:
-            # Cek stok per item individual
-            inventory_payload = {
-                "order_id": f"{order_id}_check_{item.menu_name}",
-                "items": [{"menu_name": item.menu_name, "quantity": item.quantity, "preference": item.preference}]
-            }
-            
-            stock_resp = requests.post(
-                f"{INVENTORY_SERVICE_URL}/stock/check_availability",
-                json=inventory_payload,
-                timeout=7
-            )
-            stock_data = stock_resp.json()
-            
-            if stock_data.get("can_fulfill", False):
-                available_items.append(item)
+            logging.info(f"🔍 DEBUG: Validating flavor for menu '{item.menu_name}', preference: '{item.preference}'")
+            entry = menu_catalog.menu(item.menu_name)
+            if entry is None:
+                return JSONResponse(status_code=200, content={"status": "error", "message": f"Gagal mendapatkan data rasa untuk {item.menu_name}", "data": None})
+
+            # Hanya flavor yang available (isAvail=True) untuk validasi
+            available_flavors = entry["flavors"]
+
+            # Jika tidak ada flavor available, cek apakah sebenarnya menu punya flavor tapi sedang tidak tersedia
+            if not available_flavors or len(available_flavors) == 0:
+                if entry["all_flavors"]:
+                    return JSONResponse(
+                        status_code=200,
+                        content={
+                            "status": "error",
+                            "message": f"Semua varian rasa untuk '{item.menu_name}' sedang tidak tersedia. Silakan pilih menu lain atau coba lagi nanti.",
+                            "data": {
+                                "menu_item": item.menu_name,
+                                "invalid_preference": item.preference,
+                                "reason": "Semua flavor sedang tidak tersedia"
+                            }
+                        }
+                    )
+                # Default: menu memang tidak punya flavor standar
+                logging.info(f"🚫 DEBUG: Menu '{item.menu_name}' tidak memiliki pasangan flavor, tapi preference diberikan: '{item.preference}'")
+                return JSONResponse(
+                    status_code=200,
+                    content={
+                        "status": "error",
+                        "message": f"Menu '{item.menu_name}' tidak dapat diberikan pilihan rasa pada pesanan reguler. Silakan gunakan /custom_order jika ingin menambahkan rasa khusus.",
+                        "data": {
+                            "menu_item": item.menu_name,
+                            "invalid_preference": item.preference,
+                            "reason": "Menu tidak memiliki varian rasa standar"
+                        }
+                    }
+                )
+
+            # Jika menu memiliki pasangan flavor, validasi apakah preference valid (nama EN/ID)
+            available_flavor_names = list(entry["flavor_names"])
+            logging.info(f"🔍 DEBUG: Available flavors for {item.menu_name}: {available_flavor_names}")
+
+            # Validasi apakah preference yang diberikan valid
+            if item.preference not in available_flavor_names:
+                logging.info(f"🚫 DEBUG: Invalid flavor '{item.preference}' for {item.menu_name}. Valid flavors: {available_flavor_names}")
+                # Format untuk menampilkan flavor dwi bahasa
+                flavor_names = []
+                for i, flavor in enumerate(available_flavors):
+                    flavor_display = ""
+                    if flavor.get('flavor_name_en') and flavor.get('flavor_name_id'):
+                        flavor_display = f"{flavor['flavor_name_en']} / {flavor['flavor_name_id']}"
+                    elif flavor.get('flavor_name_en'):
+                        flavor_display = flavor['flavor_name_en']
+                    elif flavor.get('flavor_name_id'):
+                        flavor_display = flavor['flavor_name_id']
+                    elif flavor.get('flavor_name'):
+                        flavor_display = flavor['flavor_name']
+
+                    if flavor_display:
+                        flavor_names.append(f"{i+1}. {flavor_display}")
+
+                flavor_list_str = "\n".join(flavor_names)
+                message = (
+                    f"Rasa '{item.preference}' tidak tersedia untuk {item.menu_name}. Varian yang tersedia:\n\n"
+                    f"{flavor_list_str}\n\n"
+                    "Silakan pilih salah satu rasa yang tersedia, atau gunakan /custom_order untuk rasa khusus."
+                )
+
+                return JSONResponse(
+                    status_code=200,
+                    content={
+                        "status": "error",
+                        "message": message,
+                        "data": {
+                            "menu_item": item.menu_name,
+                            "invalid_flavor": item.preference,
+                            "available_flavors": available_flavor_names
+                        }
+                    }
+                )
             else:
-                unavailable_items.append({
-                    "item": item,
-                    "shortages": stock_data.get("shortages", []),
-                    "reason": f"Stok tidak mencukupi untuk {item.menu_name}"
-                })
+                logging.info(f"✅ DEBUG: Valid flavor '{item.preference}' for {item.menu_name}")
+
+        except requests.RequestException as e:
+            logging.error(f"Gagal menghubungi menu_service untuk validasi flavor: {e}")
+            return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi pilihan rasa saat ini.", "data": None})
+
+    # Menu yang wajib memiliki flavor tapi tidak ada preference
+    elif item.menu_name in FLAVOR_REQUIRED_MENUS and not item.preference:
+        try:
+            entry = menu_catalog.menu(item.menu_name)
+            if entry is not None:
+                # Hanya flavor yang available (isAvail=True)
+                available_flavors = entry["flavors"]
+                if available_flavors:
+                    # Format untuk menampilkan flavor dwi bahasa
+                    flavor_names = []
+                    for i, flavor in enumerate(available_flavors):
+                        flavor_display = ""
+                        if flavor.get('flavor_name_en') and flavor.get('flavor_name_id'):
+                            flavor_display = f"{flavor['flavor_name_en']} / {flavor['flavor_name_id']}"
+                        elif flavor.get('flavor_name_en'):
+                            flavor_display = flavor['flavor_name_en']
+                        elif flavor.get('flavor_name_id'):
+                            flavor_display = flavor['flavor_name_id']
+                        elif flavor.get('flavor_name'):
+                            flavor_display = flavor['flavor_name']
+
+                        if flavor_display:
+                            flavor_names.append(f"{i+1}. {flavor_display}")
+
+                    available_flavor_names = list(entry["flavor_names"])
+                    flavor_list_str = "\n".join(flavor_names)
+                    message = (
+                        f"Anda memesan {item.menu_name}, pilihan rasa wajib diisi. Varian yang tersedia:\n\n"
+                        f"{flavor_list_str}\n\n"
+                        "Silakan pilih satu rasa dan masukkan ke field 'preference', lalu kirim ulang pesanan Anda."
+                    )
+
+                    return JSONResponse(
+                        status_code=200,
+                        content={
+                            "status": "error",
+                            "message": "Pilihan rasa diperlukan untuk menu ini.",
+                            "data": {
+                                "guidance": message,
+                                "menu_item": item.menu_name,
+                                "available_flavors": available_flavor_names,
+                                "order_id_suggestion": temp_order_id 
+                            }
+                        }
+                    )
+
+        except requests.RequestException as e:
+            logging.error(f"Gagal menghubungi menu_service untuk validasi flavor: {e}")
+            return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi pilihan rasa saat ini.", "data": None})
+
+def check_custom_item_flavor(item: OrderItemSchema, temp_order_id: str) -> Optional[JSONResponse]:
+    """Validasi pilihan rasa satu item custom order (flavor bebas, tapi tetap wajib diisi)."""
+    if item.menu_name in FLAVOR_REQUIRED_MENUS and not item.preference:
+        logging.info(f"🔍 DEBUG CUSTOM: Menu '{item.menu_name}' memerlukan flavor tapi tidak diisi")
+        try:
+            entry = menu_catalog.menu(item.menu_name)
+            if entry is None:
+                return JSONResponse(status_code=200, content={"status": "error", "message": f"Gagal mendapatkan data rasa untuk {item.menu_name}", "data": None})
+
+            available_flavors = entry["flavors"]
+            if available_flavors:
+                # Format untuk menampilkan flavor dwi bahasa
+                flavor_names = []
+                for i, flavor in enumerate(available_flavors):
+                    flavor_display = ""
+                    if flavor.get('flavor_name_en') and flavor.get('flavor_name_id'):
+                        flavor_display = f"{flavor['flavor_name_en']} / {flavor['flavor_name_id']}"
+                    elif flavor.get('flavor_name_en'):
+                        flavor_display = flavor['flavor_name_en']
+                    elif flavor.get('flavor_name_id'):
+                        flavor_display = flavor['flavor_name_id']
+                    elif flavor.get('flavor_name'):
+                        flavor_display = flavor['flavor_name']
+
+                    if flavor_display:
+                        flavor_names.append(f"{i+1}. {flavor_display}")
+
+                flavor_list_str = "\n".join(flavor_names)
+                message = (
+                    f"Anda memesan {item.menu_name} via custom order, pilihan rasa tetap wajib diisi. Varian yang tersedia:\n\n"
+                    f"{flavor_list_str}\n\n"
+                    "Untuk custom order, Anda bisa menggunakan rasa apapun termasuk yang tidak ada dalam daftar di atas."
+                )
+
+                return JSONResponse(
+                    status_code=200,
+                    content={
+                        "status": "error",
+                        "message": "Pilihan rasa diperlukan untuk menu ini.",
+                        "data": {
+                            "guidance": message,
+                            "menu_item": item.menu_name,
+                            "available_flavors": list(entry["flavor_names"]),
+                            "order_id_suggestion": temp_order_id 
+                        }
+                    }
+                )
+        except requests.RequestException as e:
+            logging.error(f"Gagal menghubungi menu_service untuk validasi flavor: {e}")
+            return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi pilihan rasa saat ini.", "data": None})
+    elif item.menu_name in FLAVOR_REQUIRED_MENUS and item.preference:
+        logging.info(f"🔍 DEBUG CUSTOM: Mulai validasi flavor '{item.preference}' untuk menu '{item.menu_name}'")
+        try:
+            flavor_check_url = f"{INVENTORY_SERVICE_URL}/flavors"
+            logging.info(f"🔍 DEBUG CUSTOM: Calling {flavor_check_url}")
+            flavor_response = requests.get(flavor_check_url, timeout=3)
+            if flavor_response.status_code == 200:
+                available_flavors_data = flavor_response.json()
+                available_flavors = available_flavors_data.get("flavors", [])
+                logging.info(f"🔍 DEBUG CUSTOM: Got {len(available_flavors)} available flavors from inventory")
+
+                # if item.preference not in available_flavors:
+                #     logging.info(f"❌ DEBUG CUSTOM: Flavor '{item.preference}' tidak ada dalam database untuk menu '{item.menu_name}'")
+                #     return JSONResponse(
+                #         status_code=200,
+                #         content={
+                #             "status": "error",
+                #             "message": f"Flavor '{item.preference}' tidak tersedia dalam database. Silakan pilih flavor yang tersedia.",
+                #             "data": {
+                #                 "available_flavors": available_flavors[:10], 
+                #                 "total_flavors": len(available_flavors),
+                #                 "invalid_flavor": item.preference,
+                #                 "menu_item": item.menu_name,
+                #                 "note": "Untuk custom order, Anda tetap harus memilih flavor yang ada dalam database."
+                #             }
+                #         }
+                #     )
+                # else:
+                #     logging.info(f"✅ DEBUG CUSTOM: Custom order dengan menu '{item.menu_name}' dan flavor valid '{item.preference}'")
+            else:
+                logging.warning(f"⚠️ DEBUG CUSTOM: Gagal mengecek flavor dari inventory service, status: {flavor_response.status_code}")
+                return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi flavor saat ini.", "data": None})
+
+        except requests.RequestException as e:
+            logging.error(f"Gagal menghubungi inventory_service untuk validasi flavor: {e}")
+            return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi flavor saat ini.", "data": None})
+
+# ========== PIPELINE VALIDASI PESANAN ==========
+# Validasi berjalan bertahap dengan satu deadline: room/duplikat (DB lokal) -> menu, rasa,
+# dapur (paralel; biasanya dari replika lokal) -> stok gabungan -> stok per item (paralel).
+# Tahap berikutnya baru dimulai bila tahap sebelumnya lolos, supaya pesanan yang pasti gagal
+# tidak ikut membebani inventory_service. Cek dalam satu tahap jalan di thread pool terbatas.
+validation_pool = ThreadPoolExecutor(max_workers=ORDER_VALIDATION_WORKERS, thread_name_prefix="order-validation")
+
+class ValidationPipeline:
+    """Jalankan cek pesanan paralel; hasil cek berupa str/JSONResponse dianggap error.
+
+    Error dengan prioritas tertinggi yang sudah pasti langsung dikembalikan dan cek dengan
+    prioritas lebih rendah dibatalkan (yang sudah berjalan dibiarkan selesai, hasilnya diabaikan).
+    Durasi tiap cek dilampirkan ke response lewat header Server-Timing.
+    """
+
+    def __init__(self, deadline: float = ORDER_VALIDATION_DEADLINE):
+        self.started = time.perf_counter()
+        self.deadline = time.monotonic() + deadline
+        self.checks = []
+        self.timings = {}
+
+    def _timed(self, name: str, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
         except Exception as e:
-            logging.error(f"Error checking stock for {item.menu_name}: {e}")
-            unavailable_items.append({
-                "item": item,
-                "shortages": [],
-                "reason": f"Error saat cek stok: {e}"
-            })
-    
-    can_fulfill_all = len(unavailable_items) == 0
-    return can_fulfill_all, available_items, unavailable_items
+            logging.error(f"Cek '{name}' gagal: {e}")
+            return "Tidak dapat memvalidasi pesanan saat ini."
+        finally:
+            self.timings[name] = (time.perf_counter() - started) * 1000
+
+    def submit(self, priority: int, name: str, fn, *args):
+        """Cek remote, langsung berjalan di thread pool"""
+        self.checks.append((priority, name, validation_pool.submit(self._timed, name, fn, *args)))
+
+    def run(self, priority: int, name: str, fn, *args):
+        """Cek lokal yang memakai session DB request, dijalankan di thread pemanggil"""
+        started = time.perf_counter()
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        finally:
+            self.timings[name] = (time.perf_counter() - started) * 1000
+        self.checks.append((priority, name, future))
+
+    def result(self, name: str):
+        return next(future for _, check_name, future in self.checks if check_name == name).result()
+
+    @staticmethod
+    def _is_error(future: Future) -> bool:
+        return future.done() and not future.cancelled() and isinstance(future.result(), (str, Response))
+
+    def first_error(self) -> Optional[JSONResponse]:
+        """Tunggu cek yang relevan sampai deadline; None bila semua cek lolos"""
+        checks = sorted(self.checks, key=lambda check: check[0])
+        try:
+            while True:
+                failed = next((i for i, (_, _, future) in enumerate(checks) if self._is_error(future)), None)
+                if failed is not None:
+                    for _, _, future in checks[failed + 1:]:
+                        future.cancel()
+                    checks = checks[:failed + 1]
+                pending = [future for _, _, future in checks if not future.done()]
+                if not pending:
+                    if failed is None:
+                        return None
+                    error = checks[failed][2].result()
+                    if isinstance(error, str):
+                        error = JSONResponse(status_code=200, content={"status": "error", "message": error, "data": None})
+                    return error
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    for future in pending:
+                        future.cancel()
+                    pending_names = [name for _, name, future in checks if not future.done() or future.cancelled()]
+                    logging.warning(f"⚠️ Validasi pesanan melewati deadline {ORDER_VALIDATION_DEADLINE}s, belum selesai: {pending_names}")
+                    return JSONResponse(status_code=200, content={
+                        "status": "error",
+                        "message": "Validasi pesanan melebihi batas waktu. Coba lagi nanti.",
+                        "data": {"pending_checks": pending_names}
+                    })
+                wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        finally:
+            # Total dipindah ke akhir supaya header tetap terurut per tahap
+            self.timings.pop("validation", None)
+            self.timings["validation"] = (time.perf_counter() - self.started) * 1000
+
+    def attach(self, response: Response) -> Response:
+        """Lampirkan durasi tiap cek ke header Server-Timing"""
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={ms:.1f}" for name, ms in self.timings.items()
+        )
+        return response
+
+def validate_order(req: "CreateOrderRequest", order_id: str, db: Session,
+                   flavor_check) -> tuple[ValidationPipeline, Optional[JSONResponse]]:
+    """Jalankan validasi create_order/custom_order per tahap; return (pipeline, error pertama)."""
+    pipeline = ValidationPipeline()
+    pipeline.run(0, "room", validate_room_name, req.room_name, db)
+    pipeline.run(1, "duplicate", check_duplicate_order, order_id, db)
+    error = pipeline.first_error()
+    if error is None:
+        pipeline.submit(2, "menu", validate_order_items, req.orders)
+        for i, item in enumerate(req.orders, 1):
+            pipeline.submit(3, f"flavor_{i}", flavor_check, item, order_id)
+        pipeline.submit(4, "kitchen", check_kitchen_open)
+        error = pipeline.first_error()
+    if error is None:
+        pipeline.submit(5, "stock_combined", check_combined_stock, req.orders, order_id)
+        error = pipeline.first_error()
+    if error is None:
+        # Sama seperti sebelumnya: cek per item hanya bila kombinasi bisa dipenuhi
+        for i, item in enumerate(req.orders, 1):
+            pipeline.submit(6, f"stock_item_{i}", check_stock_item, item, order_id)
+        error = pipeline.first_error()
+    return pipeline, error
+
+def split_stock_results(pipeline: ValidationPipeline, order_items: List[OrderItemSchema]) -> tuple[list, list]:
+    """Pisahkan item yang stoknya cukup vs tidak dari hasil cek stok per item."""
+    results = [pipeline.result(f"stock_item_{i}") for i in range(1, len(order_items) + 1)]
+    available_items = [item for item, result in zip(order_items, results) if result is None]
+    unavailable_items = [result for result in results if result is not None]
+    return available_items, unavailable_items
     
 def create_outbox_event(db: Session, order_id: str, event_type: str, payload: dict):
     outbox_event = OrderOutbox(
@@ -427,7 +1230,7 @@ def process_outbox_events(db: Session):
     unprocessed_events = db.query(OrderOutbox).filter(
         OrderOutbox.processed == False,
         OrderOutbox.retry_count < OrderOutbox.max_retries
-    ).all()
+    ).order_by(OrderOutbox.id).all()
     
     for event in unprocessed_events:
         try:
@@ -454,7 +1257,16 @@ def process_outbox_events(db: Session):
                     timeout=5
                 )
                 response.raise_for_status()
-            
+
+            elif event.event_type in ("item_cancelled", "order_item_cancelled"):
+                # Kitchen menyalin items terbaru ke barisnya sendiri, sehingga row_version naik
+                # dan board yang fetch ?since ikut melihat item yang dibatalkan
+                response = requests.post(
+                    f"http://kitchen_service:8003/kitchen/sync_order_items/{event.order_id}",
+                    timeout=5
+                )
+                response.raise_for_status()
+
             event.processed = True
             event.processed_at = datetime.now(jakarta_tz)
             event.error_message = None
@@ -496,244 +1308,21 @@ def get_outbox_status(db: Session = Depends(get_db)):
     }
 
 @app.post("/create_order", summary="Buat pesanan baru", tags=["Order"], operation_id="add order")
-def create_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
+def create_order(req: CreateOrderRequest, request: Request, db: Session = Depends(get_db)):
     """Membuat pesanan baru dan mengirimkannya ke kitchen_service."""
+    return run_idempotent(request, "/create_order", req, lambda: _create_order(req, db))
 
-    # Validasi nama ruangan
-    room_validation_error = validate_room_name(req.room_name, db)
-    if room_validation_error:
-        return JSONResponse(status_code=200, content={"status": "error", "message": room_validation_error, "data": None})
-
-    validation_error = validate_order_items(req.orders)
-    if validation_error:
-        return JSONResponse(status_code=200, content={"status": "error", "message": validation_error, "data": None})
-    
-    flavor_required_menus = ["Caffe Latte", "Cappuccino", "Milkshake", "Squash"]
-    # Menu yang memerlukan flavor (menggunakan nama dwi bahasa)
-    flavor_required_menus = [
-        "Caffe Latte", "Kafe Latte",  # Bahasa Inggris dan Indonesia
-        "Cappuccino", "Kapucino", 
-        "Milkshake", "Milkshake",
-        "Squash", "Skuas"
-    ]
+def _create_order(req: CreateOrderRequest, db: Session):
     temp_order_id = req.order_id if req.order_id else generate_order_id()
-
-    for item in req.orders:
-        # Jika item memiliki preference, validasi apakah menu tersebut boleh memiliki flavor
-        if item.preference and item.preference.strip():
-            try:
-                # Ambil hanya flavor yang available (isAvail=True) untuk validasi
-                flavor_url = f"{MENU_SERVICE_URL}/menu/by_name/{item.menu_name}/flavors?include_unavailable=false"
-                logging.info(f"🔍 DEBUG: Validating flavor for menu '{item.menu_name}', preference: '{item.preference}'")
-                logging.info(f"🔍 DEBUG: Calling flavor endpoint: {flavor_url}")
-                flavor_response = requests.get(flavor_url, timeout=3)
-                logging.info(f"🔍 DEBUG: Flavor response status: {flavor_response.status_code}")
-                
-                if flavor_response.status_code != 200:
-                    return JSONResponse(status_code=200, content={"status": "error", "message": f"Gagal mendapatkan data rasa untuk {item.menu_name}", "data": None})
-                
-                available_flavors = flavor_response.json()
-
-                # Jika tidak ada flavor available, cek apakah sebenarnya menu punya flavor tapi sedang tidak tersedia
-                if not available_flavors or len(available_flavors) == 0:
-                    try:
-                        all_flavors_resp = requests.get(
-                            f"{MENU_SERVICE_URL}/menu/by_name/{item.menu_name}/flavors?include_unavailable=true",
-                            timeout=3
-                        )
-                        if all_flavors_resp.status_code == 200 and len(all_flavors_resp.json() or []) > 0:
-                            return JSONResponse(
-                                status_code=200,
-                                content={
-                                    "status": "error",
-                                    "message": f"Semua varian rasa untuk '{item.menu_name}' sedang tidak tersedia. Silakan pilih menu lain atau coba lagi nanti.",
-                                    "data": {
-                                        "menu_item": item.menu_name,
-                                        "invalid_preference": item.preference,
-                                        "reason": "Semua flavor sedang tidak tersedia"
-                                    }
-                                }
-                            )
-                    except Exception:
-                        pass
-                    # Default: menu memang tidak punya flavor standar
-                    logging.info(f"🚫 DEBUG: Menu '{item.menu_name}' tidak memiliki pasangan flavor, tapi preference diberikan: '{item.preference}'")
-                    return JSONResponse(
-                        status_code=200,
-                        content={
-                            "status": "error",
-                            "message": f"Menu '{item.menu_name}' tidak dapat diberikan pilihan rasa pada pesanan reguler. Silakan gunakan /custom_order jika ingin menambahkan rasa khusus.",
-                            "data": {
-                                "menu_item": item.menu_name,
-                                "invalid_preference": item.preference,
-                                "reason": "Menu tidak memiliki varian rasa standar"
-                            }
-                        }
-                    )
-                
-                # Jika menu memiliki pasangan flavor, validasi apakah preference valid
-                # Menggunakan field dwi bahasa baru untuk flavor
-                available_flavor_names = []
-                if available_flavors:
-                    for f in available_flavors:
-                        # Tambahkan nama bahasa Inggris dan Indonesia
-                        if f.get('flavor_name_en'):
-                            available_flavor_names.append(f.get('flavor_name_en'))
-                        if f.get('flavor_name_id'):
-                            available_flavor_names.append(f.get('flavor_name_id'))
-                        # Fallback untuk compatibility dengan nama lama
-                        if f.get('flavor_name'):
-                            available_flavor_names.append(f.get('flavor_name'))
-                # Remove duplicates
-                available_flavor_names = list(set(available_flavor_names))
-                logging.info(f"🔍 DEBUG: Available flavors for {item.menu_name}: {available_flavor_names}")
-                
-                # Validasi apakah preference yang diberikan valid
-                if item.preference not in available_flavor_names:
-                    logging.info(f"🚫 DEBUG: Invalid flavor '{item.preference}' for {item.menu_name}. Valid flavors: {available_flavor_names}")
-                    # Format untuk menampilkan flavor dwi bahasa
-                    flavor_names = []
-                    for i, flavor in enumerate(available_flavors):
-                        flavor_display = ""
-                        if flavor.get('flavor_name_en') and flavor.get('flavor_name_id'):
-                            flavor_display = f"{flavor['flavor_name_en']} / {flavor['flavor_name_id']}"
-                        elif flavor.get('flavor_name_en'):
-                            flavor_display = flavor['flavor_name_en']
-                        elif flavor.get('flavor_name_id'):
-                            flavor_display = flavor['flavor_name_id']
-                        elif flavor.get('flavor_name'):
-                            flavor_display = flavor['flavor_name']
-                        
-                        if flavor_display:
-                            flavor_names.append(f"{i+1}. {flavor_display}")
-                    
-                    flavor_list_str = "\n".join(flavor_names)
-                    message = (
-                        f"Rasa '{item.preference}' tidak tersedia untuk {item.menu_name}. Varian yang tersedia:\n\n"
-                        f"{flavor_list_str}\n\n"
-                        "Silakan pilih salah satu rasa yang tersedia, atau gunakan /custom_order untuk rasa khusus."
-                    )
-                    
-                    return JSONResponse(
-                        status_code=200,
-                        content={
-                            "status": "error",
-                            "message": message,
-                            "data": {
-                                "menu_item": item.menu_name,
-                                "invalid_flavor": item.preference,
-                                "available_flavors": available_flavor_names
-                            }
-                        }
-                    )
-                else:
-                    logging.info(f"✅ DEBUG: Valid flavor '{item.preference}' for {item.menu_name}")
-                    
-            except requests.RequestException as e:
-                logging.error(f"Gagal menghubungi menu_service untuk validasi flavor: {e}")
-                return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi pilihan rasa saat ini.", "data": None})
-        
-        # Menu yang wajib memiliki flavor tapi tidak ada preference
-        elif item.menu_name in flavor_required_menus and not item.preference:
-            try:
-                # Ambil hanya flavor yang available (isAvail=True) untuk validasi
-                flavor_url = f"{MENU_SERVICE_URL}/menu/by_name/{item.menu_name}/flavors?include_unavailable=false"
-                flavor_response = requests.get(flavor_url, timeout=3)
-                
-                if flavor_response.status_code == 200:
-                    available_flavors = flavor_response.json()
-                    if available_flavors:
-                        # Format untuk menampilkan flavor dwi bahasa
-                        flavor_names = []
-                        available_flavor_names = []
-                        for i, flavor in enumerate(available_flavors):
-                            flavor_display = ""
-                            if flavor.get('flavor_name_en') and flavor.get('flavor_name_id'):
-                                flavor_display = f"{flavor['flavor_name_en']} / {flavor['flavor_name_id']}"
-                            elif flavor.get('flavor_name_en'):
-                                flavor_display = flavor['flavor_name_en']
-                            elif flavor.get('flavor_name_id'):
-                                flavor_display = flavor['flavor_name_id']
-                            elif flavor.get('flavor_name'):
-                                flavor_display = flavor['flavor_name']
-                            
-                            if flavor_display:
-                                flavor_names.append(f"{i+1}. {flavor_display}")
-                                
-                            # Build available names list for validation
-                            if flavor.get('flavor_name_en'):
-                                available_flavor_names.append(flavor.get('flavor_name_en'))
-                            if flavor.get('flavor_name_id'):
-                                available_flavor_names.append(flavor.get('flavor_name_id'))
-                            if flavor.get('flavor_name'):
-                                available_flavor_names.append(flavor.get('flavor_name'))
-                        
-                        available_flavor_names = list(set(available_flavor_names))
-                        flavor_list_str = "\n".join(flavor_names)
-                        message = (
-                            f"Anda memesan {item.menu_name}, pilihan rasa wajib diisi. Varian yang tersedia:\n\n"
-                            f"{flavor_list_str}\n\n"
-                            "Silakan pilih satu rasa dan masukkan ke field 'preference', lalu kirim ulang pesanan Anda."
-                        )
-                        
-                        return JSONResponse(
-                            status_code=200,
-                            content={
-                                "status": "error",
-                                "message": "Pilihan rasa diperlukan untuk menu ini.",
-                                "data": {
-                                    "guidance": message,
-                                    "menu_item": item.menu_name,
-                                    "available_flavors": available_flavor_names,
-                                    "order_id_suggestion": temp_order_id 
-                                }
-                            }
-                        )
-                        
-            except requests.RequestException as e:
-                logging.error(f"Gagal menghubungi menu_service untuk validasi flavor: {e}")
-                return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi pilihan rasa saat ini.", "data": None})
-
-    try:
-        status_response = requests.get("http://kitchen_service:8003/kitchen/status/now", timeout=5)
-        status_response.raise_for_status()
-        kitchen_status = status_response.json()
-        if not kitchen_status.get("is_open", False):
-            return JSONResponse(status_code=200, content={"status": "error", "message": "Dapur sedang OFF. Tidak dapat menerima pesanan.", "data": None})
-    except Exception as e:
-        logging.warning(f"⚠️ Gagal mengakses kitchen_service untuk cek status: {e}")
-        return JSONResponse(status_code=200, content={"status": "error", "message": "Gagal menghubungi layanan dapur. Coba lagi nanti.", "data": None})
-    
     order_id = temp_order_id
-    if db.query(Order).filter(Order.order_id == order_id).first():
-        return JSONResponse(status_code=200, content={"status": "error", "message": f"Pesanan dengan ID {order_id} sudah dalam proses.", "data": None})
+
+    pipeline, validation_error = validate_order(req, order_id, db, check_item_flavor)
+    if validation_error:
+        return pipeline.attach(validation_error)
     
     try:
-        # Guard: pastikan kombinasi item bisa dipenuhi (cek agregat sekali)
-        combined_check = check_stock_combined(req.orders, temp_order_id)
-        if not combined_check.get("can_fulfill", False):
-            shortages = combined_check.get("shortages") or []
-            # Format pesan ringkas berdasarkan bahan yang kurang
-            if shortages:
-                detail = "; ".join([
-                    f"{s.get('ingredient_name','?')}: perlu {s.get('required',0)} tersedia {s.get('available',0)}"
-                    for s in shortages[:5]
-                ])
-                extra = f" dan {max(0, len(shortages)-5)} item lainnya" if len(shortages) > 5 else ""
-                msg = f"Stok tidak mencukupi untuk kombinasi menu ini. Detail: {detail}{extra}"
-            else:
-                msg = combined_check.get("message", "Stok tidak mencukupi untuk kombinasi menu ini")
-            return JSONResponse(status_code=200, content={
-                "status": "error",
-                "message": msg,
-                "data": {
-                    "order_id": temp_order_id,
-                    "shortages": shortages
-                }
-            })
-
         # Cek stok per item untuk partial cancellation
-        can_fulfill_all, available_items, unavailable_items = check_stock_per_item(req.orders, temp_order_id)
+        available_items, unavailable_items = split_stock_results(pipeline, req.orders)
         
         if not available_items:
             # Jika tidak ada item yang bisa dipenuhi sama sekali
@@ -744,11 +1333,16 @@ def create_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
                 shortage_msgs.append(f"{i}. {item.menu_name} x{item.quantity} - {reason}")
             
             msg = "Semua menu yang dipesan tidak tersedia:\n" + "\n".join(shortage_msgs)
-            return JSONResponse(status_code=200, content={
+            return pipeline.attach(JSONResponse(status_code=200, content={
                 "status": "error",
                 "message": msg,
-                "data": {"available_items": [], "unavailable_items": unavailable_items}
-            })
+                "data": {
+                    "available_items": [],
+                    "unavailable_items": [
+                        {**unavail_item, "item": unavail_item["item"].model_dump()} for unavail_item in unavailable_items
+                    ]
+                }
+            }))
         
         # Jika ada item yang tidak tersedia, buat partial order
         if unavailable_items:
@@ -771,11 +1365,11 @@ def create_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
             
     except Exception as e:
         logging.error(f"Gagal cek stok per item: {e}")
-        return JSONResponse(status_code=200, content={
+        return pipeline.attach(JSONResponse(status_code=200, content={
             "status": "error",
             "message": "Tidak dapat memvalidasi stok saat ini.",
             "data": None
-        })
+        }))
         
     try:
         new_queue_number = get_next_queue_number(db)
@@ -908,162 +1502,28 @@ def create_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
         ] if unavailable_items else []
     }
 
-    return JSONResponse(status_code=200, content={
+    return pipeline.attach(JSONResponse(status_code=200, content={
         "status": "success",
         "message": success_message,
         "data": order_details
-    })
+    }))
 
 @app.post("/custom_order", summary="Buat pesanan custom (tanpa validasi menu)", tags=["Order"], operation_id="add custom order")
-def create_custom_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
+def create_custom_order(req: CreateOrderRequest, request: Request, db: Session = Depends(get_db)):
     """Membuat pesanan custom baru dengan validasi menu tetapi flavor bebas."""
+    return run_idempotent(request, "/custom_order", req, lambda: _create_custom_order(req, db))
 
-    # Validasi nama ruangan
-    room_validation_error = validate_room_name(req.room_name, db)
-    if room_validation_error:
-        return JSONResponse(status_code=200, content={"status": "error", "message": room_validation_error, "data": None})
-
-    validation_error = validate_order_items(req.orders)
-    if validation_error:
-        return JSONResponse(status_code=200, content={"status": "error", "message": validation_error, "data": None})
-
-    flavor_required_menus = ["Caffe Latte", "Cappuccino", "Milkshake", "Squash"]
-    # Menu yang memerlukan flavor (menggunakan nama dwi bahasa)  
-    flavor_required_menus = [
-        "Caffe Latte", "Kafe Latte",  # Bahasa Inggris dan Indonesia
-        "Cappuccino", "Kapucino", 
-        "Milkshake", "Milkshake",
-        "Squash", "Skuas"
-    ]
+def _create_custom_order(req: CreateOrderRequest, db: Session):
     temp_order_id = req.order_id if req.order_id else generate_order_id()
-
-    for item in req.orders:
-        if item.menu_name in flavor_required_menus and not item.preference:
-            logging.info(f"🔍 DEBUG CUSTOM: Menu '{item.menu_name}' memerlukan flavor tapi tidak diisi")
-            try:
-                flavor_url = f"{MENU_SERVICE_URL}/menu/by_name/{item.menu_name}/flavors"
-                flavor_response = requests.get(flavor_url, timeout=3)
-                if flavor_response.status_code != 200:
-                        return JSONResponse(status_code=200, content={"status": "error", "message": f"Gagal mendapatkan data rasa untuk {item.menu_name}", "data": None})
-                
-                available_flavors = flavor_response.json()
-                if available_flavors:
-                    # Format untuk menampilkan flavor dwi bahasa
-                    flavor_names = []
-                    for i, flavor in enumerate(available_flavors):
-                        flavor_display = ""
-                        if flavor.get('flavor_name_en') and flavor.get('flavor_name_id'):
-                            flavor_display = f"{flavor['flavor_name_en']} / {flavor['flavor_name_id']}"
-                        elif flavor.get('flavor_name_en'):
-                            flavor_display = flavor['flavor_name_en']
-                        elif flavor.get('flavor_name_id'):
-                            flavor_display = flavor['flavor_name_id']
-                        elif flavor.get('flavor_name'):
-                            flavor_display = flavor['flavor_name']
-                        
-                        if flavor_display:
-                            flavor_names.append(f"{i+1}. {flavor_display}")
-                    
-                    flavor_list_str = "\n".join(flavor_names)
-                    message = (
-                        f"Anda memesan {item.menu_name} via custom order, pilihan rasa tetap wajib diisi. Varian yang tersedia:\n\n"
-                        f"{flavor_list_str}\n\n"
-                        "Untuk custom order, Anda bisa menggunakan rasa apapun termasuk yang tidak ada dalam daftar di atas."
-                    )
-                    
-                    return JSONResponse(
-                        status_code=200,
-                        content={
-                            "status": "error",
-                            "message": "Pilihan rasa diperlukan untuk menu ini.",
-                            "data": {
-                                "guidance": message,
-                                "menu_item": item.menu_name,
-                                "available_flavors": [f['flavor_name'] for f in available_flavors],
-                                "order_id_suggestion": temp_order_id 
-                            }
-                        }
-                    )
-            except requests.RequestException as e:
-                logging.error(f"Gagal menghubungi menu_service untuk validasi flavor: {e}")
-                return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi pilihan rasa saat ini.", "data": None})
-        elif item.menu_name in flavor_required_menus and item.preference:
-            logging.info(f"🔍 DEBUG CUSTOM: Mulai validasi flavor '{item.preference}' untuk menu '{item.menu_name}'")
-            try:
-                flavor_check_url = f"{INVENTORY_SERVICE_URL}/flavors"
-                logging.info(f"🔍 DEBUG CUSTOM: Calling {flavor_check_url}")
-                flavor_response = requests.get(flavor_check_url, timeout=3)
-                if flavor_response.status_code == 200:
-                    available_flavors_data = flavor_response.json()
-                    available_flavors = available_flavors_data.get("flavors", [])
-                    logging.info(f"🔍 DEBUG CUSTOM: Got {len(available_flavors)} available flavors from inventory")
-                    
-                    # if item.preference not in available_flavors:
-                    #     logging.info(f"❌ DEBUG CUSTOM: Flavor '{item.preference}' tidak ada dalam database untuk menu '{item.menu_name}'")
-                    #     return JSONResponse(
-                    #         status_code=200,
-                    #         content={
-                    #             "status": "error",
-                    #             "message": f"Flavor '{item.preference}' tidak tersedia dalam database. Silakan pilih flavor yang tersedia.",
-                    #             "data": {
-                    #                 "available_flavors": available_flavors[:10], 
-                    #                 "total_flavors": len(available_flavors),
-                    #                 "invalid_flavor": item.preference,
-                    #                 "menu_item": item.menu_name,
-                    #                 "note": "Untuk custom order, Anda tetap harus memilih flavor yang ada dalam database."
-                    #             }
-                    #         }
-                    #     )
-                    # else:
-                    #     logging.info(f"✅ DEBUG CUSTOM: Custom order dengan menu '{item.menu_name}' dan flavor valid '{item.preference}'")
-                else:
-                    logging.warning(f"⚠️ DEBUG CUSTOM: Gagal mengecek flavor dari inventory service, status: {flavor_response.status_code}")
-                    return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi flavor saat ini.", "data": None})
-                    
-            except requests.RequestException as e:
-                logging.error(f"Gagal menghubungi inventory_service untuk validasi flavor: {e}")
-                return JSONResponse(status_code=200, content={"status": "error", "message": "Tidak dapat memvalidasi flavor saat ini.", "data": None})
-
-    try:
-        status_response = requests.get("http://kitchen_service:8003/kitchen/status/now", timeout=5)
-        status_response.raise_for_status()
-        kitchen_status = status_response.json()
-        if not kitchen_status.get("is_open", False):
-            return JSONResponse(status_code=200, content={"status": "error", "message": "Dapur sedang OFF. Tidak dapat menerima pesanan.", "data": None})
-    except Exception as e:
-        logging.warning(f"⚠️ Gagal mengakses kitchen_service untuk cek status: {e}")
-        return JSONResponse(status_code=200, content={"status": "error", "message": "Gagal menghubungi layanan dapur. Coba lagi nanti.", "data": None})
-    
     order_id = temp_order_id
-    if db.query(Order).filter(Order.order_id == order_id).first():
-        return JSONResponse(status_code=200, content={"status": "error", "message": f"Pesanan dengan ID {order_id} sudah dalam proses.", "data": None})
-    
+
+    pipeline, validation_error = validate_order(req, order_id, db, check_custom_item_flavor)
+    if validation_error:
+        return pipeline.attach(validation_error)
     
     try:
-        # Guard: pastikan kombinasi item bisa dipenuhi (cek agregat sekali)
-        combined_check = check_stock_combined(req.orders, temp_order_id)
-        if not combined_check.get("can_fulfill", False):
-            shortages = combined_check.get("shortages") or []
-            if shortages:
-                detail = "; ".join([
-                    f"{s.get('ingredient_name','?')}: perlu {s.get('required',0)} tersedia {s.get('available',0)}"
-                    for s in shortages[:5]
-                ])
-                extra = f" dan {max(0, len(shortages)-5)} item lainnya" if len(shortages) > 5 else ""
-                msg = f"Stok tidak mencukupi untuk kombinasi menu ini. Detail: {detail}{extra}"
-            else:
-                msg = combined_check.get("message", "Stok tidak mencukupi untuk kombinasi menu ini")
-            return JSONResponse(status_code=200, content={
-                "status": "error",
-                "message": msg,
-                "data": {
-                    "order_id": temp_order_id,
-                    "shortages": shortages
-                }
-            })
-
         # Cek stok per item untuk partial cancellation (sama seperti create_order)
-        can_fulfill_all, available_items, unavailable_items = check_stock_per_item(req.orders, temp_order_id)
+        available_items, unavailable_items = split_stock_results(pipeline, req.orders)
         
         if not available_items:
             # Jika tidak ada item yang bisa dipenuhi sama sekali
@@ -1074,11 +1534,16 @@ def create_custom_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
                 shortage_msgs.append(f"{i}. {item.menu_name} x{item.quantity} - {reason}")
             
             msg = "Semua menu custom yang dipesan tidak tersedia:\n" + "\n".join(shortage_msgs)
-            return JSONResponse(status_code=200, content={
+            return pipeline.attach(JSONResponse(status_code=200, content={
                 "status": "error",
                 "message": msg,
-                "data": {"available_items": [], "unavailable_items": unavailable_items}
-            })
+                "data": {
+                    "available_items": [],
+                    "unavailable_items": [
+                        {**unavail_item, "item": unavail_item["item"].model_dump()} for unavail_item in unavailable_items
+                    ]
+                }
+            }))
         
         # Jika ada item yang tidak tersedia, buat partial order
         if unavailable_items:
@@ -1101,11 +1566,11 @@ def create_custom_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
             
     except Exception as e:
         logging.error(f"Gagal cek stok per item (custom): {e}")
-        return JSONResponse(status_code=200, content={
+        return pipeline.attach(JSONResponse(status_code=200, content={
             "status": "error",
             "message": "Tidak dapat memvalidasi stok saat ini.",
             "data": None
-        })
+        }))
         
     try:
         new_queue_number = get_next_queue_number(db)
@@ -1239,11 +1704,11 @@ def create_custom_order(req: CreateOrderRequest, db: Session = Depends(get_db)):
         ] if unavailable_items else []
     }
 
-    return JSONResponse(status_code=200, content={
+    return pipeline.attach(JSONResponse(status_code=200, content={
         "status": "success",
         "message": success_message,
         "data": order_details
-    })
+    }))
 
 @app.post("/cancel_order", summary="Batalkan pesanan", tags=["Order"], operation_id="cancel order")
 def cancel_order(req: CancelOrderRequest, db: Session = Depends(get_db)):
@@ -1660,6 +2125,23 @@ async def cancel_order_item_endpoint(request: Request, db: Session = Depends(get
         "data": result_data
     })
 
+@app.post("/internal/update_status/batch", tags=["Internal"])
+def update_order_status_batch_from_kitchen(req: BatchStatusUpdateRequest, db: Session = Depends(get_db)):
+    """Endpoint internal untuk menerima update status banyak order sekaligus dari kitchen_service."""
+    updates = {item.order_id: str(item.status).strip() for item in req.updates}
+    if not all(updates.values()):
+        raise HTTPException(status_code=400, detail="Setiap update harus berisi 'status' yang tidak kosong")
+    orders = db.query(Order).filter(Order.order_id.in_(list(updates))).all()
+    for order in orders:
+        order.status = updates[order.order_id]
+    db.commit()
+    found = {order.order_id for order in orders}
+    not_found = [order_id for order_id in updates if order_id not in found]
+    if not_found:
+        logging.error(f"Gagal menemukan order {', '.join(not_found)} untuk diupdate dari kitchen.")
+    logging.info(f"Status {len(orders)} order diupdate dari kitchen (batch).")
+    return {"status": "updated", "not_found": not_found}
+
 @app.post("/internal/update_status/{order_id}", tags=["Internal"])
 def update_order_status_from_kitchen(order_id: str, req: StatusUpdateRequest, db: Session = Depends(get_db)):
     """Endpoint internal untuk menerima update status dari kitchen_service."""
@@ -1680,6 +2162,16 @@ def update_order_status_from_kitchen(order_id: str, req: StatusUpdateRequest, db
     logging.info(f"Status untuk order {order_id} diupdate menjadi '{new_status}' dari kitchen.")
     return {"status": "updated"}
 
+@app.get("/internal/kitchen_status", tags=["Internal"])
+def get_kitchen_status_replica():
+    """Kondisi replika status dapur lokal (untuk debugging)."""
+    return kitchen_status.stats()
+
+@app.get("/internal/menu_catalog", tags=["Internal"])
+def get_menu_catalog_replica():
+    """Kondisi replika katalog menu lokal (untuk debugging)."""
+    return menu_catalog.stats()
+
 @app.get("/order_status/{order_id}", summary="Status pesanan", tags=["Order"], operation_id="order status")
 def get_order_status(order_id: str, db: Session = Depends(get_db)):
     """Mengambil status terkini dari pesanan tertentu."""
@@ -1776,24 +2268,9 @@ def estimate_order_time(order_id: str, db: Session = Depends(get_db)):
     if not target:
         return JSONResponse(status_code=200, content={"status": "error", "message": "Order not found", "data": None})
 
-    # Ambil peta waktu pembuatan dari menu_service
+    # Peta waktu pembuatan dari replika katalog menu
     try:
-        resp = requests.get(f"{MENU_SERVICE_URL}/menu", timeout=5)
-        resp.raise_for_status()
-        menus = resp.json() or []
-        time_map = {}
-        for m in menus:
-            making_time = float(m.get("making_time_minutes", 0) or 0)
-            # Menggunakan field dwi bahasa baru
-            if m.get("base_name_en"):
-                time_map[m.get("base_name_en")] = making_time
-            if m.get("base_name_id"):
-                time_map[m.get("base_name_id")] = making_time
-            # Fallback untuk compatibility dengan nama lama
-            if m.get("base_name"):
-                time_map[m.get("base_name")] = making_time
-            if m.get("menu_name"):
-                time_map[m.get("menu_name").strip()] = making_time
+        time_map = menu_catalog.current()["making_times"]
     except Exception as e:
         logging.error(f"Error fetching menus for estimation: {e}")
         time_map = {}
@@ -1852,13 +2329,18 @@ def estimate_order_time(order_id: str, db: Session = Depends(get_db)):
     )
 
 @app.get("/today_orders", summary="Pesanan hari ini", tags=["Order"])
-def get_today_orders(db: Session = Depends(get_db)):
+def get_today_orders(request: Request, response: Response, db: Session = Depends(get_db)):
     """Mengembalikan pesanan hari ini saja."""
     today_jakarta = datetime.now(jakarta_tz).date()
-
     start_of_day = datetime.combine(today_jakarta, datetime.min.time()).replace(tzinfo=jakarta_tz)
     end_of_day = datetime.combine(today_jakarta, datetime.max.time()).replace(tzinfo=jakarta_tz)
 
+    # Tanggal ikut di ETag karena isi response berganti saat pergantian hari
+    etag = orders_etag(db, f"today-orders-{today_jakarta.isoformat()}", start_of_day, end_of_day)
+    not_modified = conditional_response(request, response, etag)
+    if not_modified:
+        return not_modified
+
     today_orders = db.query(Order).filter(
         and_(
             Order.created_at >= start_of_day,
@@ -1872,28 +2354,8 @@ def get_today_orders(db: Session = Depends(get_db)):
         "total_orders": len(today_orders)
     }
 
-@app.get("/order/status/{queue_number}", summary="Get order status by queue number", tags=["Order"])
-def get_order_status(queue_number: int, db: Session = Depends(get_db)):
-    """Mengambil status pesanan berdasarkan nomor antrian untuk HARI INI (Asia/Jakarta)."""
-    # Batasi pencarian ke hari ini sesuai logika dashboard (queue reset per hari)
-    today_jakarta = datetime.now(jakarta_tz).date()
-    start_of_day = datetime.combine(today_jakarta, datetime.min.time()).replace(tzinfo=jakarta_tz)
-    end_of_day = datetime.combine(today_jakarta, datetime.max.time()).replace(tzinfo=jakarta_tz)
-
-    order = db.query(Order).filter(
-        and_(
-            Order.queue_number == queue_number,
-            Order.created_at >= start_of_day,
-            Order.created_at <= end_of_day
-        )
-    ).first()
-
-    if not order:
-        raise HTTPException(status_code=404, detail=f"Pesanan dengan nomor antrian {queue_number} tidak ditemukan untuk hari ini")
-
-    # Get order items
-    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.order_id).all()
-
+def build_order_status(order: Order, order_items: List[OrderItem], cancel_event_time) -> dict:
+    """Bentuk response status order; cancel_event_time(order_id) dipanggil hanya bila perlu."""
     # Pisahkan item aktif dan yang dibatalkan serta kumpulkan waktu batal
     active_items = []
     cancelled_items = []
@@ -1924,12 +2386,9 @@ def get_order_status(queue_number: int, db: Session = Depends(get_db)):
             time_cancelled_val = max(cancel_times).isoformat()
         else:
             try:
-                evt = db.query(OrderOutbox).filter(
-                    OrderOutbox.order_id == order.order_id,
-                    OrderOutbox.event_type == "order_cancelled"
-                ).order_by(OrderOutbox.created_at.desc()).first()
-                if evt and evt.created_at:
-                    time_cancelled_val = evt.created_at.isoformat()
+                cancelled_at = cancel_event_time(order.order_id)
+                if cancelled_at:
+                    time_cancelled_val = cancelled_at.isoformat()
             except Exception:
                 time_cancelled_val = None
 
@@ -1950,6 +2409,83 @@ def get_order_status(queue_number: int, db: Session = Depends(get_db)):
         "time_cancelled": time_cancelled_val
     }
 
+@app.get("/order/status/{queue_number}", summary="Get order status by queue number", tags=["Order"])
+def get_order_status(queue_number: int, db: Session = Depends(get_db)):
+    """Mengambil status pesanan berdasarkan nomor antrian untuk HARI INI (Asia/Jakarta)."""
+    # Batasi pencarian ke hari ini sesuai logika dashboard (queue reset per hari)
+    today_jakarta = datetime.now(jakarta_tz).date()
+    start_of_day = datetime.combine(today_jakarta, datetime.min.time()).replace(tzinfo=jakarta_tz)
+    end_of_day = datetime.combine(today_jakarta, datetime.max.time()).replace(tzinfo=jakarta_tz)
+
+    order = db.query(Order).filter(
+        and_(
+            Order.queue_number == queue_number,
+            Order.created_at >= start_of_day,
+            Order.created_at <= end_of_day
+        )
+    ).first()
+
+    if not order:
+        raise HTTPException(status_code=404, detail=f"Pesanan dengan nomor antrian {queue_number} tidak ditemukan untuk hari ini")
+
+    order_items = db.query(OrderItem).filter(OrderItem.order_id == order.order_id).all()
+
+    def cancel_event_time(order_id: str):
+        evt = db.query(OrderOutbox).filter(
+            OrderOutbox.order_id == order_id,
+            OrderOutbox.event_type == "order_cancelled"
+        ).order_by(OrderOutbox.created_at.desc()).first()
+        return evt.created_at if evt else None
+
+    return build_order_status(order, order_items, cancel_event_time)
+
+@app.post("/order/status/bulk", summary="Status banyak pesanan sekaligus", tags=["Order"])
+def get_order_status_bulk(req: BulkOrderStatusRequest, db: Session = Depends(get_db)):
+    """Status + item aktif/batal untuk banyak order dalam satu request (dipakai board kitchen)."""
+    order_ids = set(req.order_ids)
+    queue_numbers = set(req.queue_numbers)
+    if not order_ids and not queue_numbers:
+        return {"orders": {}}
+
+    conditions = []
+    if order_ids:
+        conditions.append(Order.order_id.in_(order_ids))
+    if queue_numbers:
+        # Nomor antrian reset per hari, jadi lookup by queue_number hanya untuk hari ini
+        today_jakarta = datetime.now(jakarta_tz).date()
+        start_of_day = datetime.combine(today_jakarta, datetime.min.time()).replace(tzinfo=jakarta_tz)
+        end_of_day = datetime.combine(today_jakarta, datetime.max.time()).replace(tzinfo=jakarta_tz)
+        conditions.append(and_(
+            Order.queue_number.in_(queue_numbers),
+            Order.created_at >= start_of_day,
+            Order.created_at <= end_of_day
+        ))
+    orders = db.query(Order).filter(or_(*conditions)).all()
+    if not orders:
+        return {"orders": {}}
+
+    found_ids = [o.order_id for o in orders]
+    items_by_order = {}
+    for item in db.query(OrderItem).filter(OrderItem.order_id.in_(found_ids)).order_by(OrderItem.id).all():
+        items_by_order.setdefault(item.order_id, []).append(item)
+
+    # Waktu batal dari outbox cukup diambil sekali untuk semua order yang dibatalkan
+    cancelled_ids = [o.order_id for o in orders if (o.status or "").lower() in ["cancelled", "habis"]]
+    cancel_events = {}
+    if cancelled_ids:
+        rows = db.query(OrderOutbox.order_id, func.max(OrderOutbox.created_at)).filter(
+            OrderOutbox.order_id.in_(cancelled_ids),
+            OrderOutbox.event_type == "order_cancelled"
+        ).group_by(OrderOutbox.order_id).all()
+        cancel_events = dict(rows)
+
+    return {
+        "orders": {
+            o.order_id: build_order_status(o, items_by_order.get(o.order_id, []), cancel_events.get)
+            for o in orders
+        }
+    }
+
 @app.get("/health", summary="Health check", tags=["Utility"])
 def health_check():
     """Cek status hidup service."""